@@ -2,24 +2,93 @@ import gradio as gr
 import sys
 import os
 
-# Add current directory to path
+# Add current directory and the backend package to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import inference
+from advice import generate_crop_advice, generate_disease_advice
+from image_io import InvalidImage, load_rgb, open_image
+from leaf_filter import is_probable_leaf
+
+# Requests waiting in the queue are grouped into batches of up to this size and
+# share one forward pass; each event runs at most this many batches at a time
+MAX_BATCH_SIZE = int(os.getenv("GRADIO_MAX_BATCH_SIZE", "16"))
+CONCURRENCY_LIMIT = int(os.getenv("GRADIO_CONCURRENCY_LIMIT", "2"))
+MAX_QUEUE_SIZE = int(os.getenv("GRADIO_MAX_QUEUE_SIZE", "200"))
+
+NOT_A_LEAF_MESSAGE = ("The uploaded image does not appear to be a valid plant leaf image. "
+                      "Please upload a clear image of a plant leaf (Tomato, Potato, or Pepper).")
+
+inference.load_models()
+
+
+class _SoilParameters:
+    """Attribute view of the slider values for generate_crop_advice()."""
+
+    def __init__(self, N, P, K, ph):
+        self.N, self.P, self.K, self.ph = N, P, K, ph
+
+
+def _load_image(path):
+    if not path:
+        raise InvalidImage("No image uploaded")
+    with open(path, "rb") as f:
+        contents = f.read()
+    return load_rgb(open_image(contents), target_size=inference.disease_input_size[::-1])
+
+
+def predict_disease(images):
+    """Batched handler: classify every queued image in one forward pass."""
+    if inference.disease_model is None:
+        return [["Disease detection model is not available."] * len(images)]
+
+    results = [None] * len(images)
+    decoded, positions = [], []
+    for i, path in enumerate(images):
+        try:
+            img = _load_image(path)
+        except (InvalidImage, OSError):
+            results[i] = "Invalid image file. Please upload a valid image."
+            continue
+        # Obvious non-leaf images never reach the model
+        if not is_probable_leaf(img):
+            results[i] = NOT_A_LEAF_MESSAGE
+            continue
+        decoded.append(img)
+        positions.append(i)
+
+    if decoded:
+        for i, prediction in zip(positions, inference.predict_disease(decoded)):
+            if not inference.is_valid_plant_image(prediction["confidence"]):
+                results[i] = NOT_A_LEAF_MESSAGE
+                continue
+
+            info = inference.parse_disease_class(prediction["class_name"])
+            results[i] = (
+                f"Crop: {info['crop']}\n"
+                f"Status: {info['disease']}\n"
+                f"Confidence: {prediction['confidence'] * 100:.1f}%\n\n"
+                + generate_disease_advice(info["crop"], info["disease"], info["is_healthy"])
+            )
+
+    return [results]
 
-# Simple demo interface for AgriMindAI
-def predict_disease(image):
-    """Placeholder for disease detection"""
-    return "Upload an image of a plant leaf to detect diseases. (Backend integration needed)"
 
 def recommend_crop(nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall):
-    """Placeholder for crop recommendation"""
-    return f"""
-    Based on your input:
-    - N: {nitrogen}, P: {phosphorus}, K: {potassium}
-    - Temperature: {temperature}°C, Humidity: {humidity}%
-    - pH: {ph}, Rainfall: {rainfall}mm
-    
-    Recommended Crop: Rice (ML model will be integrated)
-    """
+    """Batched handler: each argument is a list with one value per queued request."""
+    if inference.crop_model is None:
+        return [["Crop recommendation model is not available."] * len(nitrogen)]
+
+    rows = list(zip(nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall))
+    results = []
+    for row, (crop, confidence) in zip(rows, inference.predict_crop(rows)):
+        n, p, k, _, _, row_ph, _ = row
+        results.append(
+            f"Recommended Crop: {crop} ({confidence * 100:.1f}% confidence)\n\n"
+            + generate_crop_advice(crop, _SoilParameters(n, p, k, row_ph))
+        )
+    return [results]
 
 # Create Gradio interface
 with gr.Blocks(title="AgriMindAI - Smart Farming Assistant") as demo:
@@ -28,7 +97,7 @@ with gr.Blocks(title="AgriMindAI - Smart Farming Assistant") as demo:
     
     AI-powered platform for crop recommendation and plant disease detection.
     
-    **Note:** This is a demo interface. Full functionality requires backend integration.
+    Predictions are served by the same models as the AgriMind.AI API.
     """)
     
     with gr.Tab("🔍 Disease Detection"):
@@ -43,7 +112,10 @@ with gr.Blocks(title="AgriMindAI - Smart Farming Assistant") as demo:
         disease_btn.click(
             fn=predict_disease,
             inputs=disease_image,
-            outputs=disease_output
+            outputs=disease_output,
+            batch=True,
+            max_batch_size=MAX_BATCH_SIZE,
+            concurrency_limit=CONCURRENCY_LIMIT
         )
     
     with gr.Tab("🌾 Crop Recommendation"):
@@ -65,7 +137,10 @@ with gr.Blocks(title="AgriMindAI - Smart Farming Assistant") as demo:
         crop_btn.click(
             fn=recommend_crop,
             inputs=[nitrogen, phosphorus, potassium, temperature, humidity, ph, rainfall],
-            outputs=crop_output
+            outputs=crop_output,
+            batch=True,
+            max_batch_size=MAX_BATCH_SIZE,
+            concurrency_limit=CONCURRENCY_LIMIT
         )
     
     with gr.Tab("📊 About"):
@@ -89,9 +164,10 @@ with gr.Blocks(title="AgriMindAI - Smart Farming Assistant") as demo:
         ### GitHub Repository:
         [https://github.com/abhiyeduru/agrimind](https://github.com/abhiyeduru/agrimind)
         
-        ---
-        **Note:** This demo version shows the UI. Full ML models require backend deployment.
         """)
 
+# Queue requests so bursts are batched instead of overwhelming the models
+demo.queue(max_size=MAX_QUEUE_SIZE, default_concurrency_limit=CONCURRENCY_LIMIT)
+
 if __name__ == "__main__":
     demo.launch()
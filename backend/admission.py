@@ -0,0 +1,275 @@
+"""
+Admission control for the expensive endpoints.
+
+Each limited endpoint runs at most `max_in_flight` requests at a time. Further
+requests wait in a queue per tenant (user), and freed slots go to the tenants
+in turn (round-robin), so one client sending a burst only delays its own
+requests. A request that can't start within the queue-wait target, or that
+arrives while the queue is already that far behind or full, is rejected at
+once with 503 and a Retry-After estimate instead of piling up.
+
+The user is the X-User-Id header, else the user_id query parameter. Clients
+choose those freely, so a client could otherwise send a new ID with every
+request to get a fresh queue each time and fill the shared one. The tenant
+is therefore the client address plus the user ID, and one address may have
+at most ADMISSION_MAX_TENANTS_PER_ADDRESS users queued at once. Addresses in
+ADMISSION_TRUSTED_CLIENTS (the Streamlit frontend, a reverse proxy) relay
+many users, so their user IDs are taken as is and not capped. Limits are
+per server process.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+import deadlines
+import tracing
+
+logger = logging.getLogger(__name__)
+
+ADMISSION_QUEUE_WAIT_TARGET = float(os.getenv("ADMISSION_QUEUE_WAIT_TARGET", "2"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+ADMISSION_MAX_QUEUE_PER_TENANT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_TENANT", "10"))
+# With ten queued requests per tenant, four users from one address can take
+# at most 40 of the 100 queue places
+ADMISSION_MAX_TENANTS_PER_ADDRESS = int(os.getenv("ADMISSION_MAX_TENANTS_PER_ADDRESS", "4"))
+ADMISSION_TRUSTED_CLIENTS = {
+    address.strip() for address in os.getenv("ADMISSION_TRUSTED_CLIENTS", "127.0.0.1,::1").split(",")
+    if address.strip()
+}
+
+# Concurrent requests per endpoint and process
+ENDPOINT_LIMITS = {
+    "/recommend_crop": int(os.getenv("RECOMMEND_CROP_MAX_IN_FLIGHT", "16")),
+    "/detect_disease": int(os.getenv("DETECT_DISEASE_MAX_IN_FLIGHT", "4")),
+    "/detect_disease/tiled": int(os.getenv("DETECT_DISEASE_TILED_MAX_IN_FLIGHT", "2")),
+    "/detect_disease/video": int(os.getenv("DETECT_DISEASE_VIDEO_MAX_IN_FLIGHT", "1")),
+    "/chat": int(os.getenv("CHAT_MAX_IN_FLIGHT", "8")),
+}
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed; retry_after is in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, tenant: str, address: Optional[str]):
+        self.tenant = tenant
+        self.address = address
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    """Bounded concurrency with fair per-tenant queueing for one endpoint."""
+
+    def __init__(self, name: str, max_in_flight: int,
+                 queue_wait_target: float = ADMISSION_QUEUE_WAIT_TARGET,
+                 max_queue: int = ADMISSION_MAX_QUEUE,
+                 max_queue_per_tenant: int = ADMISSION_MAX_QUEUE_PER_TENANT,
+                 max_tenants_per_address: int = ADMISSION_MAX_TENANTS_PER_ADDRESS):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.queue_wait_target = queue_wait_target
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.max_tenants_per_address = max_tenants_per_address
+
+        self._in_flight = 0
+        self._queued = 0
+        self._queues = OrderedDict()  # tenant -> deque of waiters, in round-robin order
+        self._service_time = 1.0  # Moving average, for Retry-After estimates
+        self._counts = {"admitted": 0, "waited": 0, "shed": 0}
+
+    async def acquire(self, tenant: str, address: Optional[str] = None):
+        """
+        Wait for a slot; raises Overloaded if the request should be shed.
+        `address` is the client whose number of queued tenants is capped, or
+        None for a trusted client.
+        """
+        if self._in_flight < self.max_in_flight and not self._queued:
+            self._admit()
+            return
+
+        if self._queued >= self.max_queue:
+            self._shed("queue full", tenant)
+        if len(self._queues.get(tenant, ())) >= self.max_queue_per_tenant:
+            self._shed(f"tenant {tenant} has too many queued requests", tenant)
+        if (address is not None and tenant not in self._queues
+                and self._tenants_from(address) >= self.max_tenants_per_address):
+            self._shed(f"client {address} has too many queued users", tenant)
+        # Fail fast if the request would not get a slot in time anyway
+        if self._expected_wait(tenant) > self.queue_wait_target:
+            self._shed("queue wait above target", tenant)
+
+        # Don't wait for a slot past the request deadline either
+        max_wait = self.queue_wait_target
+        remaining = deadlines.remaining()
+        if remaining is not None:
+            max_wait = min(max_wait, remaining)
+
+        waiter = _Waiter(tenant, address)
+        self._queues.setdefault(tenant, deque()).append(waiter)
+        self._queued += 1
+        self._counts["waited"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done():
+                # The slot was handed over just as we gave up; pass it on
+                self.release(0.0)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._shed("queue wait above target", tenant)
+
+    def release(self, service_time: float):
+        self._in_flight -= 1
+        if service_time:
+            self._service_time = 0.9 * self._service_time + 0.1 * service_time
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self._queued,
+            "queued_tenants": len(self._queues),
+            "oldest_wait_seconds": self._oldest_wait(),
+            "mean_service_seconds": self._service_time,
+            **self._counts
+        }
+
+    def _admit(self):
+        self._in_flight += 1
+        self._counts["admitted"] += 1
+
+    def _shed(self, reason: str, tenant: str):
+        self._counts["shed"] += 1
+        raise Overloaded(reason, max(1, math.ceil(self._expected_wait(tenant))))
+
+    def _dispatch(self):
+        """Hand free slots to queued requests, one tenant at a time."""
+        while self._in_flight < self.max_in_flight and self._queues:
+            tenant, queue = self._queues.popitem(last=False)
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # The tenant goes to the back of the rotation
+                self._queues[tenant] = queue
+            self._admit()
+            waiter.future.set_result(None)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.tenant)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.tenant]
+
+    def _tenants_from(self, address: str) -> int:
+        """Queued tenants whose requests came from a client address."""
+        return sum(1 for queue in self._queues.values() if queue[0].address == address)
+
+    def _expected_wait(self, tenant: str) -> float:
+        """
+        Estimated wait for a tenant's request joining the queue now. With
+        round-robin dispatch, each other tenant gets at most as many turns
+        before it as the tenant already has queued, plus one.
+        """
+        turns = len(self._queues.get(tenant, ())) + 1
+        ahead = sum(min(len(queue), turns) for other, queue in self._queues.items() if other != tenant)
+        return self._service_time * (ahead + turns) / max(1, self.max_in_flight)
+
+    def _oldest_wait(self) -> float:
+        if not self._queues:
+            return 0.0
+        now = time.monotonic()
+        return max(now - queue[0].enqueued_at for queue in self._queues.values())
+
+
+def tenant_for(scope, trusted_clients=ADMISSION_TRUSTED_CLIENTS) -> Tuple[str, Optional[str]]:
+    """
+    The tenant a request queues as and the client address whose tenants are
+    capped: the address plus the X-User-Id header or user_id query parameter,
+    or for a trusted client the user ID alone and no address.
+    """
+    client = scope.get("client")
+    address = client[0] if client else "unknown"
+    user_id = None
+    for name, value in scope.get("headers", []):
+        if name == b"x-user-id" and value:
+            user_id = value.decode("latin-1")
+            break
+    if user_id is None:
+        user_ids = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("user_id")
+        user_id = user_ids[0] if user_ids and user_ids[0] else None
+
+    if address in trusted_clients:
+        return user_id or address, None
+    return f"{address}/{user_id}" if user_id else address, address
+
+
+def create_controllers(limits: Optional[Dict[str, int]] = None) -> Dict[str, AdmissionController]:
+    """One controller per endpoint path; a limit of 0 leaves the endpoint unlimited."""
+    limits = ENDPOINT_LIMITS if limits is None else limits
+    return {
+        path: AdmissionController(path, max_in_flight)
+        for path, max_in_flight in limits.items() if max_in_flight > 0
+    }
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to each limited endpoint."""
+
+    def __init__(self, app, controllers: Dict[str, AdmissionController]):
+        self.app = app
+        self.controllers = controllers
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controllers.get(scope.get("path")) if scope["type"] == "http" else None
+        if controller is None:
+            await self.app(scope, receive, send)
+            return
+
+        tenant, address = tenant_for(scope)
+        try:
+            with tracing.span("admission.wait", tenant=tenant):
+                await controller.acquire(tenant, address)
+        except Overloaded as e:
+            logger.warning(f"Shed {scope['path']} request from {tenant}: {e}")
+            await _send_overloaded(send, e.retry_after)
+            return
+
+        start = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.release(time.monotonic() - start)
+
+
+async def _send_overloaded(send, retry_after: int):
+    body = json.dumps({"detail": "Server is busy. Please try again shortly."}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,68 @@
+"""
+Rule-based farming advice.
+
+These templates need no model or network access and return in microseconds,
+so they are used wherever an LLM answer would be too slow or unavailable.
+"""
+
+
+def generate_crop_advice(crop: str, data) -> str:
+    """
+    Generate customized farming advice based on the crop and soil parameters.
+    `data` is any object with N, P, K and ph attributes (e.g. CropData).
+    """
+
+    advice = f"Based on your soil parameters, {crop} is recommended.\n\n"
+
+    # NPK advice
+    if data.N < 50:
+        advice += "- Nitrogen (N) is low. Consider adding nitrogen-rich fertilizers.\n"
+    elif data.N > 100:
+        advice += "- Nitrogen (N) is high. Reduce nitrogen fertilization.\n"
+
+    if data.P < 30:
+        advice += "- Phosphorus (P) is low. Add phosphate fertilizers.\n"
+    elif data.P > 100:
+        advice += "- Phosphorus (P) is high. Reduce phosphate application.\n"
+
+    if data.K < 30:
+        advice += "- Potassium (K) is low. Add potash fertilizers.\n"
+    elif data.K > 100:
+        advice += "- Potassium (K) is high. Reduce potassium application.\n"
+
+    # pH advice
+    if data.ph < 6.0:
+        advice += "- Soil is acidic. Consider adding lime to raise pH.\n"
+    elif data.ph > 8.0:
+        advice += "- Soil is alkaline. Consider adding sulfur to lower pH.\n"
+
+    # General care advice
+    advice += f"\nGeneral care for {crop}:\n"
+    advice += "1. Prepare the soil well before planting\n"
+    advice += "2. Maintain proper spacing between plants\n"
+    advice += "3. Monitor for pests and diseases regularly\n"
+    advice += f"4. Maintain soil moisture appropriate for {crop}\n"
+
+    return advice
+
+
+def generate_disease_advice(crop_name: str, disease_name: str, is_healthy: bool) -> str:
+    """Generate general treatment or maintenance advice for a detection result."""
+    if is_healthy:
+        advice = f"✅ Your {crop_name} plant appears healthy!\n\n"
+        advice += "Maintenance tips:\n"
+        advice += "1. Continue regular watering schedule\n"
+        advice += "2. Ensure adequate sunlight (6-8 hours daily)\n"
+        advice += "3. Monitor for early signs of pests or disease\n"
+        advice += "4. Maintain good air circulation\n"
+        advice += "5. Apply balanced fertilizer as needed"
+    else:
+        advice = f"⚠️ {disease_name} detected in {crop_name}\n\n"
+        advice += "Treatment recommendations:\n"
+        advice += "1. Remove and destroy affected leaves\n"
+        advice += "2. Apply appropriate fungicide or treatment\n"
+        advice += "3. Improve air circulation around plants\n"
+        advice += "4. Avoid overhead watering\n"
+        advice += "5. Monitor other plants for spread\n\n"
+        advice += "Consult a local agricultural expert for specific treatment options."
+    return advice
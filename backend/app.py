@@ -1,22 +1,68 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import Depends, FastAPI, UploadFile, File, Header, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-import joblib
-import tensorflow as tf
-import numpy as np
-from PIL import Image
-import io
 import os
 import time
 import requests
 import warnings
 import logging
-from firebase_admin import credentials, firestore, initialize_app
 from dotenv import load_dotenv
+import hmac
 import json
+import shutil
+import tempfile
 from pathlib import Path
-from typing import Optional, Union
-from transformers import pipeline
+from typing import Iterable, Iterator, List, Optional, Tuple
+import inference
+from advice import generate_crop_advice, generate_disease_advice
+from admission import AdmissionMiddleware, create_controllers
+from callbacks import InvalidCallbackUrl, validate_callback_url
+from circuit_breaker import CircuitBreaker
+import deadlines
+import tracing
+from deadlines import DeadlineMiddleware
+from enrichment import EnrichmentStore
+from jobs import JobError, JobQueue, QueueFull
+from leaf_filter import is_probable_leaf
+from model_manager import ARTIFACTS, ModelManager, validate_disease_model
+from profiling import ProfileBusy, Profiler, ProfilingMiddleware
+from residency import MODEL_LAZY_LOAD, ModelUnavailable, ResidencyManager
+from knowledge_base import KnowledgeBase, format_context
+from semantic_cache import CHAT_CACHE_SIZE, SemanticCache, create_embedder
+from similar_fields import SIMILAR_FIELDS_K, SimilarFieldsIndex
+from tiled_scan import (
+    MAX_TILED_UPLOAD_BYTES,
+    TILE_OVERLAP,
+    TILE_SIZE,
+    NotReducible,
+    TooManyTiles,
+    analyze_tiles,
+)
+from video_scan import (
+    MAX_VIDEO_UPLOAD_BYTES,
+    VIDEO_MAX_FRAMES,
+    VIDEO_SAMPLE_FPS,
+    InvalidVideo,
+    decode_image_frames,
+    probe_video,
+    sample_video_frames,
+    scan_frames,
+    video_support,
+)
+from image_io import (
+    MAX_IMAGE_PIXELS,
+    MAX_TILED_IMAGE_PIXELS,
+    MAX_UPLOAD_BYTES,
+    InvalidImage,
+    UploadLimitMiddleware,
+    UploadTooLarge,
+    load_rgb,
+    open_image,
+    read_upload,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,32 +74,167 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 # Load environment variables
 load_dotenv()
 
-# Initialize Firebase with error handling
-try:
-    cred = credentials.Certificate("firebase-config.json")
-    initialize_app(cred)
-    db = firestore.client()
-    logger.info("Firebase initialized successfully")
-except Exception as e:
-    logger.error(f"Firebase initialization failed: {e}")
+# Initialize Firebase with error handling. firebase_admin pulls in gRPC and
+# the Cloud SDK, so it is only imported when credentials are present.
+db = None
+firestore = None
+if Path("firebase-config.json").exists():
+    try:
+        from firebase_admin import credentials, firestore, initialize_app
+        cred = credentials.Certificate("firebase-config.json")
+        initialize_app(cred)
+        db = firestore.client()
+        logger.info("Firebase initialized successfully")
+    except Exception as e:
+        logger.error(f"Firebase initialization failed: {e}")
+        db = None
+if db is None:
     logger.info("Running without Firebase integration")
-    db = None
 
 # Initialize Hugging Face
 HUGGINGFACE_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
 HF_API_URL = "https://api-inference.huggingface.co/models/google/flan-t5-xxl"
 headers = {"Authorization": f"Bearer {HUGGINGFACE_API_KEY}"}
+# Shared across requests so a degraded API fails fast for everyone
+hf_breaker = CircuitBreaker("huggingface")
+
+def load_crop_model():
+    inference.crop_model = inference.read_crop_model()
+    return inference.crop_model
+
+def load_disease_model():
+    # TensorFlow is first imported here, in the process that serves the model
+    # (never in the gunicorn master), with this process's thread limits
+    inference.configure_threads()
+    version = inference.read_disease_model()
+    inference.install_disease_model(version)
+    logger.info(f"Disease detection model loaded with {len(version.class_names)} classes, "
+                f"input size {version.input_size}")
+    return version
 
-# Initialize text generation pipeline for fallback
+def unload_disease_model(version):
+    if inference.disease is version:
+        inference.install_disease_model(None)
+
+def load_local_generator():
+    # torch and transformers are only imported here, and not at all in the crop profile
+    from local_generator import LocalGenerator
+    inference.configure_threads()
+    return LocalGenerator()
+
+# Loads models on demand and evicts idle ones to stay within
+# MODEL_MEMORY_BUDGET_MB (idle eviction thread started on startup). The crop
+# model is small and always resident.
+model_residency = ResidencyManager()
+model_residency.register(
+    "crop", load_crop_model, lambda model: setattr(inference, "crop_model", None), pinned=True,
+    can_load=lambda: all((inference.MODEL_DIR / name).exists() for name in ARTIFACTS["crop"])
+)
+if inference.CROP_ONLY:
+    logger.info("Crop-only serving profile: disease model and local text generation disabled")
+else:
+    model_residency.register(
+        "disease", load_disease_model, unload_disease_model, warmup=validate_disease_model,
+        can_load=lambda: all((inference.MODEL_DIR / name).exists() for name in ARTIFACTS["disease"])
+    )
+    model_residency.register("local_generator", load_local_generator, lambda generator: generator.close())
+
+model_residency.preload("crop")
+if not inference.CROP_ONLY:
+    if MODEL_LAZY_LOAD:
+        logger.info("Disease model and local text generation load on first use")
+    else:
+        model_residency.preload("disease")
+        if model_residency.preload("local_generator"):
+            logger.info("Local text generation model loaded successfully")
+
+# Swaps in retrained artifacts without a restart (watcher started on startup)
+model_manager = ModelManager(residency=model_residency)
+
+# Historical records returned as evidence with crop recommendations: the
+# training dataset plus recommendations stored in Firestore, at most
+# SIMILAR_FIELDS_MAX_STORED of them (loaded at startup or saved since)
+SIMILAR_FIELDS_MAX_STORED = int(os.getenv("SIMILAR_FIELDS_MAX_STORED", "20000"))
 try:
-    generator = pipeline('text-generation', model='gpt2')
-    logger.info("Local text generation model loaded successfully")
+    similar_fields = SimilarFieldsIndex.from_csv(max_stored=SIMILAR_FIELDS_MAX_STORED)
+    logger.info(f"Similar fields index built with {len(similar_fields)} dataset records")
 except Exception as e:
-    logger.warning(f"Could not load local text generation model: {e}")
-    generator = None
+    logger.warning(f"Could not build similar fields index: {e}")
+    similar_fields = None
+
+if similar_fields is not None and db:
+    try:
+        rows, labels, owners = [], [], []
+        stored = db.collection_group("recommendations").limit(SIMILAR_FIELDS_MAX_STORED).stream()
+        for doc in stored:
+            record = doc.to_dict()
+            soil = record.get("soil_data") or {}
+            if all(name in soil for name in inference.CROP_FEATURES):
+                rows.append([float(soil[name]) for name in inference.CROP_FEATURES])
+                # Older records only have the (possibly translated) display name
+                labels.append(record.get("crop_label") or record.get("crop"))
+                # farmers/{user_id}/recommendations/{id}
+                owners.append(doc.reference.parent.parent.id)
+        added = similar_fields.extend(rows, labels, ["recommendation"] * len(rows), owners) if rows else 0
+        logger.info(f"Added {added} stored recommendations to the similar fields index")
+    except Exception as e:
+        logger.warning(f"Could not load stored recommendations: {e}")
+
+# Admin endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Local generation limits for the fallback model
+LOCAL_LM_MAX_NEW_TOKENS = int(os.getenv("LOCAL_LM_MAX_NEW_TOKENS", "120"))
+LOCAL_LM_TIMEOUT = float(os.getenv("LOCAL_LM_TIMEOUT", "20"))
+
+# Answers repeated (or reworded) chat questions without calling the LLM. The
+# crop profile has no torch, so it embeds questions with hashed n-grams.
+# Created on startup: the MiniLM embedder imports torch, which like TensorFlow
+# must not be loaded in the gunicorn master before the workers are forked.
+chat_cache = None
+
+def create_chat_cache():
+    global chat_cache
+    if CHAT_CACHE_SIZE > 0 and chat_cache is None:
+        chat_cache = SemanticCache(create_embedder(allow_transformers=not inference.CROP_ONLY))
+        logger.info(f"Chat cache enabled with {chat_cache.embedder.name} embeddings")
+
+# Curated agronomy passages that /chat answers from directly or passes to the LLM
+try:
+    knowledge = KnowledgeBase.load_or_build()
+    logger.info(f"Knowledge base loaded with {len(knowledge)} passages")
+except Exception as e:
+    logger.warning(f"Could not load knowledge base: {e}")
+    knowledge = None
+
+# "hybrid" answers with rule-based advice immediately and generates LLM advice
+# in the background; "sync" waits for the LLM advice before answering
+ADVICE_MODE = os.getenv("ADVICE_MODE", "hybrid").lower()
+enrichments = EnrichmentStore()
 
 app = FastAPI(title="AgriMind.AI API")
 
+# Bound concurrent work per endpoint, queue the rest fairly per user and shed
+# with 503 + Retry-After when the queue falls behind. Innermost, so requests
+# rejected for size never take a slot and queue time counts against the deadline.
+admission = create_controllers()
+app.add_middleware(AdmissionMiddleware, controllers=admission)
+
+# Reject oversized uploads while they stream in, before they are spooled.
+# Added before CORS so that CORS wraps every response these middlewares send.
+app.add_middleware(
+    UploadLimitMiddleware,
+    max_bytes=MAX_UPLOAD_BYTES,
+    path_limits={
+        "/detect_disease/video": MAX_VIDEO_UPLOAD_BYTES,
+        "/detect_disease/tiled": MAX_TILED_UPLOAD_BYTES
+    }
+)
+
+# Give each request a time budget (per endpoint, or X-Request-Timeout-Ms);
+# stages check what is left and skip optional work that no longer fits
+app.add_middleware(DeadlineMiddleware)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -61,34 +242,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
-# Load ML models with better error handling
-MODEL_DIR = Path("models")
-crop_model = None  # Will be loaded as RandomForestClassifier
-disease_model = None  # Will be loaded as tf.keras.Model
-disease_class_names = {}  # Will store disease class names (dict mapping class_id -> class_name)
-
-try:
-    crop_model = joblib.load(MODEL_DIR / "crop_rf.joblib")
-    logger.info("Crop recommendation model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading crop model: {e}")
+# Sampling profiler sessions started from /admin/profile; counts requests so a
+# session can stop after the next N
+profiler = Profiler()
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
 
-try:
-    # Enable mixed precision for better performance on Apple Silicon
-    policy = tf.keras.mixed_precision.Policy('mixed_float16')
-    tf.keras.mixed_precision.set_global_policy(policy)
-    disease_model = tf.keras.models.load_model(MODEL_DIR / "disease_mobilenet.h5")
-    logger.info("Disease detection model loaded successfully")
-    
-    # Load class indices
-    class_indices = joblib.load(MODEL_DIR / "disease_classes.joblib")
-    # Reverse the dictionary to get class_id -> class_name mapping
-    disease_class_names = {v: k for k, v in class_indices.items()}
-    logger.info(f"Loaded {len(disease_class_names)} disease classes")
-except Exception as e:
-    logger.error(f"Error loading disease model: {e}")
+# Outermost: trace every request, including time spent queued for admission,
+# and return its ID in X-Trace-Id
+app.add_middleware(tracing.TracingMiddleware)
 
 class CropData(BaseModel):
     N: float
@@ -100,19 +264,72 @@ class CropData(BaseModel):
     rainfall: float
     user_id: str
     language: str = "en"
+    advice_mode: Optional[str] = None  # "hybrid" or "sync", defaults to ADVICE_MODE
+    similar_k: Optional[int] = None  # Similar historical fields to return, defaults to SIMILAR_FIELDS_K
+    callback_url: Optional[str] = None  # Receives the enriched advice in hybrid mode
 
 class ChatRequest(BaseModel):
     message: str
     user_id: str
     language: str = "en"
 
+def check_deadline():
+    """Give up before the model runs if the request is already out of time."""
+    if deadlines.expired():
+        raise HTTPException(status_code=504, detail="Request deadline exceeded. Please try again.")
+
+def check_callback_url(callback_url: Optional[str]):
+    """Reject callback URLs the server must not POST to (see callbacks.py). Resolves DNS, so call off the event loop."""
+    if callback_url:
+        try:
+            validate_callback_url(callback_url)
+        except InvalidCallbackUrl as e:
+            raise HTTPException(status_code=400, detail=f"Invalid callback_url: {e}")
+
+def resolve_advice_mode(requested: Optional[str]) -> str:
+    mode = (requested or ADVICE_MODE).lower()
+    return mode if mode in ("hybrid", "sync") else ADVICE_MODE
+
+UNAVAILABLE_RESPONSE = ("I apologize, but I'm having trouble generating a response right now. "
+                        "Please try again later.")
+
 def query_huggingface(prompt: str) -> str:
     """
     Query Hugging Face model for text generation with fallback options
     """
+    return generate_text(prompt)[0]
+
+def generate_text(prompt: str) -> Tuple[str, str]:
+    """
+    Generate text with the Hugging Face API, falling back to the local model.
+    Returns the text and where it came from: "huggingface", "local" or "unavailable".
+    """
+    with tracing.span("llm", prompt_chars=len(prompt)) as llm_span:
+        text, source = _generate_text(prompt)
+        llm_span.set(source=source)
+        return text, source
+
+def post_huggingface(payload: dict, timeout: float, attempt: int) -> requests.Response:
+    """One Hugging Face API call, traced with its attempt number and status code."""
+    with tracing.span("huggingface", attempt=attempt, timeout=round(timeout, 2)) as attempt_span:
+        response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=timeout)
+        attempt_span.set(status_code=response.status_code)
+        return response
+
+def _generate_text(prompt: str) -> Tuple[str, str]:
     try:
-        # Try Hugging Face API with retries
+        # Try Hugging Face API with retries, unless the breaker says it is down
         for attempt in range(3):  # Try up to 3 times
+            if not hf_breaker.allow_request():
+                logger.info("Hugging Face circuit open, using fallback")
+                tracing.event("huggingface.circuit_open")
+                break
+            # Never wait on the API past the request deadline
+            timeout = deadlines.cap_timeout(10)
+            if timeout < 1:
+                deadlines.skip("huggingface")
+                break
+            start = time.monotonic()
             try:
                 payload = {
                     "inputs": prompt, 
@@ -123,17 +340,23 @@ def query_huggingface(prompt: str) -> str:
                         "do_sample": True
                     }
                 }
-                response = requests.post(HF_API_URL, headers=headers, json=payload, timeout=10)
+                response = post_huggingface(payload, timeout, attempt + 1)
                 
                 if response.status_code == 200:
                     generated_text = response.json()[0]["generated_text"]
+                    hf_breaker.record_success(time.monotonic() - start)
                     # Clean and format the response
                     generated_text = generated_text.replace(prompt, "").strip()
-                    return generated_text
+                    return generated_text, "huggingface"
                     
-                elif response.status_code == 429:  # Rate limit
+                hf_breaker.record_failure(time.monotonic() - start)
+                if response.status_code == 429:  # Rate limit
+                    if not deadlines.has_time(2 ** attempt + 1):
+                        deadlines.skip("huggingface")
+                        break
                     logger.warning("Rate limit hit, waiting before retry...")
-                    time.sleep(2 ** attempt)  # Exponential backoff
+                    with tracing.span("huggingface.backoff", seconds=2 ** attempt):
+                        time.sleep(2 ** attempt)  # Exponential backoff
                     continue
                     
                 else:
@@ -141,101 +364,191 @@ def query_huggingface(prompt: str) -> str:
                     break
                     
             except requests.exceptions.Timeout:
+                hf_breaker.record_failure(time.monotonic() - start)
                 logger.warning("API request timed out, retrying...")
                 continue
                 
             except Exception as e:
+                hf_breaker.record_failure(time.monotonic() - start)
                 logger.error(f"API request failed: {e}")
                 break
         
         # If API fails, try local model
-        if generator:
+        local_available = model_residency.available("local_generator")
+        if local_available and deadlines.cap_timeout(LOCAL_LM_TIMEOUT) < 1:
+            deadlines.skip("local_generator")
+        elif local_available:
             try:
-                outputs = generator(
-                    prompt, 
-                    max_length=150,
-                    num_return_sequences=1,
-                    temperature=0.7,
-                    top_p=0.95,
-                    do_sample=True
-                )
-                return outputs[0]["generated_text"].replace(prompt, "").strip()
+                # Loads the model first if it was evicted
+                with model_residency.use("local_generator") as generator:
+                    # Concurrent fallbacks are batched together by the worker;
+                    # past the deadline it returns the text generated so far
+                    local_timeout = deadlines.cap_timeout(LOCAL_LM_TIMEOUT)
+                    with tracing.span("local_generator", timeout=round(local_timeout, 2)) as local_span:
+                        text = generator.generate(
+                            prompt,
+                            max_new_tokens=LOCAL_LM_MAX_NEW_TOKENS,
+                            timeout=local_timeout,
+                            temperature=0.7,
+                            top_p=0.95
+                        ).strip()
+                        local_span.set(output_chars=len(text))
+                if text:
+                    return text, "local"
             except Exception as e:
                 logger.error(f"Local model failed: {e}")
         
         # If all fails, return a default response
         logger.warning("Both HF API and local model failed, returning default response")
-        return ("I apologize, but I'm having trouble generating a response right now. "
-                "Please try again later.")
+        return UNAVAILABLE_RESPONSE, "unavailable"
     except Exception as e:
         logger.error(f"Error in text generation: {e}")
-        return ("I apologize, but I'm having trouble generating a response right now. "
-                "Please try again later.")
+        return UNAVAILABLE_RESPONSE, "unavailable"
 
 def translate_text(text: str, target_lang: str) -> str:
     """
     Translate text using Hugging Face models
     """
+    return translate_text_with_source(text, target_lang)[0]
+
+def translate_text_with_source(text: str, target_lang: str) -> Tuple[str, str]:
+    """Like translate_text, also returning the generate_text source ("none" if untranslated)."""
     if target_lang == "en":
-        return text
+        return text, "none"
+    
+    if not deadlines.has_time(deadlines.TRANSLATION_MIN_SECONDS):
+        deadlines.skip("translation")
+        return text, "none"
     
     language = "Telugu" if target_lang == "te" else "Hindi"
     prompt = f"Translate to {language}: {text}"
     
     try:
-        return query_huggingface(prompt)
+        with tracing.span("translation", target=target_lang, chars=len(text)):
+            return generate_text(prompt)
     except Exception as e:
         logger.error(f"Translation error: {e}")
-        return text  # Return original text if translation fails
+        return text, "none"  # Return original text if translation fails
 
-def parse_disease_class(class_name: str) -> dict:
+@app.get("/enrichments/{enrichment_id}")
+def get_enrichment(enrichment_id: str, wait: float = 0):
     """
-    Parse disease class name to extract crop and disease information.
-    Format: Crop___Disease or Crop_Disease
-    Example: "Tomato___Late_blight" -> {"crop": "Tomato", "disease": "Late blight", "is_healthy": False}
+    Fetch LLM advice generated in the background for a hybrid-mode response.
+    Pass `wait` (seconds, up to 30) to long-poll until it is ready.
     """
-    # Replace underscores with spaces for better readability
-    parts = class_name.replace('___', '|').replace('__', '|').replace('_', ' ').split('|')
-    
-    if len(parts) >= 2:
-        crop = parts[0].strip()
-        disease = parts[1].strip()
-        is_healthy = 'healthy' in disease.lower()
-        
-        return {
-            "crop": crop,
-            "disease": disease if not is_healthy else "Healthy",
-            "is_healthy": is_healthy,
-            "full_name": class_name
-        }
-    else:
-        # Fallback for unexpected format
-        return {
-            "crop": "Unknown",
-            "disease": class_name,
-            "is_healthy": False,
-            "full_name": class_name
-        }
+    record = enrichments.get(enrichment_id, wait=min(max(wait, 0), 30))
+    if record is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired enrichment ID")
+    return record
+
+@app.get("/model_info")
+async def model_info():
+    """Describe model inputs so clients can preprocess uploads to match."""
+    return {
+        "disease_input_size": list(inference.disease_input_size),
+        "disease_model_loaded": model_residency.available("disease"),
+        "crop_model_loaded": model_residency.available("crop"),
+        "serving_profile": inference.SERVING_PROFILE,
+        "max_upload_bytes": MAX_UPLOAD_BYTES
+    }
+
+@app.get("/metrics")
+def metrics():
+    """Upstream health and worker statistics."""
+    generator = model_residency.get("local_generator")
+    return {
+        "huggingface": hf_breaker.snapshot(),
+        "admission": {path: controller.stats() for path, controller in admission.items()},
+        "local_generator": generator.stats() if generator else None,
+        "jobs": jobs.stats(),
+        "chat_cache": chat_cache.stats() if chat_cache else None,
+        "models": model_manager.status(),
+        "residency": model_residency.status()
+    }
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency for admin endpoints: checks the X-Admin-Token header against ADMIN_TOKEN."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled. Set ADMIN_TOKEN to enable them.")
+    if not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.on_event("startup")
+def start_model_watcher():
+    # Threads don't survive fork, so start the watchers in each server process
+    model_manager.start()
+    model_residency.start()
+    create_chat_cache()
+
+@app.post("/admin/models/reload", status_code=202, dependencies=[Depends(require_admin)])
+def reload_models(kind: Optional[str] = None, force: bool = False):
+    """
+    Load changed model artifacts in the background, validate them and swap
+    them in. `kind` is "crop" or "disease" (default: both); `force` reloads
+    even if the files look unchanged. Check progress at GET /admin/models.
+    """
+    try:
+        kinds = model_manager.reload_async([kind] if kind else None, force=force)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "reloading", "kinds": kinds}
 
-def is_valid_plant_image(confidence: float, threshold: float = 0.3) -> bool:
+@app.get("/admin/models", dependencies=[Depends(require_admin)])
+def model_status():
+    """Installed model versions and the state of the last reload."""
+    return model_manager.status()
+
+@app.post("/admin/models/evict", dependencies=[Depends(require_admin)])
+def evict_model(kind: str):
     """
-    Check if the image is a valid plant image based on confidence score.
-    If confidence is too low, it might be an invalid image.
+    Unload a model from this process now; the next request that needs it
+    loads it again. Returns 409 while requests are using it, and for pinned
+    models (the crop model), which are never evicted.
     """
-    return confidence >= threshold
+    if not model_residency.is_resident(kind):
+        raise HTTPException(status_code=404, detail=f"Model {kind} is not loaded")
+    if not model_residency.evict(kind):
+        raise HTTPException(status_code=409, detail=f"Model {kind} is in use or pinned")
+    return model_residency.status()["models"][kind]
 
-@app.post("/recommend_crop")
-async def recommend_crop(data: CropData):
-    if not crop_model:
-        raise HTTPException(status_code=503, detail="Crop recommendation model not available")
-    
+@app.post("/admin/profile", status_code=202, dependencies=[Depends(require_admin)])
+def start_profile(seconds: float = 30, request_count: Optional[int] = None,
+                  allocations: bool = True, top: int = 25):
+    """
+    Profile this server process for `seconds` or the next `request_count`
+    requests, whichever ends first. Fetch the report from GET /admin/profile.
+    """
     try:
-        # Make prediction
-        X = [[data.N, data.P, data.K, data.temperature, data.humidity, data.ph, data.rainfall]]
-        crop = crop_model.predict(X)[0]
+        return profiler.start(seconds=seconds, requests=request_count, allocations=allocations, top=top)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/admin/profile/stop", dependencies=[Depends(require_admin)])
+def stop_profile():
+    profiler.stop()
+    return profiler.status()
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+def get_profile(wait: float = 0):
+    """
+    The last session's report: top frames by samples and allocation growth.
+    Pass `wait` (seconds, up to 300) to long-poll until a running session ends.
+    """
+    report = profiler.report(wait=min(max(wait, 0), 300))
+    if report is None:
+        return profiler.status()
+    return {key: value for key, value in report.items() if key != "folded"}
+
+@app.get("/admin/profile/folded", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+def get_profile_folded(wait: float = 0):
+    """The last session's stacks in folded format, for flamegraph.pl or speedscope."""
+    report = profiler.report(wait=min(max(wait, 0), 300))
+    if report is None:
+        raise HTTPException(status_code=404, detail="No finished profiling session")
+    return report["folded"] + "\n"
 
-        # Generate farming advice using Hugging Face
-        prompt = f"""
+def crop_advice_prompt(crop: str, data: CropData) -> str:
+    return f"""
         As an agricultural expert, provide detailed farming advice for {crop} cultivation with these conditions:
         - Soil nutrients: N={data.N}, P={data.P}, K={data.K}, pH={data.ph}
         - Weather: Temperature={data.temperature}°C, Humidity={data.humidity}%, Rainfall={data.rainfall}mm
@@ -247,31 +560,105 @@ async def recommend_crop(data: CropData):
         4. Best practices
         """
 
-        advice = query_huggingface(prompt)
-        
-        # Translate if needed
-        if data.language != "en":
-            advice = translate_text(advice, data.language)
-            crop = translate_text(crop, data.language)
+def find_similar_fields(row: list, k: Optional[int], user_id: str) -> list:
+    """The k historical records closest to a field, other than the user's own, or [] without an index."""
+    if similar_fields is None:
+        return []
+    try:
+        return similar_fields.query([row], k or SIMILAR_FIELDS_K, exclude_owner=user_id)[0]
+    except Exception as e:
+        logger.error(f"Similar fields lookup failed: {e}")
+        return []
 
-        # Save to Firebase if available
-        if db:
-            try:
+def enrich_crop_recommendation(crop: str, data: CropData) -> dict:
+    """Generate LLM advice for a recommendation, translate it and save it."""
+    crop_label = crop
+    if deadlines.has_time(deadlines.LLM_MIN_SECONDS):
+        advice, advice_source = query_huggingface(crop_advice_prompt(crop, data)), "llm"
+    else:
+        deadlines.skip("llm")
+        advice, advice_source = generate_crop_advice(crop, data), "rules"
+    
+    # Translate if needed
+    if data.language != "en":
+        advice = translate_text(advice, data.language)
+        crop = translate_text(crop, data.language)
+
+    # Save to Firebase if available
+    if db and not deadlines.has_time(deadlines.PERSISTENCE_MIN_SECONDS):
+        deadlines.skip("persistence")
+    elif db:
+        try:
+            with tracing.span("firestore.write", collection="recommendations"):
                 db.collection("farmers").document(data.user_id).collection("recommendations").add({
                     "crop": crop,
+                    "crop_label": crop_label,
                     "advice": advice,
                     "soil_data": data.dict(),
                     "timestamp": firestore.SERVER_TIMESTAMP
-                })
-            except Exception as e:
-                logger.error(f"Firebase error in crop recommendation: {e}")
+                }, timeout=deadlines.remaining())
+            # Only saved recommendations become evidence for other users
+            if similar_fields is not None:
+                similar_fields.append(
+                    [data.N, data.P, data.K, data.temperature, data.humidity, data.ph, data.rainfall],
+                    crop_label, owner=data.user_id
+                )
+        except Exception as e:
+            logger.error(f"Firebase error in crop recommendation: {e}")
+
+    return {"recommended_crop": crop, "advice": advice, "advice_source": advice_source}
+
+def run_crop_recommendation(data: CropData) -> dict:
+    """Predict a crop and build the response; shared by the endpoint and job workers."""
+    if not model_residency.available("crop"):
+        raise HTTPException(status_code=503, detail="Crop recommendation model not available")
+    check_callback_url(data.callback_url)
+    
+    try:
+        check_deadline()
+        
+        # Make prediction; loads the model first if it failed to load at startup
+        X = [[data.N, data.P, data.K, data.temperature, data.humidity, data.ph, data.rainfall]]
+        try:
+            with tracing.span("inference", model="crop"), model_residency.use("crop") as model:
+                crop, _ = inference.predict_crop(X, model)[0]
+        except ModelUnavailable as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=503, detail="Crop recommendation model not available")
+
+        # Evidence for the recommendation; the field itself is indexed once saved
+        with tracing.span("similar_fields"):
+            similar = find_similar_fields(X[0], data.similar_k, data.user_id)
 
+        if resolve_advice_mode(data.advice_mode) == "hybrid":
+            # Answer now with rule-based advice; the LLM advice follows in the background
+            enrichment_id = enrichments.submit(
+                lambda: enrich_crop_recommendation(crop, data),
+                callback_url=data.callback_url
+            )
+            return {
+                "recommended_crop": crop,
+                "advice": generate_crop_advice(crop, data),
+                "advice_source": "rules",
+                "enrichment_id": enrichment_id,
+                "enrichment_status": "pending",
+                "similar_fields": similar,
+                "skipped_stages": deadlines.skipped_stages(),
+                "success": True
+            }
+
+        result = enrich_crop_recommendation(crop, data)
         return {
-            "recommended_crop": crop,
-            "advice": advice,
+            "recommended_crop": result["recommended_crop"],
+            "advice": result["advice"],
+            "advice_source": result["advice_source"],
+            "similar_fields": similar,
+            "skipped_stages": deadlines.skipped_stages(),
             "success": True
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in crop recommendation: {e}")
         raise HTTPException(
@@ -279,108 +666,175 @@ async def recommend_crop(data: CropData):
             detail="Unable to process crop recommendation. Please try again later."
         )
 
-@app.post("/detect_disease")
-async def detect_disease(
-    file: UploadFile = File(...),
-    user_id: Optional[str] = None,
-    language: str = "en"
-):
-    if not disease_model:
+@app.post("/recommend_crop")
+async def recommend_crop(data: CropData):
+    # Model and LLM calls block, so keep them off the event loop
+    return await run_in_threadpool(run_crop_recommendation, data)
+
+def disease_advice_prompt(crop_name: str, disease_name: str, is_healthy: bool) -> str:
+    if is_healthy:
+        return f"""
+            As a plant pathologist, provide information about a healthy {crop_name} plant:
+            
+            1. Confirm the plant appears healthy
+            2. Best practices to maintain plant health
+            3. Common diseases to watch for in {crop_name}
+            4. Preventive care recommendations
+            """
+    return f"""
+            As a plant pathologist, provide detailed information about {disease_name} in {crop_name}:
+            
+            1. Disease description and causes
+            2. Common symptoms to look for
+            3. Treatment recommendations (organic and chemical)
+            4. Prevention measures for future crops
+            5. Expected recovery timeline
+            """
+
+def enrich_disease_detection(crop_name: str, disease_name: str, is_healthy: bool,
+                             confidence: float, user_id: Optional[str], language: str) -> dict:
+    """Generate LLM advice for a detection, translate it and save it."""
+    if deadlines.has_time(deadlines.LLM_MIN_SECONDS):
+        advice = query_huggingface(disease_advice_prompt(crop_name, disease_name, is_healthy))
+        advice_source = "llm"
+    else:
+        deadlines.skip("llm")
+        advice = generate_disease_advice(crop_name, disease_name, is_healthy)
+        advice_source = "rules"
+    
+    # Translate if needed
+    if language != "en":
+        advice = translate_text(advice, language)
+        crop_name = translate_text(crop_name, language)
+        disease_name = translate_text(disease_name, language)
+    
+    # Save to Firebase if available and user_id provided
+    if db and user_id and not deadlines.has_time(deadlines.PERSISTENCE_MIN_SECONDS):
+        deadlines.skip("persistence")
+    elif db and user_id:
+        try:
+            with tracing.span("firestore.write", collection="disease_detections"):
+                db.collection("farmers").document(user_id).collection("disease_detections").add({
+                    "crop": crop_name,
+                    "disease": disease_name,
+                    "is_healthy": is_healthy,
+                    "confidence": confidence,
+                    "advice": advice,
+                    "timestamp": firestore.SERVER_TIMESTAMP
+                }, timeout=deadlines.remaining())
+        except Exception as e:
+            logger.error(f"Firebase error in disease detection: {e}")
+    
+    return {"crop": crop_name, "disease": disease_name, "advice": advice, "advice_source": advice_source}
+
+async def read_image_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read and sniff an uploaded image, rejecting bad or oversized files early."""
+    # Validate file type
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload an image file (JPEG, PNG, etc.)"
+        )
+    
+    # Read the upload in chunks, checking the magic bytes up front
+    try:
+        with tracing.span("upload.read") as read_span:
+            contents = await read_upload(file, max_bytes)
+            read_span.set(bytes=len(contents))
+        return contents
+    except InvalidImage as e:
+        logger.warning(f"Rejected upload: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload an image file (JPEG, PNG, etc.)"
+        )
+    except UploadTooLarge as e:
+        logger.warning(f"Rejected upload: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid image file. Please upload a valid image."
+        )
+
+def run_disease_detection(contents: bytes, user_id: Optional[str] = None, language: str = "en",
+                          advice_mode: Optional[str] = None, callback_url: Optional[str] = None) -> dict:
+    """Classify an uploaded image and build the response; shared by the endpoint and job workers."""
+    if not model_residency.available("disease"):
         raise HTTPException(status_code=503, detail="Disease detection model not available")
+    check_callback_url(callback_url)
     
     try:
-        # Validate file type
-        if not file.content_type or not file.content_type.startswith('image/'):
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file type. Please upload an image file (JPEG, PNG, etc.)"
-            )
-        
-        # Process image
-        contents = await file.read()
-        
+        # Validate the header before decoding any pixels
         try:
-            img = Image.open(io.BytesIO(contents)).convert('RGB')
-        except Exception as e:
+            with tracing.span("decode", bytes=len(contents)):
+                img = load_rgb(open_image(contents), target_size=inference.disease_input_size[::-1])
+        except InvalidImage as e:
             logger.error(f"Error opening image: {e}")
             raise HTTPException(
                 status_code=400,
                 detail="Invalid image file. Please upload a valid image."
             )
         
-        img = img.resize((224, 224))
-        img_array = np.expand_dims(np.array(img) / 255.0, axis=0)
+        # Reject obvious non-leaf images before paying for the CNN pass
+        with tracing.span("leaf_filter") as filter_span:
+            is_leaf = is_probable_leaf(img)
+            filter_span.set(is_leaf=is_leaf)
+        if not is_leaf:
+            raise HTTPException(
+                status_code=400,
+                detail="The uploaded image does not appear to be a valid plant leaf image. Please upload a clear image of a plant leaf (Tomato, Potato, or Pepper)."
+            )
         
         # Make prediction
-        prediction = disease_model.predict(img_array)
-        disease_label = int(np.argmax(prediction))
-        confidence = float(np.max(prediction))
+        check_deadline()
+        try:
+            # Loads the model first if it was evicted
+            with model_residency.use("disease") as version:
+                prediction = inference.predict_disease([img], version)[0]
+        except ModelUnavailable as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=503, detail="Disease detection model not available")
+        confidence = prediction["confidence"]
         
         # Check if image is valid (confidence threshold)
-        if not is_valid_plant_image(confidence, threshold=0.3):
+        if not inference.is_valid_plant_image(confidence, threshold=0.3):
             raise HTTPException(
                 status_code=400,
                 detail="The uploaded image does not appear to be a valid plant leaf image. Please upload a clear image of a plant leaf (Tomato, Potato, or Pepper)."
             )
         
         # Get class name and parse it
-        class_name = disease_class_names.get(disease_label, f"Unknown_{disease_label}")
-        disease_info = parse_disease_class(class_name)
+        disease_info = inference.parse_disease_class(prediction["class_name"])
         
         # Extract crop and disease information
         crop_name = disease_info["crop"]
         disease_name = disease_info["disease"]
         is_healthy = disease_info["is_healthy"]
         
-        # Generate appropriate advice based on health status
-        if is_healthy:
-            prompt = f"""
-            As a plant pathologist, provide information about a healthy {crop_name} plant:
-            
-            1. Confirm the plant appears healthy
-            2. Best practices to maintain plant health
-            3. Common diseases to watch for in {crop_name}
-            4. Preventive care recommendations
-            """
-        else:
-            prompt = f"""
-            As a plant pathologist, provide detailed information about {disease_name} in {crop_name}:
-            
-            1. Disease description and causes
-            2. Common symptoms to look for
-            3. Treatment recommendations (organic and chemical)
-            4. Prevention measures for future crops
-            5. Expected recovery timeline
-            """
-        
-        advice = query_huggingface(prompt)
-        
-        # Translate if needed
-        if language != "en":
-            advice = translate_text(advice, language)
-            crop_name = translate_text(crop_name, language)
-            disease_name = translate_text(disease_name, language)
-        
-        # Save to Firebase if available and user_id provided
-        if db and user_id:
-            try:
-                db.collection("farmers").document(user_id).collection("disease_detections").add({
-                    "crop": crop_name,
-                    "disease": disease_name,
-                    "is_healthy": is_healthy,
-                    "confidence": confidence,
-                    "advice": advice,
-                    "timestamp": firestore.SERVER_TIMESTAMP
-                })
-            except Exception as e:
-                logger.error(f"Firebase error in disease detection: {e}")
+        if resolve_advice_mode(advice_mode) == "hybrid":
+            # Answer now with rule-based advice; the LLM advice follows in the background
+            enrichment_id = enrichments.submit(
+                lambda: enrich_disease_detection(crop_name, disease_name, is_healthy, confidence, user_id, language),
+                callback_url=callback_url
+            )
+            return {
+                "crop": crop_name,
+                "disease": disease_name,
+                "is_healthy": is_healthy,
+                "confidence": confidence,
+                "advice": generate_disease_advice(crop_name, disease_name, is_healthy),
+                "advice_source": "rules",
+                "enrichment_id": enrichment_id,
+                "enrichment_status": "pending",
+                "skipped_stages": deadlines.skipped_stages(),
+                "success": True
+            }
         
+        result = enrich_disease_detection(crop_name, disease_name, is_healthy, confidence, user_id, language)
         return {
-            "crop": crop_name,
-            "disease": disease_name,
+            **result,
             "is_healthy": is_healthy,
             "confidence": confidence,
-            "advice": advice,
+            "skipped_stages": deadlines.skipped_stages(),
             "success": True
         }
     
@@ -394,36 +848,317 @@ async def detect_disease(
             detail="Unable to process disease detection. Please try again later."
         )
 
+@app.post("/detect_disease")
+async def detect_disease(
+    file: UploadFile = File(...),
+    user_id: Optional[str] = None,
+    language: str = "en",
+    advice_mode: Optional[str] = None,
+    callback_url: Optional[str] = None
+):
+    if not model_residency.available("disease"):
+        raise HTTPException(status_code=503, detail="Disease detection model not available")
+    
+    contents = await read_image_upload(file)
+    # Decoding and inference block, so keep them off the event loop
+    return await run_in_threadpool(
+        run_disease_detection, contents, user_id, language, advice_mode, callback_url
+    )
+
+def run_tiled_detection(contents: bytes, tile_size: int, overlap: float, overlay: bool) -> dict:
+    """Classify overlapping tiles of a large image and build the heatmap response."""
+    try:
+        img = open_image(contents, max_pixels=MAX_TILED_IMAGE_PIXELS)
+    except InvalidImage as e:
+        logger.error(f"Error opening image: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image file. Please upload a valid image.")
+
+    try:
+        # Loads the model first if it was evicted
+        with model_residency.use("disease") as version:
+            result = analyze_tiles(
+                img, version.input_size, version.class_names,
+                lambda batch: inference.predict_disease_batch(batch, version),
+                tile_size=tile_size, overlap=overlap, overlay=overlay, checkpoint=check_deadline
+            )
+    except ModelUnavailable as e:
+        logger.error(str(e))
+        raise HTTPException(status_code=503, detail="Disease detection model not available")
+    except TooManyTiles as e:
+        raise HTTPException(status_code=400, detail=f"Image too large for this tile size ({e}). Use a larger tile_size.")
+    except NotReducible as e:
+        logger.warning(f"Rejected tiled image: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Images over {MAX_IMAGE_PIXELS // 1_000_000} megapixels must be JPEGs. Please convert the image or upload a smaller one."
+        )
+    except InvalidImage as e:
+        logger.error(f"Error decoding image: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image file. Please upload a valid image.")
+
+    dominant = result["dominant"]
+    return {
+        **result,
+        "advice": generate_disease_advice(
+            dominant["crop"], dominant["disease"], dominant["is_healthy"]
+        ) if dominant else None,
+        "success": True
+    }
+
+@app.post("/detect_disease/tiled")
+async def detect_disease_tiled(
+    file: UploadFile = File(...),
+    tile_size: int = TILE_SIZE,
+    overlap: float = TILE_OVERLAP,
+    overlay: bool = True
+):
+    """
+    Analyze a high-resolution field or drone photo in overlapping tiles of
+    `tile_size` source pixels. Returns per-class tile counts, a grid of
+    disease probabilities and, with `overlay`, a base64 PNG heatmap.
+    """
+    if not model_residency.available("disease"):
+        raise HTTPException(status_code=503, detail="Disease detection model not available")
+    contents = await read_image_upload(file, max_bytes=MAX_TILED_UPLOAD_BYTES)
+    tile_size = min(max(tile_size, 64), 4096)
+    overlap = min(max(overlap, 0.0), 0.75)
+    # Decoding and inference block, so keep them off the event loop
+    return await run_in_threadpool(run_tiled_detection, contents, tile_size, overlap, overlay)
+
+async def save_video_upload(file: UploadFile) -> str:
+    """Copy an uploaded video to a temporary file, since OpenCV reads from a path."""
+    if not file.content_type or not file.content_type.startswith("video/"):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload a video file (MP4, MOV, etc.)"
+        )
+
+    def copy() -> str:
+        with tempfile.NamedTemporaryFile(suffix=Path(file.filename or "").suffix[:8], delete=False) as tmp:
+            shutil.copyfileobj(file.file, tmp)
+            return tmp.name
+
+    with tracing.span("upload.read"):
+        await file.seek(0)
+        return await run_in_threadpool(copy)
+
+def stream_clip_scan(frames: Iterable, clip: dict) -> Iterator[str]:
+    """NDJSON lines of a clip scan; failures after the stream started become an "error" event."""
+    yield json.dumps({"type": "clip", **clip}) + "\n"
+    try:
+        # Loads the model first if it was evicted, and keeps it for the whole clip
+        with model_residency.use("disease") as version:
+            for event in scan_frames(frames, lambda images: inference.predict_disease(images, version)):
+                if event["type"] == "summary":
+                    dominant = event["dominant"]
+                    event["advice"] = generate_disease_advice(
+                        dominant["crop"], dominant["disease"], dominant["is_healthy"]
+                    ) if dominant else None
+                    event["success"] = True
+                yield json.dumps(event) + "\n"
+    except ModelUnavailable as e:
+        logger.error(str(e))
+        yield json.dumps({"type": "error", "detail": "Disease detection model not available"}) + "\n"
+    except InvalidImage as e:
+        logger.warning(f"Invalid frame in clip: {e}")
+        yield json.dumps({"type": "error", "detail": "A frame could not be decoded. Please upload valid images."}) + "\n"
+    except Exception as e:
+        logger.error(f"Error in clip disease scan: {e}")
+        yield json.dumps({"type": "error", "detail": "Unable to finish the scan. Please try again later."}) + "\n"
+
+@app.post("/detect_disease/video")
+async def detect_disease_video(
+    file: Optional[UploadFile] = File(None),
+    frames: List[UploadFile] = File(None),
+    sample_fps: float = VIDEO_SAMPLE_FPS,
+    max_frames: int = VIDEO_MAX_FRAMES
+):
+    """
+    Scan a walk-along video (`file`) or an ordered frame sequence (`frames`)
+    for disease. Video frames are sampled at `sample_fps`, at most
+    `max_frames` of them. Streams NDJSON: a "clip" line, a "frames" line per
+    batch with the frame results and the summary so far, then a "summary"
+    line with the dominant disease, its confidence and the frames affected.
+    """
+    if not model_residency.available("disease"):
+        raise HTTPException(status_code=503, detail="Disease detection model not available")
+    if (file is None) == (not frames):
+        raise HTTPException(status_code=400, detail="Upload either a video file or a sequence of frames")
+    sample_fps = min(max(sample_fps, 0.1), 30)
+    max_frames = min(max(max_frames, 1), VIDEO_MAX_FRAMES)
+    input_size = inference.disease_input_size
+
+    if file is not None:
+        if not video_support():
+            raise HTTPException(status_code=501, detail="Video scanning is not available on this server. Upload frames instead.")
+        path = await save_video_upload(file)
+        try:
+            clip = await run_in_threadpool(probe_video, path)
+        except InvalidVideo as e:
+            os.unlink(path)
+            logger.warning(f"Rejected video: {e}")
+            raise HTTPException(status_code=400, detail="Invalid video file. Please upload a valid video.")
+        source = sample_video_frames(path, input_size, sample_fps, max_frames)
+        return StreamingResponse(
+            stream_clip_scan(source, {**clip, "sample_fps": sample_fps, "max_frames": max_frames}),
+            media_type="application/x-ndjson",
+            background=BackgroundTask(os.unlink, path)
+        )
+
+    if len(frames) > max_frames:
+        raise HTTPException(status_code=400, detail=f"Too many frames. Please upload at most {max_frames}.")
+    contents = [await read_image_upload(frame) for frame in frames]
+    try:
+        # Check every header before streaming; pixels are decoded during the scan
+        for frame in contents:
+            open_image(frame)
+    except InvalidImage as e:
+        logger.warning(f"Rejected frame: {e}")
+        raise HTTPException(status_code=400, detail="Invalid image file. Please upload valid images.")
+    return StreamingResponse(
+        stream_clip_scan(decode_image_frames(contents, input_size), {"frames": len(contents)}),
+        media_type="application/x-ndjson"
+    )
+
+def run_job(fn, *args, **kwargs) -> dict:
+    """Run an endpoint function on a job worker, turning HTTP errors into job errors."""
+    try:
+        with tracing.trace(f"job {fn.__name__}"):
+            return fn(*args, **kwargs)
+    except HTTPException as e:
+        raise JobError(e.status_code, e.detail)
+
+# Jobs already run off the request path, so they wait for the LLM advice
+# instead of returning rule-based advice plus an enrichment ID
+jobs = JobQueue({
+    "recommend_crop": lambda payload, _: run_job(
+        run_crop_recommendation, CropData(**payload, advice_mode="sync")
+    ),
+    "detect_disease": lambda payload, attachment: run_job(
+        run_disease_detection, attachment, advice_mode="sync", **payload
+    ),
+})
+
+@app.on_event("startup")
+def start_job_workers():
+    # Worker threads don't survive fork, so start them in each server process
+    jobs.start()
+
+def submit_job(job_type: str, payload: dict, attachment: Optional[bytes] = None,
+               callback_url: Optional[str] = None) -> dict:
+    check_callback_url(callback_url)
+    try:
+        job_id = jobs.submit(job_type, payload, attachment, callback_url=callback_url)
+    except QueueFull as e:
+        logger.warning(f"Rejected {job_type} job: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="Too many queued jobs. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+    return {"job_id": job_id, "status": "queued"}
+
+@app.post("/jobs/recommend_crop", status_code=202)
+def submit_crop_recommendation_job(data: CropData):
+    """Queue a crop recommendation; `callback_url` receives the finished job."""
+    if not model_residency.available("crop"):
+        raise HTTPException(status_code=503, detail="Crop recommendation model not available")
+    payload = data.dict(exclude={"advice_mode", "callback_url"})
+    return submit_job("recommend_crop", payload, callback_url=data.callback_url)
+
+@app.post("/jobs/detect_disease", status_code=202)
+async def submit_disease_detection_job(
+    file: UploadFile = File(...),
+    user_id: Optional[str] = None,
+    language: str = "en",
+    callback_url: Optional[str] = None
+):
+    """Queue a disease detection; `callback_url` receives the finished job."""
+    if not model_residency.available("disease"):
+        raise HTTPException(status_code=503, detail="Disease detection model not available")
+    contents = await read_image_upload(file)
+    payload = {"user_id": user_id, "language": language}
+    return await run_in_threadpool(submit_job, "detect_disease", payload, contents, callback_url)
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, wait: float = 0):
+    """
+    Fetch a job's status and, once finished, its result or error.
+    Pass `wait` (seconds, up to 30) to long-poll until it finishes.
+    """
+    job = jobs.get(job_id, wait=min(max(wait, 0), 30))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job ID")
+    return job
+
 @app.post("/chat")
-async def chat_with_ai(request: ChatRequest):
+def chat_with_ai(request: ChatRequest):
+    # Plain def: FastAPI runs it in the threadpool, so the LLM call doesn't block the event loop
     try:
-        # Generate response using Hugging Face
-        prompt = f"""
-        As KrishiGPT, a friendly agricultural assistant helping Indian farmers, 
-        respond to this farming question in simple, clear language:
-        
-        {request.message}
-        """
-        
-        response = query_huggingface(prompt)
+        # Answer from the cache if this question (or one close to it) was answered before
+        with tracing.span("chat_cache.lookup") as cache_span:
+            lookup = chat_cache.lookup(request.message, request.language) if chat_cache else None
+            cache_span.set(hit=lookup is not None and lookup.hit)
+        knowledge_sources = []
+        if lookup is not None and lookup.hit:
+            response, source = lookup.answer, "cache"
+        else:
+            # Well-known topics are answered straight from the knowledge base;
+            # otherwise its best passages become context for the LLM
+            with tracing.span("knowledge.search") as search_span:
+                passages = knowledge.search(request.message) if knowledge else []
+                direct = knowledge.answer(passages) if knowledge else None
+                search_span.set(passages=len(passages), direct=direct is not None)
+            if direct is not None:
+                response, source = f"**{direct.passage.title}**\n\n{direct.passage.text}", "knowledge_base"
+                knowledge_sources = [direct.passage.to_dict()]
+            else:
+                context = ""
+                if passages:
+                    context = f"Use this reference information where it is relevant:\n{format_context(passages)}\n"
+                    knowledge_sources = [result.passage.to_dict() for result in passages]
 
-        # Translate if needed
-        if request.language != "en":
-            response = translate_text(response, request.language)
+                # Generate response using Hugging Face
+                prompt = f"""
+                As KrishiGPT, a friendly agricultural assistant helping Indian farmers, 
+                respond to this farming question in simple, clear language:
+                {context}
+                {request.message}
+                """
+                
+                response, source = generate_text(prompt)
+
+            # Translate if needed
+            translated = True
+            if request.language != "en":
+                response, translation_source = translate_text_with_source(response, request.language)
+                translated = translation_source == "huggingface"
+
+            # Only cache full-quality answers, not fallbacks or ones cut short by the deadline
+            if (lookup is not None and source in ("huggingface", "knowledge_base") and translated
+                    and not deadlines.skipped_stages()):
+                chat_cache.store(lookup, response)
 
         # Save to Firebase if available
-        if db:
+        if db and not deadlines.has_time(deadlines.PERSISTENCE_MIN_SECONDS):
+            deadlines.skip("persistence")
+        elif db:
             try:
-                db.collection("farmers").document(request.user_id).collection("chats").add({
-                    "question": request.message,
-                    "response": response,
-                    "timestamp": firestore.SERVER_TIMESTAMP
-                })
+                with tracing.span("firestore.write", collection="chats"):
+                    db.collection("farmers").document(request.user_id).collection("chats").add({
+                        "question": request.message,
+                        "response": response,
+                        "timestamp": firestore.SERVER_TIMESTAMP
+                    }, timeout=deadlines.remaining())
             except Exception as e:
                 logger.error(f"Firebase error in chat: {e}")
 
         return {
             "response": response,
+            "cached": source == "cache",
+            "answer_source": source,
+            "knowledge_sources": knowledge_sources,
+            "skipped_stages": deadlines.skipped_stages(),
             "success": True
         }
 
@@ -436,6 +1171,5 @@ async def chat_with_ai(request: ChatRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    import os
     port = int(os.environ.get("PORT", 8000))
     uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
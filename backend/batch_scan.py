@@ -0,0 +1,349 @@
+"""
+Scan a directory of leaf images with the disease model, offline.
+
+Works on class-folder dumps laid out like PlantVillage/<class>/<file> (the
+folder name is kept as the label, and accuracy is reported when labels
+match the model's classes) and on flat folders. Images are decoded and
+resized by a pool of worker processes while the main process runs batches
+through the same model and serving function the API uses.
+
+Results are written as the scan goes, so an interrupted run picks up where
+it stopped when rerun with the same arguments: images already in the
+output are skipped. A .csv output is appended to and flushed after every
+batch. A .parquet output is a directory of part files (readable with
+pandas.read_parquet), each written atomically with the same schema; it needs
+pyarrow. Only rows in finished parts count as done, and a part is written
+every --rows-per-part rows or PART_FLUSH_SECONDS, so a crash redoes at most
+that much work. Files that can't be decoded are recorded with their error
+and not retried.
+
+Usage:
+    cd backend
+    python batch_scan.py ../../PlantVillage/PlantVillage --output scan.csv
+    python batch_scan.py /data/lab_dump --output scan.parquet --workers 8 --batch-size 64
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from image_io import InvalidImage, load_rgb, open_image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff"}
+
+COLUMNS = ["path", "label", "class_name", "crop", "disease", "is_healthy", "confidence", "error"]
+
+# Longest a Parquet part stays buffered, i.e. the most work a crash can lose
+PART_FLUSH_SECONDS = 30.0
+
+
+def list_images(directory: Path) -> Iterator[str]:
+    """Image paths under a directory, relative to it, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+def decode_chunk(directory: str, paths: Sequence[str],
+                 input_size: Tuple[int, int]) -> List[Tuple[str, Optional[np.ndarray], Optional[str]]]:
+    """
+    Decode and resize images in a worker process. Returns (path, uint8 pixels
+    or None, error) per image; scaling to [0, 1] happens in the main process
+    so that a quarter of the bytes cross the process boundary.
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(os.path.join(directory, path), "rb") as f:
+                img = load_rgb(open_image(f.read()), target_size=input_size[::-1])
+            # The same resize as inference.preprocess_image()
+            results.append((path, np.asarray(img.resize(input_size[::-1]), dtype=np.uint8), None))
+        except (OSError, InvalidImage) as e:
+            results.append((path, None, str(e)))
+    return results
+
+
+class CsvResults:
+    """Results appended to a CSV file, flushed to disk after every write."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def completed(self) -> Set[str]:
+        if not self.path.exists():
+            return set()
+        # Drop a row cut short by an interruption
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return {row["path"] for row in csv.DictReader(f)}
+
+    def open(self):
+        new = not self.path.exists() or self.path.stat().st_size == 0
+        self._file = open(self.path, "a", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        if new:
+            self._writer.writeheader()
+
+    def write(self, rows: List[dict]):
+        self._writer.writerows(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetResults:
+    """Results written as numbered Parquet part files in a directory."""
+
+    def __init__(self, path: Path, rows_per_part: int):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs pyarrow (pip install pyarrow); or write to a .csv file")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        # Fixed, so a part of only error rows (nulls) matches the others
+        self.schema = pyarrow.schema([
+            ("path", pyarrow.string()),
+            ("label", pyarrow.string()),
+            ("class_name", pyarrow.string()),
+            ("crop", pyarrow.string()),
+            ("disease", pyarrow.string()),
+            ("is_healthy", pyarrow.bool_()),
+            ("confidence", pyarrow.float64()),
+            ("error", pyarrow.string()),
+        ])
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def _parts(self) -> List[Path]:
+        return sorted(self.path.glob("part-*.parquet")) if self.path.is_dir() else []
+
+    def completed(self) -> Set[str]:
+        done = set()
+        for part in self._parts():
+            done.update(self.pq.read_table(part, columns=["path"]).column("path").to_pylist())
+        return done
+
+    def open(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        parts = self._parts()
+        self._next = int(parts[-1].stem.split("-")[1]) + 1 if parts else 0
+
+    def write(self, rows: List[dict]):
+        self._buffer.extend(rows)
+        if (len(self._buffer) >= self.rows_per_part
+                or time.monotonic() - self._last_flush >= PART_FLUSH_SECONDS):
+            self._flush()
+
+    def close(self):
+        self._flush()
+
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        table = self.pa.Table.from_pylist(self._buffer, schema=self.schema)
+        part = self.path / f"part-{self._next:05d}.parquet"
+        tmp = part.with_suffix(".tmp")
+        self.pq.write_table(table, tmp)
+        os.replace(tmp, part)  # A part is either complete or absent
+        self._next += 1
+        self._buffer = []
+
+
+class Progress:
+    """Prints throughput over the last minute and the ETA every few seconds."""
+
+    def __init__(self, total: int, interval: float = 5.0, window: float = 60.0):
+        self.total = total
+        self.interval = interval
+        self.window = window
+        self.done = 0
+        self.start = time.monotonic()
+        self._samples = deque([(self.start, 0)])
+        self._last_report = self.start
+
+    def update(self, count: int):
+        self.done += count
+        now = time.monotonic()
+        self._samples.append((now, self.done))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def rate(self) -> float:
+        (start, first), (end, last) = self._samples[0], self._samples[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    def report(self):
+        rate = self.rate()
+        remaining = self.total - self.done
+        eta = format_duration(remaining / rate) if rate > 0 else "?"
+        print(f"{self.done}/{self.total} images ({self.done / max(self.total, 1):.1%}), "
+              f"{rate:.1f} images/s, ETA {eta}", flush=True)
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def iter_decoded(executor: ProcessPoolExecutor, directory: Path, paths: List[str], chunk_size: int,
+                 input_size: Tuple[int, int], max_pending: int):
+    """Decoded chunks in order, with at most max_pending chunks in flight or waiting."""
+    chunks = (paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size))
+    pending = deque()
+    for chunk in chunks:
+        pending.append(executor.submit(decode_chunk, str(directory), chunk, input_size))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def scan(directory: Path, results, paths: List[str], version, workers: int, batch_size: int,
+         chunk_size: int) -> Tuple[int, Counter]:
+    """Classify the images, writing rows as batches finish. Returns errors and label outcomes."""
+    import inference
+
+    classes = set(version.class_names.values())
+    progress = Progress(len(paths))
+    errors = 0
+    accuracy = Counter()
+    batch: List[Tuple[str, np.ndarray]] = []
+
+    def label_of(path: str) -> str:
+        parent = os.path.dirname(path)
+        return os.path.basename(parent) if parent else ""
+
+    def run_batch():
+        probabilities = inference.predict_disease_batch(
+            np.stack([pixels for _, pixels in batch]).astype(np.float32) / 255.0, version
+        )
+        rows = []
+        for (path, _), probs in zip(batch, probabilities):
+            class_id = int(np.argmax(probs))
+            name = version.class_names.get(class_id, f"Unknown_{class_id}")
+            info = inference.parse_disease_class(name)
+            label = label_of(path)
+            if label in classes:
+                accuracy["correct" if label == name else "wrong"] += 1
+            rows.append({
+                "path": path, "label": label, "class_name": name, "crop": info["crop"],
+                "disease": info["disease"], "is_healthy": info["is_healthy"],
+                "confidence": round(float(probs[class_id]), 6), "error": "",
+            })
+        results.write(rows)
+        progress.update(len(rows))
+        batch.clear()
+
+    # Spawn rather than fork: the main process runs TensorFlow's thread pools
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        for decoded in iter_decoded(executor, directory, paths, chunk_size, version.input_size,
+                                    max_pending=workers * 4):
+            failed = []
+            for path, pixels, error in decoded:
+                if pixels is None:
+                    failed.append({**dict.fromkeys(COLUMNS, ""), "path": path, "label": label_of(path),
+                                   "is_healthy": None, "confidence": None, "error": error})
+                else:
+                    batch.append((path, pixels))
+                    if len(batch) >= batch_size:
+                        run_batch()
+            if failed:
+                errors += len(failed)
+                results.write(failed)
+                progress.update(len(failed))
+        if batch:
+            run_batch()
+    progress.report()
+    return errors, accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", type=Path, help="Folder of images, flat or one subfolder per class")
+    parser.add_argument("--output", type=Path, default=Path("batch_scan.csv"), help="A .csv file or .parquet directory")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decoding processes")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per model call")
+    parser.add_argument("--chunk-size", type=int, default=16, help="Images per decoding task")
+    parser.add_argument("--rows-per-part", type=int, default=1000, help="Most rows per Parquet part file")
+    parser.add_argument("--limit", type=int, help="Scan at most this many images (after skipping finished ones)")
+    parser.add_argument("--restart", action="store_true", help="Ignore and replace existing results")
+    parser.add_argument("--model-dir", type=Path, help="Directory with the disease model (default: MODEL_DIR)")
+    args = parser.parse_args()
+
+    import inference
+
+    if args.output.suffix == ".parquet":
+        results = ParquetResults(args.output, args.rows_per_part)
+    elif args.output.suffix == ".csv":
+        results = CsvResults(args.output)
+    else:
+        sys.exit("--output must end in .csv or .parquet")
+
+    if args.restart and args.output.exists():
+        if args.output.is_dir():
+            for part in args.output.glob("part-*.parquet"):
+                part.unlink()
+        else:
+            args.output.unlink()
+
+    print(f"Listing images in {args.directory}...", flush=True)
+    paths = list(list_images(args.directory))
+    done = results.completed()
+    todo = [path for path in paths if path not in done]
+    print(f"{len(paths)} images, {len(paths) - len(todo)} already scanned, {len(todo)} to go", flush=True)
+    if args.limit:
+        todo = todo[:args.limit]
+    if not todo:
+        return
+
+    model_dir = args.model_dir or inference.MODEL_DIR
+    inference.configure_threads()
+    try:
+        version = inference.read_disease_model(model_dir)
+    except Exception as e:
+        sys.exit(f"Could not load the disease model from {model_dir} (run train_models.py first): {e}")
+
+    results.open()
+    start = time.monotonic()
+    try:
+        errors, accuracy = scan(args.directory, results, todo, version, args.workers,
+                                args.batch_size, args.chunk_size)
+    except KeyboardInterrupt:
+        results.close()
+        sys.exit(f"Interrupted; results so far are in {args.output}. Rerun the same command to resume.")
+    results.close()
+
+    elapsed = time.monotonic() - start
+    print(f"Scanned {len(todo)} images in {format_duration(elapsed)} ({len(todo) / elapsed:.1f} images/s), "
+          f"{errors} could not be decoded; results in {args.output}")
+    labelled = accuracy["correct"] + accuracy["wrong"]
+    if labelled:
+        print(f"Accuracy on {labelled} images whose folder names a model class: {accuracy['correct'] / labelled:.2%}")
+
+
+if __name__ == "__main__":
+    main()
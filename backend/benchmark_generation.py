@@ -0,0 +1,76 @@
+"""
+Measure tokens/sec of the local generation worker (local_generator.py) as the
+number of concurrent requests grows, against one-at-a-time generation.
+
+Usage:
+    cd backend
+    python benchmark_generation.py --concurrency 1 4 8 16 --max-new-tokens 64
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from local_generator import LOCAL_LM_MODEL, LocalGenerator
+
+PROMPTS = [
+    "As an agricultural expert, provide farming advice for rice cultivation:",
+    "How can I improve soil fertility naturally?",
+    "What could cause yellow leaves in my tomato plants?",
+    "When is the best time to plant wheat in North India?",
+    "How much water does cotton need during the flowering stage?",
+    "Describe treatment options for late blight in potatoes:",
+]
+
+
+def run(generator: LocalGenerator, concurrency: int, requests_per_client: int, max_new_tokens: int) -> dict:
+    before = generator.stats()["tokens_generated"]
+    latencies = []
+
+    def client(index):
+        for i in range(requests_per_client):
+            prompt = PROMPTS[(index + i) % len(PROMPTS)]
+            start = time.perf_counter()
+            generator.generate(prompt, max_new_tokens=max_new_tokens)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    tokens = generator.stats()["tokens_generated"] - before
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "tokens": tokens,
+        "tokens_per_second": tokens / elapsed,
+        "p50_latency": latencies[len(latencies) // 2],
+        "p95_latency": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=LOCAL_LM_MODEL)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--requests-per-client", type=int, default=3)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--max-batch-size", type=int, default=16)
+    parser.add_argument("--threads", type=int, default=0, help="torch threads (0 = half the cores)")
+    args = parser.parse_args()
+
+    generator = LocalGenerator(args.model, max_batch_size=args.max_batch_size, num_threads=args.threads)
+    # Warm up so one-time allocation isn't counted
+    generator.generate(PROMPTS[0], max_new_tokens=8)
+
+    print(f"{'clients':>7} {'tokens':>7} {'tokens/s':>9} {'p50 (s)':>8} {'p95 (s)':>8}")
+    for concurrency in args.concurrency:
+        r = run(generator, concurrency, args.requests_per_client, args.max_new_tokens)
+        print(f"{r['concurrency']:>7} {r['tokens']:>7} {r['tokens_per_second']:>9.1f} "
+              f"{r['p50_latency']:>8.2f} {r['p95_latency']:>8.2f}")
+
+    generator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compare per-call latency of the disease model served through model.predict()
+against the traced serving function (inference.build_disease_fn), with and
+without XLA, for single images and small batches.
+
+Usage:
+    cd backend
+    python benchmark_inference.py --batch-sizes 1 4 8 --iterations 200
+"""
+import argparse
+import time
+
+import numpy as np
+
+import inference
+
+
+def time_calls(fn, batch: np.ndarray, iterations: int) -> np.ndarray:
+    # Warm up so tracing and compilation aren't counted
+    for _ in range(5):
+        fn(batch)
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(batch)
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--no-xla", action="store_true", help="Skip the XLA variant")
+    args = parser.parse_args()
+
+    inference.configure_threads()
+    inference.load_disease_model()
+    if inference.disease_model is None:
+        print(f"Disease model not found in {inference.MODEL_DIR}; run train_models.py first")
+        return
+
+    model = inference.disease_model
+    height, width = inference.disease_input_size
+    traced = inference.build_disease_fn(model, inference.disease_input_size)
+    # Include the conversion back to numpy, as the serving path does
+    variants = {
+        "predict": lambda batch: model.predict(batch, verbose=0),
+        "traced": lambda batch: traced(batch).numpy(),
+    }
+    if not args.no_xla:
+        try:
+            traced_xla = inference.build_disease_fn(model, inference.disease_input_size, jit_compile=True)
+            variants["traced+xla"] = lambda batch: traced_xla(batch).numpy()
+        except Exception as e:
+            print(f"XLA compilation failed, skipping: {e}")
+
+    print(f"Input size {height}x{width}, {args.iterations} calls per cell")
+    print(f"{'variant':<12} {'batch':>5} {'mean (ms)':>10} {'p50 (ms)':>9} {'p95 (ms)':>9} {'images/s':>9}")
+    rng = np.random.default_rng(0)
+    for batch_size in args.batch_sizes:
+        batch = rng.random((batch_size, height, width, 3), dtype=np.float32)
+        for name, fn in variants.items():
+            ms = time_calls(fn, batch, args.iterations)
+            print(f"{name:<12} {batch_size:>5} {ms.mean():>10.2f} {np.percentile(ms, 50):>9.2f} "
+                  f"{np.percentile(ms, 95):>9.2f} {batch_size / ms.mean() * 1000:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
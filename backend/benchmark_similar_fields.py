@@ -0,0 +1,98 @@
+"""
+Latency of the similar fields index (similar_fields.py) as it grows.
+
+For each index size, reports the build time, single-query latency of the
+KD-tree against blocked brute force, batch throughput of both, and the cost
+of querying with a full append buffer. Rows are drawn from
+Crop_recommendation.csv with jitter when it is available, otherwise from
+uniform ranges of the same features.
+
+Usage:
+    cd backend
+    python benchmark_similar_fields.py --sizes 2200 100000 1000000 --k 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from similar_fields import CROP_DATASET_PATH, SIMILAR_FIELDS_MIN_REBUILD, SimilarFieldsIndex, brute_force_knn
+
+# Rough feature ranges (N, P, K, temperature, humidity, ph, rainfall)
+LOW = np.array([0, 5, 5, 8, 14, 3.5, 20])
+HIGH = np.array([140, 145, 205, 44, 100, 10, 300])
+
+
+def load_base_rows():
+    try:
+        return SimilarFieldsIndex.from_csv(CROP_DATASET_PATH)._snapshot.rows
+    except OSError:
+        return None
+
+
+def sample_rows(count: int, rng: np.random.Generator, base) -> np.ndarray:
+    if base is None:
+        return LOW + rng.random((count, len(LOW))) * (HIGH - LOW)
+    rows = base[rng.integers(0, len(base), count)]
+    return rows + rng.normal(0, 0.02, rows.shape) * (HIGH - LOW)
+
+
+def latency_ms(fn, repeats: int) -> np.ndarray:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2200, 10000, 100000, 1000000])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200, help="Single queries timed per size")
+    parser.add_argument("--batch", type=int, default=1024, help="Rows per batch query")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    base = load_base_rows()
+    print(f"Sampling rows from {CROP_DATASET_PATH if base is not None else 'uniform feature ranges'}")
+    print(f"{'rows':>9} {'build (s)':>9} {'tree p50':>9} {'tree p95':>9} {'brute p50':>9} "
+          f"{'tree batch/s':>12} {'brute batch/s':>13} {'+buffer p50':>11}")
+    for size in args.sizes:
+        rows = sample_rows(size, rng, base)
+        labels = np.full(size, "crop")
+
+        start = time.perf_counter()
+        index = SimilarFieldsIndex(rows, labels, np.full(size, "dataset"))
+        build = time.perf_counter() - start
+
+        queries = sample_rows(args.queries, rng, base)
+        snapshot = index._snapshot
+        scaled = (rows - snapshot.mean) / snapshot.scale
+        it = iter(queries)
+        tree = latency_ms(lambda: index.query([next(it)], args.k), args.queries)
+        it = iter(queries)
+        brute = latency_ms(
+            lambda: brute_force_knn(scaled, (next(it)[None, :] - snapshot.mean) / snapshot.scale, args.k),
+            min(args.queries, 20)
+        )
+
+        batch = (sample_rows(args.batch, rng, base) - snapshot.mean) / snapshot.scale
+        tree_batch = latency_ms(lambda: snapshot.tree.query(batch, k=args.k), 3).mean() / 1000
+        brute_batch = latency_ms(lambda: brute_force_knn(scaled, batch, args.k), 1).mean() / 1000
+
+        # Fill the append buffer to just below the rebuild threshold
+        for row in sample_rows(SIMILAR_FIELDS_MIN_REBUILD - 1, rng, base):
+            index.append(row, "crop")
+        it = iter(queries)
+        buffered = latency_ms(lambda: index.query([next(it)], args.k), args.queries)
+
+        print(f"{size:>9} {build:>9.2f} {np.percentile(tree, 50):>9.3f} {np.percentile(tree, 95):>9.3f} "
+              f"{np.percentile(brute, 50):>9.3f} {args.batch / tree_batch:>12.0f} {args.batch / brute_batch:>13.0f} "
+              f"{np.percentile(buffered, 50):>11.3f}")
+    print("Latencies in ms; batch columns in queries/s")
+
+
+if __name__ == "__main__":
+    main()
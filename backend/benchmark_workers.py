@@ -0,0 +1,162 @@
+"""
+Benchmark memory per worker and aggregate throughput of the multi-worker
+gunicorn setup (see gunicorn.conf.py) as the number of workers grows.
+
+RSS counts shared copy-on-write pages once per worker, so PSS (proportional set
+size, shared pages divided between the processes using them) is reported as
+well. Linux only, since it reads /proc.
+
+Usage:
+    cd backend
+    python benchmark_workers.py --workers 1 2 4 --duration 20
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+SAMPLE_CROP_REQUEST = {
+    "N": 90, "P": 42, "K": 43,
+    "temperature": 20.8, "humidity": 82.0, "ph": 6.5, "rainfall": 202.9,
+    "user_id": "benchmark",
+    "language": "en"
+}
+
+
+def read_memory_kb(pid: int) -> dict:
+    """Return RSS and PSS in kB for a process."""
+    memory = {"rss": 0, "pss": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "Rss":
+                    memory["rss"] = int(value.split()[0])
+                elif key == "Pss":
+                    memory["pss"] = int(value.split()[0])
+    except FileNotFoundError:
+        pass
+    return memory
+
+
+def child_pids(pid: int) -> list:
+    """Return the PIDs of the direct children of a process."""
+    children = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces, so split after its closing paren
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        if ppid == pid:
+            children.append(int(entry.name))
+    return children
+
+
+def wait_until_ready(url: str, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{url}/docs", timeout=2).status_code == 200:
+                return True
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(1)
+    return False
+
+
+def run_load(url: str, duration: float, concurrency: int, path: str) -> dict:
+    """Send requests from `concurrency` threads for `duration` seconds."""
+    deadline = time.time() + duration
+
+    def worker():
+        session = requests.Session()
+        ok = failed = 0
+        while time.time() < deadline:
+            try:
+                response = session.post(f"{url}{path}", json=SAMPLE_CROP_REQUEST, timeout=60)
+                if response.status_code == 200:
+                    ok += 1
+                else:
+                    failed += 1
+            except requests.exceptions.RequestException:
+                failed += 1
+        return ok, failed
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: worker(), range(concurrency)))
+    elapsed = time.time() - start
+
+    ok = sum(r[0] for r in results)
+    failed = sum(r[1] for r in results)
+    return {"ok": ok, "failed": failed, "throughput": ok / elapsed}
+
+
+def benchmark(workers: int, args) -> dict:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), PORT=str(args.port))
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        if not wait_until_ready(url, args.startup_timeout):
+            raise RuntimeError(f"Server with {workers} workers did not start")
+
+        load = run_load(url, args.duration, args.concurrency, args.path)
+
+        # Measure after the load so that lazily touched pages are counted
+        worker_memory = [read_memory_kb(pid) for pid in child_pids(master.pid)]
+        master_memory = read_memory_kb(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+    n = max(1, len(worker_memory))
+    return {
+        "workers": workers,
+        "master_rss_mb": master_memory["rss"] / 1024,
+        "worker_rss_mb": sum(m["rss"] for m in worker_memory) / n / 1024,
+        "worker_pss_mb": sum(m["pss"] for m in worker_memory) / n / 1024,
+        "total_pss_mb": (master_memory["pss"] + sum(m["pss"] for m in worker_memory)) / 1024,
+        **load,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=20.0, help="Load duration per run in seconds")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent client threads")
+    parser.add_argument("--path", default="/recommend_crop")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        print(f"Benchmarking {workers} worker(s)...")
+        results.append(benchmark(workers, args))
+
+    print(f"\n{'workers':>7} {'master RSS':>11} {'worker RSS':>11} {'worker PSS':>11} "
+          f"{'total PSS':>10} {'req/s':>8} {'failed':>7}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['master_rss_mb']:>9.0f}MB {r['worker_rss_mb']:>9.0f}MB "
+              f"{r['worker_pss_mb']:>9.0f}MB {r['total_pss_mb']:>8.0f}MB "
+              f"{r['throughput']:>8.1f} {r['failed']:>7}")
+
+
+if __name__ == "__main__":
+    main()
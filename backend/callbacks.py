@@ -0,0 +1,86 @@
+"""
+Validation and delivery of client-supplied callback URLs.
+
+Enrichments and jobs can POST their result to a URL the client sends, so
+without checks anyone could make the server send requests into its own
+network (cloud metadata, admin ports, other internal services). A callback
+URL must:
+
+- use https;
+- name a host that resolves only to public addresses, so no private,
+  loopback, link-local or reserved ones;
+- match CALLBACK_ALLOWED_HOSTS when that is set. Entries are comma-separated
+  host names, and ".example.com" allows any subdomain.
+
+URLs are checked when the request arrives (an invalid one gets a 400) and
+again right before delivery. Redirects are not followed. Certificates are
+verified, which also defeats DNS rebinding between the check and the
+connection: an internal address can't present a valid certificate for the
+callback's host name.
+"""
+import ipaddress
+import logging
+import os
+import socket
+from typing import List, Union
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CALLBACK_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv("CALLBACK_ALLOWED_HOSTS", "").split(",") if host.strip()
+]
+CALLBACK_TIMEOUT = 5
+
+
+class InvalidCallbackUrl(ValueError):
+    """Raised when a callback URL isn't allowed."""
+
+
+def _host_allowed(host: str, allowed: List[str]) -> bool:
+    return any(host == entry or entry.startswith(".") and host.endswith(entry) for entry in allowed)
+
+
+def _resolve(host: str, port: int) -> List[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise InvalidCallbackUrl(f"Callback host {host} does not resolve") from e
+    # Drop any IPv6 scope ID ("fe80::1%eth0")
+    return [ipaddress.ip_address(info[4][0].split("%")[0]) for info in infos]
+
+
+def validate_callback_url(url: str, allowed_hosts: List[str] = CALLBACK_ALLOWED_HOSTS) -> str:
+    """Return the URL if the server may POST to it; raises InvalidCallbackUrl otherwise."""
+    try:
+        parts = urlsplit(url)
+        port = parts.port or 443
+    except ValueError as e:
+        raise InvalidCallbackUrl("Malformed callback URL") from e
+    if parts.scheme != "https" or not parts.hostname:
+        raise InvalidCallbackUrl("Callback URL must be an https:// URL")
+    if parts.username or parts.password:
+        raise InvalidCallbackUrl("Callback URL must not contain credentials")
+    host = parts.hostname.lower().rstrip(".")
+    if allowed_hosts and not _host_allowed(host, allowed_hosts):
+        raise InvalidCallbackUrl(f"Callback host {host} is not allowed")
+    for address in _resolve(host, port):
+        if not address.is_global:
+            raise InvalidCallbackUrl(f"Callback host {host} resolves to a non-public address")
+    return url
+
+
+def post_callback(url: str, payload: dict, timeout: float = CALLBACK_TIMEOUT) -> bool:
+    """POST a JSON payload to a callback URL; logs and returns False on failure."""
+    try:
+        validate_callback_url(url)
+        response = requests.post(url, json=payload, timeout=timeout, allow_redirects=False)
+        response.raise_for_status()
+        return True
+    except InvalidCallbackUrl as e:
+        logger.warning(f"Refused callback to {url}: {e}")
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Callback to {url} failed: {e}")
+    return False
@@ -0,0 +1,145 @@
+"""
+Circuit breaker for slow or failing upstream services.
+
+While an upstream (e.g. the Hugging Face Inference API) is healthy the breaker
+is closed and every call goes through. When too many recent calls fail or are
+slow, it opens and callers skip the upstream entirely, so users get the
+fallback immediately instead of waiting for the same timeout. After a cooldown
+it goes half-open and lets a single probe call through: success closes it,
+failure opens it again.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "5"))
+BREAKER_SLOW_CALL_RATE = float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker driven by the error rate and latency of recent calls."""
+
+    def __init__(self, name: str, window_seconds: float = BREAKER_WINDOW_SECONDS,
+                 min_calls: int = BREAKER_MIN_CALLS, failure_rate: float = BREAKER_FAILURE_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate: float = BREAKER_SLOW_CALL_RATE,
+                 open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at = None
+        self._calls = deque()  # (timestamp, failed, slow) within the window
+        self._transitions = deque(maxlen=20)
+        self._counts = {"successes": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def allow_request(self) -> bool:
+        """Return True if the caller may call the upstream now."""
+        now = time.monotonic()
+        with self._lock:
+            if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN, "cooldown elapsed")
+
+            if self._state == CLOSED:
+                return True
+            # Half-open: one probe at a time; a probe that never reported back
+            # (e.g. its thread died) is given up on after the cooldown
+            if self._state == HALF_OPEN and (
+                self._probe_started_at is None or now - self._probe_started_at >= self.open_seconds
+            ):
+                self._probe_started_at = now
+                return True
+
+            self._counts["rejected"] += 1
+            return False
+
+    def record_success(self, latency: float):
+        self._record(False, latency)
+
+    def record_failure(self, latency: float):
+        self._record(True, latency)
+
+    def snapshot(self) -> dict:
+        """State, recent call statistics and transitions, for metrics."""
+        with self._lock:
+            self._trim(time.monotonic())
+            calls = len(self._calls)
+            return {
+                "name": self.name,
+                "state": self._state,
+                "window_calls": calls,
+                "window_failure_rate": sum(c[1] for c in self._calls) / calls if calls else 0.0,
+                "window_slow_rate": sum(c[2] for c in self._calls) / calls if calls else 0.0,
+                **self._counts,
+                "transitions": list(self._transitions)
+            }
+
+    def _record(self, failed: bool, latency: float):
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            self._counts["failures" if failed else "successes"] += 1
+
+            if self._state == HALF_OPEN:
+                self._probe_started_at = None
+                if failed:
+                    self._open(now, "probe failed")
+                else:
+                    self._calls.clear()
+                    self._transition(CLOSED, f"probe succeeded in {latency:.2f}s")
+                return
+            if self._state == OPEN:
+                # A call that started before the breaker opened
+                return
+
+            self._calls.append((now, failed, slow))
+            self._trim(now)
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            failure_rate = sum(c[1] for c in self._calls) / calls
+            slow_rate = sum(c[2] for c in self._calls) / calls
+            if failure_rate >= self.failure_rate:
+                self._open(now, f"failure rate {failure_rate:.0%} over {calls} calls")
+            elif slow_rate >= self.slow_call_rate:
+                self._open(now, f"slow call rate {slow_rate:.0%} over {calls} calls")
+
+    def _open(self, now: float, reason: str):
+        self._opened_at = now
+        self._counts["opened"] += 1
+        self._calls.clear()
+        self._transition(OPEN, reason)
+
+    def _transition(self, state: str, reason: str):
+        logger.warning(f"Circuit breaker {self.name}: {self._state} -> {state} ({reason})")
+        self._transitions.append({"from": self._state, "to": state, "reason": reason, "at": time.time()})
+        self._state = state
+
+    def _trim(self, now: float):
+        cutoff = now - self.window_seconds
+        while self._calls and self._calls[0][0] < cutoff:
+            self._calls.popleft()
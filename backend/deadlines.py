@@ -0,0 +1,129 @@
+"""
+Per-request time budgets.
+
+DeadlineMiddleware gives every request to a budgeted endpoint a deadline,
+either the endpoint's default or the one the client sends in the
+X-Request-Timeout-Ms header (capped at DEADLINE_MAX_SECONDS). The deadline
+lives in a context variable, so every stage of the request, including code
+run in the threadpool, can ask how much time is left, cap its own timeouts,
+and skip optional work (LLM advice, translation, persistence) that no longer
+fits. Skipped stages are recorded so the response can report them.
+
+Code running outside a request (background enrichment, job workers) has no
+deadline and is never skipped.
+"""
+import contextvars
+import os
+import time
+from typing import List, Optional
+
+import tracing
+
+DEADLINE_HEADER = "x-request-timeout-ms"
+DEADLINE_MAX_SECONDS = float(os.getenv("DEADLINE_MAX_SECONDS", "60"))
+
+# Default budget per endpoint, in seconds
+ENDPOINT_DEADLINES = {
+    "/recommend_crop": float(os.getenv("RECOMMEND_CROP_DEADLINE_SECONDS", "15")),
+    "/detect_disease": float(os.getenv("DETECT_DISEASE_DEADLINE_SECONDS", "20")),
+    "/detect_disease/tiled": float(os.getenv("DETECT_DISEASE_TILED_DEADLINE_SECONDS", "60")),
+    "/chat": float(os.getenv("CHAT_DEADLINE_SECONDS", "25")),
+}
+
+# Time a stage needs to be worth starting
+LLM_MIN_SECONDS = float(os.getenv("LLM_MIN_SECONDS", "3"))
+TRANSLATION_MIN_SECONDS = float(os.getenv("TRANSLATION_MIN_SECONDS", "2"))
+PERSISTENCE_MIN_SECONDS = float(os.getenv("PERSISTENCE_MIN_SECONDS", "0.5"))
+
+
+class Deadline:
+    """A point in time a request must finish by, plus the stages it skipped."""
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+        self.skipped = []
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, or None outside a request."""
+    deadline = _current.get()
+    return deadline.remaining() if deadline else None
+
+
+def has_time(seconds: float) -> bool:
+    """True if at least `seconds` are left (always True outside a request)."""
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def cap_timeout(timeout: float) -> float:
+    """Shorten a timeout so it ends no later than the current deadline."""
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+def skip(stage: str):
+    """Record that an optional stage was skipped to stay within the deadline."""
+    deadline = _current.get()
+    if deadline and stage not in deadline.skipped:
+        deadline.skipped.append(stage)
+        tracing.event("skipped", stage=stage, remaining=round(deadline.remaining(), 3))
+
+
+def skipped_stages() -> List[str]:
+    deadline = _current.get()
+    return list(deadline.skipped) if deadline else []
+
+
+def parse_budget(header_value: Optional[str], default: float) -> float:
+    """Budget in seconds from the header (milliseconds) or the endpoint default."""
+    if header_value:
+        try:
+            budget = float(header_value) / 1000
+            if budget > 0:
+                return min(budget, DEADLINE_MAX_SECONDS)
+        except ValueError:
+            pass
+    return min(default, DEADLINE_MAX_SECONDS)
+
+
+class DeadlineMiddleware:
+    """ASGI middleware that starts the deadline for budgeted endpoints."""
+
+    def __init__(self, app, deadlines: Optional[dict] = None):
+        self.app = app
+        self.deadlines = ENDPOINT_DEADLINES if deadlines is None else deadlines
+
+    async def __call__(self, scope, receive, send):
+        default = self.deadlines.get(scope.get("path")) if scope["type"] == "http" else None
+        if default is None:
+            await self.app(scope, receive, send)
+            return
+
+        header = None
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1").lower() == DEADLINE_HEADER:
+                header = value.decode("latin-1")
+                break
+
+        token = _current.set(Deadline(parse_budget(header, default)))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
@@ -0,0 +1,82 @@
+"""
+Background LLM enrichment of rule-based advice.
+
+Endpoints answer immediately with rule-based advice and an enrichment ID; the
+slow LLM advice (and its translation) is generated on a small thread pool.
+Clients fetch the result with GET /enrichments/{id} (optionally long-polling)
+or have it POSTed to a callback URL once ready (see callbacks.py).
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from callbacks import post_callback
+
+logger = logging.getLogger(__name__)
+
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", "4"))
+ENRICHMENT_TTL = float(os.getenv("ENRICHMENT_TTL", "3600"))
+
+
+class EnrichmentStore:
+    """Runs enrichment jobs and keeps their results for ENRICHMENT_TTL seconds."""
+
+    def __init__(self, workers: int = ENRICHMENT_WORKERS, ttl: float = ENRICHMENT_TTL):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrichment")
+        self._ttl = ttl
+        self._records = {}
+        self._cond = threading.Condition()
+
+    def submit(self, fn: Callable[[], dict], callback_url: Optional[str] = None) -> str:
+        """Schedule fn() and return the enrichment ID for its result."""
+        enrichment_id = uuid.uuid4().hex
+        with self._cond:
+            self._evict_expired()
+            self._records[enrichment_id] = {
+                "enrichment_id": enrichment_id,
+                "status": "pending",
+                "created_at": time.time()
+            }
+        self._executor.submit(self._run, enrichment_id, fn, callback_url)
+        return enrichment_id
+
+    def get(self, enrichment_id: str, wait: float = 0) -> Optional[dict]:
+        """Return the record, waiting up to `wait` seconds for a pending one to finish."""
+        deadline = time.monotonic() + wait
+        with self._cond:
+            while True:
+                record = self._records.get(enrichment_id)
+                remaining = deadline - time.monotonic()
+                if record is None or record["status"] != "pending" or remaining <= 0:
+                    return dict(record) if record else None
+                self._cond.wait(remaining)
+
+    def _run(self, enrichment_id: str, fn: Callable[[], dict], callback_url: Optional[str]):
+        try:
+            update = {"status": "ready", "result": fn()}
+        except Exception as e:
+            logger.error(f"Enrichment {enrichment_id} failed: {e}")
+            update = {"status": "failed"}
+        update["completed_at"] = time.time()
+
+        with self._cond:
+            record = self._records.get(enrichment_id)
+            if record is None:
+                return
+            record.update(update)
+            record = dict(record)
+            self._cond.notify_all()
+
+        if callback_url:
+            # Checked on submission; checked again before sending (see callbacks.py)
+            post_callback(callback_url, record)
+
+    def _evict_expired(self):
+        cutoff = time.time() - self._ttl
+        expired = [k for k, r in self._records.items() if r["created_at"] < cutoff]
+        for key in expired:
+            del self._records[key]
@@ -0,0 +1,87 @@
+"""
+Measure the leaf prefilter (leaf_filter.py) on PlantVillage.
+
+Reports the false-reject rate per class and overall for a range of thresholds,
+the true-reject rate on an optional folder of non-leaf images, and the time
+spent per call. Run it before changing LEAF_PREFILTER_THRESHOLD; the default
+has not been measured this way yet.
+
+Usage:
+    cd backend
+    python evaluate_prefilter.py --dataset ../../PlantVillage/PlantVillage --negatives ~/non_leaf_photos
+"""
+import argparse
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+from PIL import Image
+
+from leaf_filter import LEAF_PREFILTER_THRESHOLD, leaf_score
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def list_images(directory: str, limit_per_dir: int):
+    """Yield (path, parent directory name) for images under a directory."""
+    for root, _, files in os.walk(directory):
+        images = sorted(f for f in files if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+        for name in images[:limit_per_dir]:
+            yield os.path.join(root, name), os.path.basename(root)
+
+
+def score_images(directory: str, limit_per_dir: int, input_size: int):
+    """Return per-class scores and the time spent in leaf_score()."""
+    scores = defaultdict(list)
+    timings = []
+    for path, label in list_images(directory, limit_per_dir):
+        try:
+            img = Image.open(path).convert("RGB").resize((input_size, input_size))
+        except OSError:
+            continue
+        start = time.perf_counter()
+        scores[label].append(leaf_score(img))
+        timings.append(time.perf_counter() - start)
+    return scores, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default="../../PlantVillage/PlantVillage", help="PlantVillage class folders")
+    parser.add_argument("--negatives", help="Folder of non-leaf images (selfies, screenshots, documents)")
+    parser.add_argument("--limit-per-class", type=int, default=500)
+    parser.add_argument("--input-size", type=int, default=224, help="Size of the decoded image the filter sees")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.02, 0.05, 0.1, 0.15, 0.2, 0.3])
+    args = parser.parse_args()
+
+    print(f"Scoring leaf images in {args.dataset}...")
+    scores, timings = score_images(args.dataset, args.limit_per_class, args.input_size)
+    if not timings:
+        print("No images found")
+        return
+
+    all_scores = np.concatenate([np.array(v) for v in scores.values()])
+    print(f"Scored {len(all_scores)} images in {len(scores)} classes")
+    print(f"Time per call: mean {np.mean(timings) * 1e6:.0f}us, p99 {np.percentile(timings, 99) * 1e6:.0f}us")
+
+    print(f"\nFalse-reject rate by threshold (current default: {LEAF_PREFILTER_THRESHOLD})")
+    header = f"{'class':<45}" + "".join(f"{t:>8.2f}" for t in args.thresholds)
+    print(header)
+    print("-" * len(header))
+    for label in sorted(scores):
+        values = np.array(scores[label])
+        print(f"{label[:45]:<45}" + "".join(f"{np.mean(values < t):>8.2%}" for t in args.thresholds))
+    print("-" * len(header))
+    print(f"{'overall':<45}" + "".join(f"{np.mean(all_scores < t):>8.2%}" for t in args.thresholds))
+
+    if args.negatives:
+        negative_scores, _ = score_images(args.negatives, args.limit_per_class, args.input_size)
+        negatives = np.concatenate([np.array(v) for v in negative_scores.values()]) if negative_scores else np.array([])
+        if len(negatives):
+            print(f"\nTrue-reject rate on {len(negatives)} non-leaf images")
+            print(f"{'':<45}" + "".join(f"{np.mean(negatives < t):>8.2%}" for t in args.thresholds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Gunicorn configuration for multi-worker serving of app.py.
+
+app.py is loaded once in the master process (preload_app) and the workers are
+forked afterwards, so the crop model and the similar-fields and knowledge
+indexes are shared copy-on-write between them. TensorFlow and torch are not
+fork-safe, so nothing imports them in the master: each worker loads the
+disease model and GPT-2 when it first needs them (MODEL_LAZY_LOAD=1, the
+default) and the chat cache's embedder on startup. Don't set MODEL_LAZY_LOAD=0
+under gunicorn.
+
+Usage:
+    cd backend
+    gunicorn -c gunicorn.conf.py app:app
+"""
+import gc
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", max(1, multiprocessing.cpu_count() // 2)))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = int(os.environ.get("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Load app.py (and with it the crop model) before forking
+preload_app = True
+
+# Split the cores between workers unless the thread counts were set explicitly.
+# This has to happen here, before app.py is imported by the preload.
+_threads_per_worker = str(max(1, multiprocessing.cpu_count() // workers))
+os.environ.setdefault("TF_INTRA_OP_THREADS", _threads_per_worker)
+os.environ.setdefault("TF_INTER_OP_THREADS", "1")
+os.environ.setdefault("TORCH_NUM_THREADS", _threads_per_worker)
+os.environ.setdefault("OMP_NUM_THREADS", _threads_per_worker)
+
+# The Firestore client talks gRPC, which needs fork support enabled when it is
+# created before the workers are forked
+os.environ.setdefault("GRPC_ENABLE_FORK_SUPPORT", "1")
+
+
+def when_ready(server):
+    # Move everything loaded so far out of the garbage collector's reach so
+    # that collections in the workers don't touch (and un-share) those pages
+    gc.freeze()
+    server.log.info(f"App preloaded, starting {workers} workers")
@@ -0,0 +1,196 @@
+"""
+Upload handling for image endpoints.
+
+Uploads are size-limited while they stream in, identified by their magic bytes
+and checked from the image header (dimensions, mode) before anything is
+decoded, so oversized files, junk and decompression bombs are rejected before
+they cost memory or CPU. Rejected uploads get the same 400 "Invalid image
+file" response as any other unusable image.
+"""
+import io
+import json
+import logging
+import os
+import warnings
+from typing import Optional, Tuple
+
+from fastapi import UploadFile
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# Field and drone photos for tiled analysis, which decodes them at reduced scale
+MAX_TILED_IMAGE_PIXELS = int(os.getenv("MAX_TILED_IMAGE_PIXELS", str(100_000_000)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Room for the multipart boundaries and form fields around the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+SUPPORTED_MODES = {"1", "L", "LA", "P", "RGB", "RGBA", "CMYK", "YCbCr", "I;16"}
+
+INVALID_IMAGE_DETAIL = "Invalid image file. Please upload a valid image."
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured byte limit."""
+
+
+class InvalidImage(Exception):
+    """Raised when an upload is not a supported, decodable image."""
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """Identify an image format from its leading magic bytes."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if head.startswith(b"BM"):
+        return "BMP"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "TIFF"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """
+    Read an uploaded image in chunks.
+    The magic bytes are checked on the first chunk and reading stops as soon
+    as the size limit is crossed.
+    """
+    first = await file.read(UPLOAD_CHUNK_SIZE)
+    if sniff_image_format(first[:16]) is None:
+        raise InvalidImage("Unrecognized image signature")
+
+    buffer = bytearray(first)
+    while True:
+        if len(buffer) > max_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_bytes} bytes")
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+
+def open_image(contents: bytes, max_pixels: int = MAX_IMAGE_PIXELS) -> Image.Image:
+    """
+    Open an image lazily and validate its header.
+    Only the header is parsed here; pixel data is decoded by load_rgb().
+    """
+    try:
+        # PIL warns above Image.MAX_IMAGE_PIXELS (89M by default) and raises
+        # above twice that. The limit is enforced below, so silence the warning
+        # here instead of changing PIL's process-wide settings
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            img = Image.open(io.BytesIO(contents))
+    except Image.DecompressionBombError as e:
+        raise InvalidImage(f"Image too large to decode: {e}")
+    except Exception as e:
+        raise InvalidImage(f"Cannot identify image: {e}")
+
+    width, height = img.size
+    if width <= 0 or height <= 0:
+        raise InvalidImage("Image has no pixels")
+    if width * height > max_pixels:
+        raise InvalidImage(f"Image has {width}x{height} pixels, limit is {max_pixels}")
+    if img.mode not in SUPPORTED_MODES:
+        raise InvalidImage(f"Unsupported image mode {img.mode}")
+    return img
+
+
+def load_rgb(img: Image.Image, target_size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """
+    Decode an opened image to RGB.
+    For JPEGs, a target size lets the decoder scale down by 1/2, 1/4 or 1/8 while
+    decoding, which is much cheaper than decoding full phone-camera resolution.
+    """
+    try:
+        if target_size is not None:
+            img.draft("RGB", target_size)
+        if img.mode == "RGB":
+            # convert() would decode and then copy the whole image
+            img.load()
+            return img
+        return img.convert("RGB")
+    except Image.DecompressionBombError as e:
+        raise InvalidImage(f"Image too large to decode: {e}")
+    except Exception as e:
+        raise InvalidImage(f"Cannot decode image: {e}")
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware that enforces a byte limit on multipart request bodies while
+    they stream in, before the form parser spools them to disk.
+    Requests announcing a larger Content-Length are rejected without reading the
+    body at all.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES, path_limits: Optional[dict] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.path_limits = path_limits or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.path_limits.get(scope["path"], self.max_bytes) + MULTIPART_OVERHEAD_BYTES
+        try:
+            content_length = int(headers.get(b"content-length", b"0"))
+        except ValueError:
+            content_length = 0
+        if content_length > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit and not rejected:
+                    rejected = True
+                    await self._reject(send, limit)
+                    # Tell the app the client went away so it stops parsing
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            # Drop whatever the app sends after we already answered
+            if not rejected:
+                await send(message)
+
+        await self.app(scope, limited_receive, guarded_send)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        logger.warning(f"Rejected upload larger than {limit} bytes")
+        body = json.dumps({"detail": INVALID_IMAGE_DETAIL}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 400,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,332 @@
+"""
+Model loading and inference shared by the API server (app.py), the Gradio
+app (../app.py) and offline tools.
+
+Call load_models() once at startup, then use the predict_* helpers. Module
+attributes (crop_model, disease_model, ...) are read at call time and are
+replaced when model_manager.py reloads the artifacts, so always access them as
+inference.<name> rather than importing the names directly.
+
+TensorFlow is imported only when the disease model is loaded, so the "crop"
+serving profile (SERVING_PROFILE=crop) never pays for it.
+"""
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+from PIL import Image
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = Path(os.getenv("MODEL_DIR", Path(__file__).resolve().parent / "models"))
+
+# "full" serves every feature; "crop" serves crop recommendation only and
+# never imports TensorFlow, torch or transformers
+SERVING_PROFILE = os.getenv("SERVING_PROFILE", "full").lower()
+CROP_ONLY = SERVING_PROFILE == "crop"
+
+CROP_FEATURES = ["N", "P", "K", "temperature", "humidity", "ph", "rainfall"]
+
+# Thread pools are sized per process. With several workers on one host, leaving
+# TensorFlow and torch at their defaults makes every worker grab all cores.
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+
+# Compile the disease serving function with XLA. XLA compiles once per
+# distinct batch size, so it pays off when batch sizes repeat.
+DISEASE_XLA = os.getenv("DISEASE_XLA", "0") == "1"
+
+crop_model = None  # Will be loaded as RandomForestClassifier
+disease = None  # Current DiseaseModel; the attributes below mirror it
+disease_model = None  # Will be loaded as tf.keras.Model
+disease_class_names = {}  # Will store disease class names (dict mapping class_id -> class_name)
+disease_input_size = (224, 224)  # (height, width), updated from the loaded model
+disease_fn = None  # Traced serving function, see build_disease_fn()
+
+
+class DiseaseModel:
+    """One loaded version of the disease model and everything needed to serve it."""
+
+    def __init__(self, model, class_names: dict, input_size: Tuple[int, int], fn=None):
+        self.model = model
+        self.class_names = class_names
+        self.input_size = input_size
+        self.fn = fn
+        self._traced = fn is None
+        self._trace_lock = threading.Lock()
+
+    def trace(self):
+        """
+        Trace (and with XLA compile) the serving function, once, in the process
+        that serves it; falls back to model.predict() if that fails.
+        """
+        if self._traced:
+            return
+        with self._trace_lock:
+            if self._traced:
+                return
+            height, width = self.input_size
+            try:
+                self.fn(np.zeros((1, height, width, 3), dtype=np.float32))
+            except Exception as e:
+                logger.warning(f"Could not compile disease serving function, using model.predict: {e}")
+                self.fn = None
+            self._traced = True
+
+
+_threads_configured = False
+
+
+def configure_threads():
+    """
+    Apply the per-process thread limits. Must run before the first TF op;
+    calling it again does nothing.
+    """
+    global _threads_configured
+    # The crop profile never loads TensorFlow or torch, so there is nothing to limit
+    if CROP_ONLY or _threads_configured:
+        return
+    _threads_configured = True
+
+    try:
+        import tensorflow as tf
+        if TF_INTRA_OP_THREADS:
+            tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+        if TF_INTER_OP_THREADS:
+            tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
+    except (ImportError, RuntimeError) as e:
+        logger.warning(f"Could not configure TensorFlow threads: {e}")
+
+    if TORCH_NUM_THREADS:
+        try:
+            import torch
+            torch.set_num_threads(TORCH_NUM_THREADS)
+        except Exception as e:
+            logger.warning(f"Could not configure torch threads: {e}")
+
+
+def read_crop_model(model_dir: Path = MODEL_DIR):
+    """Load the crop model from disk without making it current."""
+    # Memory-map the numpy arrays in the artifact. The trees copy their node
+    # arrays when unpickled, so most of the model is still private memory, but
+    # this avoids a second in-memory copy of the file while loading. Measured on
+    # a 100-tree, 22-class forest (52MB file, scikit-learn 1.3.2): 51MB instead
+    # of 104MB RSS growth on load, and 29MB instead of 40MB PSS per forked worker
+    return joblib.load(Path(model_dir) / "crop_rf.joblib", mmap_mode="r")
+
+
+def load_crop_model():
+    global crop_model
+    try:
+        crop_model = read_crop_model()
+        logger.info("Crop recommendation model loaded successfully")
+    except Exception as e:
+        logger.error(f"Error loading crop model: {e}")
+
+
+def read_disease_model(model_dir: Path = MODEL_DIR) -> DiseaseModel:
+    """Load the disease model, its classes and serving function without making them current."""
+    import tensorflow as tf
+
+    model_dir = Path(model_dir)
+    # Enable mixed precision for better performance on Apple Silicon
+    policy = tf.keras.mixed_precision.Policy('mixed_float16')
+    tf.keras.mixed_precision.set_global_policy(policy)
+    model = tf.keras.models.load_model(model_dir / "disease_mobilenet.h5")
+
+    # Use the input size the model was trained with
+    input_size = (224, 224)
+    _, height, width, _ = model.input_shape
+    if height and width:
+        input_size = (int(height), int(width))
+
+    # Load class indices and reverse them to get a class_id -> class_name mapping
+    class_indices = joblib.load(model_dir / "disease_classes.joblib")
+    class_names = {v: k for k, v in class_indices.items()}
+
+    try:
+        fn = build_disease_fn(model, input_size, jit_compile=DISEASE_XLA)
+    except Exception as e:
+        logger.warning(f"Could not build disease serving function, using model.predict: {e}")
+        fn = None
+    return DiseaseModel(model, class_names, input_size, fn)
+
+
+def install_disease_model(version: Optional[DiseaseModel]):
+    """
+    Make a loaded version current. Requests already holding the previous
+    version finish on it; it is freed once the last of them drops it.
+    """
+    global disease, disease_model, disease_class_names, disease_input_size, disease_fn
+    disease = version
+    disease_model = version.model if version else None
+    disease_class_names = version.class_names if version else {}
+    disease_input_size = version.input_size if version else (224, 224)
+    disease_fn = version.fn if version else None
+
+
+def load_disease_model():
+    try:
+        version = read_disease_model()
+        install_disease_model(version)
+        logger.info("Disease detection model loaded successfully")
+        logger.info(f"Disease model input size: {version.input_size}")
+        logger.info(f"Loaded {len(version.class_names)} disease classes")
+        logger.info(f"Disease serving function built: {version.fn is not None} (XLA: {DISEASE_XLA})")
+    except Exception as e:
+        logger.error(f"Error loading disease model: {e}")
+
+
+def build_disease_fn(model, input_size: Tuple[int, int], jit_compile: bool = False):
+    """
+    Wrap the model in a tf.function with a fixed [None, H, W, 3] float32
+    signature. Unlike model.predict(), calling it doesn't build a data adapter
+    and iterator each time, which dominates the cost of single images and
+    small batches: 6.5ms instead of 61ms per image for the MobileNetV2 of
+    train_models.py on one CPU core (benchmark_inference.py). It is traced on
+    first use, see DiseaseModel.trace().
+    """
+    import tensorflow as tf
+
+    height, width = input_size
+
+    @tf.function(
+        input_signature=[tf.TensorSpec([None, height, width, 3], tf.float32)],
+        jit_compile=jit_compile
+    )
+    def serve(images):
+        # The mixed precision policy makes outputs float16; return float32
+        return tf.cast(model(images, training=False), tf.float32)
+
+    return serve
+
+
+def load_models():
+    """Load the models the serving profile needs, logging (not raising) on failure."""
+    configure_threads()
+    load_crop_model()
+    if CROP_ONLY:
+        logger.info("Crop-only serving profile: disease model not loaded")
+    else:
+        load_disease_model()
+
+
+def preprocess_image(img: Image.Image, input_size: Optional[Tuple[int, int]] = None) -> np.ndarray:
+    """Resize a decoded RGB image to the model input and scale it to [0, 1]."""
+    img = img.resize((input_size or disease_input_size)[::-1])  # PIL takes (width, height)
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def predict_disease_batch(batch: np.ndarray, version: Optional[DiseaseModel] = None) -> np.ndarray:
+    """Return class probabilities for a batch of preprocessed images."""
+    version = version or disease
+    version.trace()
+    if version.fn is not None:
+        return version.fn(batch).numpy()
+    return np.asarray(version.model.predict(batch, verbose=0), dtype=np.float32)
+
+
+def predict_disease(images: Sequence[Image.Image], version: Optional[DiseaseModel] = None) -> List[dict]:
+    """
+    Classify decoded RGB images in a single forward pass (with the current
+    version unless one is given).
+    Returns one dict per image with class_id, class_name and confidence.
+    """
+    # Use one version throughout, even if a reload swaps in another meanwhile
+    version = version or disease
+    with tracing.span("preprocess", images=len(images)):
+        batch = np.stack([preprocess_image(img, version.input_size) for img in images])
+    with tracing.span("inference", model="disease", batch=len(batch)):
+        probabilities = predict_disease_batch(batch, version)
+
+    results = []
+    for probs in probabilities:
+        class_id = int(np.argmax(probs))
+        results.append({
+            "class_id": class_id,
+            "class_name": version.class_names.get(class_id, f"Unknown_{class_id}"),
+            "confidence": float(probs[class_id])
+        })
+    return results
+
+
+def predict_crop(rows: Sequence[Sequence[float]], model=None) -> List[Tuple[str, float]]:
+    """
+    Recommend a crop for each row of CROP_FEATURES values, with the given
+    model or the current one. Returns (crop, probability) pairs.
+    """
+    model = model or crop_model
+    probabilities = model.predict_proba(np.asarray(rows, dtype=np.float64))
+    best = np.argmax(probabilities, axis=1)
+    return [
+        (str(model.classes_[i]), float(probs[i]))
+        for i, probs in zip(best, probabilities)
+    ]
+
+
+def parse_disease_class(class_name: str) -> dict:
+    """
+    Parse disease class name to extract crop and disease information.
+    Format: Crop___Disease or Crop_Disease
+    Example: "Tomato___Late_blight" -> {"crop": "Tomato", "disease": "Late blight", "is_healthy": False}
+    """
+    # Replace underscores with spaces for better readability
+    parts = class_name.replace('___', '|').replace('__', '|').replace('_', ' ').split('|')
+
+    if len(parts) >= 2:
+        crop = parts[0].strip()
+        disease = parts[1].strip()
+        is_healthy = 'healthy' in disease.lower()
+
+        return {
+            "crop": crop,
+            "disease": disease if not is_healthy else "Healthy",
+            "is_healthy": is_healthy,
+            "full_name": class_name
+        }
+    else:
+        # Fallback for unexpected format
+        return {
+            "crop": "Unknown",
+            "disease": class_name,
+            "is_healthy": False,
+            "full_name": class_name
+        }
+
+
+def summarize_classes(counts: Dict[str, int], confidence_sums: Dict[str, float],
+                      unit: str = "images") -> Tuple[List[dict], Optional[dict]]:
+    """
+    Rank the classes predicted for several images (frames, tiles) by how many
+    images each won, with their mean confidence. Returns the ranking and the
+    dominant class: the most frequent disease, since a disease in a few images
+    matters more than the healthy ones around it, else the most frequent class.
+    """
+    classes = []
+    for name, count in sorted(counts.items(), key=lambda item: -item[1]):
+        info = parse_disease_class(name)
+        classes.append({
+            "class_name": name,
+            "crop": info["crop"],
+            "disease": info["disease"],
+            "is_healthy": info["is_healthy"],
+            unit: count,
+            "mean_confidence": round(confidence_sums[name] / count, 4),
+        })
+    diseased = [c for c in classes if not c["is_healthy"]]
+    return classes, (diseased or classes or [None])[0]
+
+
+def is_valid_plant_image(confidence: float, threshold: float = 0.3) -> bool:
+    """
+    Check if the image is a valid plant image based on confidence score.
+    If confidence is too low, it might be an invalid image.
+    """
+    return confidence >= threshold
@@ -0,0 +1,287 @@
+"""
+Persistent job queue for long-running analyses.
+
+Jobs are stored in a local SQLite database and processed by a bounded pool of
+worker threads, so HTTP connections don't have to stay open for model and LLM
+latency and bursts are queued instead of dropped. A job claimed by a worker
+holds a lease, renewed while the job runs however long it takes; if the
+process dies, the job is picked up again once the lease expires, so queued
+and interrupted jobs survive a restart. Several server
+processes can share one database file.
+
+Clients poll GET /jobs/{id} (optionally long-polling) or pass a callback URL
+that receives the finished job as a POST (see callbacks.py).
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from callbacks import post_callback
+
+logger = logging.getLogger(__name__)
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", str(24 * 3600)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attachment BLOB,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_expires_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+
+class QueueFull(Exception):
+    """Raised when JOB_MAX_QUEUED jobs are already waiting."""
+
+
+class JobError(Exception):
+    """Raised by a handler to fail a job with an HTTP-style status code."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class JobQueue:
+    """SQLite-backed queue with a pool of worker threads."""
+
+    def __init__(self, handlers: Dict[str, Callable[[dict, Optional[bytes]], dict]],
+                 db_path: str = JOBS_DB_PATH, workers: int = JOB_WORKERS,
+                 max_queued: int = JOB_MAX_QUEUED):
+        self.handlers = handlers
+        self.db_path = db_path
+        self.workers = workers
+        self.max_queued = max_queued
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._finished = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._active = set()  # IDs of the jobs this process is running
+        self._active_lock = threading.Lock()
+
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def start(self):
+        """Start the worker threads. Call after forking, e.g. on app startup."""
+        if self._running:
+            return
+        self._running = True
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._renew_leases, name="job-leases", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        logger.info(f"Job queue started with {self.workers} workers ({self.db_path})")
+
+    def stop(self):
+        self._running = False
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def submit(self, job_type: str, payload: dict, attachment: Optional[bytes] = None,
+               callback_url: Optional[str] = None) -> str:
+        """Queue a job and return its ID; raises QueueFull when the backlog is at its limit."""
+        if job_type not in self.handlers:
+            raise ValueError(f"Unknown job type {job_type}")
+
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} jobs already queued")
+            conn.execute(
+                "INSERT INTO jobs (id, type, status, payload, attachment, callback_url, created_at) "
+                "VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, job_type, json.dumps(payload), attachment, callback_url, time.time())
+            )
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id: str, wait: float = 0) -> Optional[dict]:
+        """Return a job, waiting up to `wait` seconds for it to finish."""
+        deadline = time.monotonic() + wait
+        while True:
+            job = self._fetch(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["status"] in ("succeeded", "failed") or remaining <= 0:
+                return job
+            # Jobs finished by another process don't notify us, so re-check periodically
+            with self._finished:
+                self._finished.wait(min(remaining, 1.0))
+
+    def stats(self) -> dict:
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    def _fetch(self, job_id: str) -> Optional[dict]:
+        row = self._connect().execute(
+            "SELECT id, type, status, result, error, status_code, attempts, created_at, started_at, finished_at "
+            "FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            "job_id": row[0],
+            "type": row[1],
+            "status": row[2],
+            "attempts": row[6],
+            "created_at": row[7],
+            "started_at": row[8],
+            "finished_at": row[9],
+        }
+        if row[3] is not None:
+            job["result"] = json.loads(row[3])
+        if row[4] is not None:
+            job["error"] = {"status_code": row[5], "detail": row[4]}
+        return job
+
+    def _claim(self):
+        """Atomically take the oldest queued job or one whose lease expired."""
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, type, payload, attachment, attempts FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?) "
+                "ORDER BY created_at LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, job_type, payload, attachment, attempts = row
+            if attempts >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, status_code = 500, finished_at = ? WHERE id = ?",
+                    ("Job was interrupted too many times", now, job_id)
+                )
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_expires_at = ?, "
+                "started_at = ? WHERE id = ?",
+                (now + JOB_LEASE_SECONDS, now, job_id)
+            )
+        return job_id, job_type, json.loads(payload), attachment
+
+    def _complete(self, job_id: str, result: Optional[dict] = None,
+                  error: Optional[str] = None, status_code: Optional[int] = None):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, status_code = ?, "
+                "attachment = NULL, lease_expires_at = NULL, finished_at = ? WHERE id = ?",
+                ("failed" if error else "succeeded",
+                 json.dumps(result) if result is not None else None,
+                 error, status_code, time.time(), job_id)
+            )
+        with self._finished:
+            self._finished.notify_all()
+
+        callback_url = conn.execute("SELECT callback_url FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if callback_url and callback_url[0]:
+            # Checked on submission; checked again before sending
+            post_callback(callback_url[0], self._fetch(job_id))
+
+    def _work(self):
+        last_cleanup = 0.0
+        while self._running:
+            try:
+                if time.time() - last_cleanup > 600:
+                    self._cleanup()
+                    last_cleanup = time.time()
+
+                claimed = self._claim()
+                if claimed is None:
+                    self._wakeup.wait(1.0)
+                    self._wakeup.clear()
+                    continue
+
+                job_id, job_type, payload, attachment = claimed
+                with self._active_lock:
+                    self._active.add(job_id)
+                try:
+                    result = self.handlers[job_type](payload, attachment)
+                    self._complete(job_id, result=result)
+                except JobError as e:
+                    self._complete(job_id, error=e.detail, status_code=e.status_code)
+                except Exception as e:
+                    logger.error(f"Job {job_id} ({job_type}) failed: {e}")
+                    self._complete(job_id, error="Unable to process job. Please try again later.", status_code=500)
+                finally:
+                    with self._active_lock:
+                        self._active.discard(job_id)
+            except sqlite3.Error as e:
+                logger.error(f"Job queue database error: {e}")
+                time.sleep(1.0)
+
+    def _renew_leases(self):
+        """Extend the leases of running jobs well before they expire."""
+        interval = max(1.0, JOB_LEASE_SECONDS / 3)
+        while not self._stopped.wait(interval):
+            with self._active_lock:
+                active = list(self._active)
+            if not active:
+                continue
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(
+                        "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running'",
+                        [(time.time() + JOB_LEASE_SECONDS, job_id) for job_id in active]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"Could not renew job leases: {e}")
+
+    def _cleanup(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND finished_at < ?", (cutoff,))
+
+    def _connect(self) -> sqlite3.Connection:
+        """One connection per thread; autocommit with explicit transactions."""
+        # Connections must not cross a fork, so they are also keyed by process
+        conn, pid = getattr(self._local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = (conn, os.getpid())
+        return conn
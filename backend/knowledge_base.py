@@ -0,0 +1,281 @@
+"""
+Local knowledge base for common farming questions.
+
+The curated agronomy documents in knowledge/ (fertilizer schedules, the
+disease classes we detect, soil pH correction, nutrient deficiencies) are
+split into passages, one per "## " section, and indexed in an inverted index
+ranked with BM25. Each posting stores its precomputed BM25 term weight, so a
+search is a sum over the postings of the query terms.
+
+/chat answers straight from the best passage when the match is confident (it
+covers most of the question's weight and clearly beats any other passage
+that does), and otherwise passes the top passages to the LLM as context.
+
+The index is built at startup, or ahead of time with
+`python knowledge_base.py build`, which saves it next to the documents; a
+saved index is only used while the documents are unchanged.
+
+    python knowledge_base.py search "how much urea for wheat"
+"""
+import argparse
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import joblib
+import numpy as np
+
+from semantic_cache import STOPWORDS
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_DIR = Path(os.getenv("KNOWLEDGE_DIR", Path(__file__).resolve().parent / "knowledge"))
+KNOWLEDGE_INDEX_PATH = Path(os.getenv("KNOWLEDGE_INDEX_PATH", KNOWLEDGE_DIR / "index.joblib"))
+# Answer directly only if the best passage covers this share of the question's
+# IDF weight and scores this many times any other passage that does too
+KB_ANSWER_MIN_COVERAGE = float(os.getenv("KB_ANSWER_MIN_COVERAGE", "0.75"))
+KB_ANSWER_MIN_MARGIN = float(os.getenv("KB_ANSWER_MIN_MARGIN", "1.2"))
+KB_CONTEXT_PASSAGES = int(os.getenv("KB_CONTEXT_PASSAGES", "3"))
+# Passages covering less of the question than this are not used as context
+KB_CONTEXT_MIN_COVERAGE = float(os.getenv("KB_CONTEXT_MIN_COVERAGE", "0.5"))
+KB_CONTEXT_CHARS = int(os.getenv("KB_CONTEXT_CHARS", "1500"))
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+# Heading words are indexed this many times, since headings name the topic
+TITLE_WEIGHT = 2
+INDEX_FORMAT = 1
+
+SUFFIXES = ("ing", "ies", "es", "ed", "s")
+# Words that say what kind of answer is wanted rather than what it is about
+QUERY_WORDS = {
+    "much", "many", "amount", "quantity", "best", "good", "need", "needed", "use", "apply", "give",
+    "treat", "treatment", "control", "manage", "management", "cure", "prevent", "solution", "remedy",
+    "problem", "help", "advice", "recommend", "recommended", "recommendation",
+}
+
+
+def stem(word: str) -> str:
+    """Strip common English suffixes so "leaves"/"leaf" and "spots"/"spot" match."""
+    if word.endswith("ves") and len(word) > 4:
+        return word[:-3] + "f"
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        stem(word) for word in re.findall(r"\w+", text.lower())
+        if word not in STOPWORDS and word not in QUERY_WORDS
+    ]
+
+
+class Passage:
+    """One section of a knowledge document."""
+
+    def __init__(self, document: str, title: str, text: str):
+        self.document = document
+        self.title = title
+        self.text = text
+
+    def to_dict(self) -> dict:
+        return {"document": self.document, "title": self.title}
+
+
+class SearchResult:
+    def __init__(self, passage: Passage, score: float, coverage: float):
+        self.passage = passage
+        self.score = score
+        self.coverage = coverage  # Share of the question's IDF weight found in the passage
+
+
+def read_passages(directory: Path = KNOWLEDGE_DIR) -> List[Passage]:
+    """Split every .md file into passages at its "## " headings."""
+    passages = []
+    for path in sorted(Path(directory).glob("*.md")):
+        title, lines = None, []
+        for line in path.read_text(encoding="utf-8").splitlines() + ["## "]:
+            if line.startswith("## "):
+                if title and "".join(lines).strip():
+                    passages.append(Passage(path.stem, title, " ".join(l.strip() for l in lines if l.strip())))
+                title, lines = line[3:].strip(), []
+            elif title is not None:
+                lines.append(line)
+    return passages
+
+
+def corpus_signature(directory: Path = KNOWLEDGE_DIR) -> tuple:
+    """(name, mtime, size) of each document, to tell whether a saved index is stale."""
+    return tuple(
+        (path.name, path.stat().st_mtime_ns, path.stat().st_size)
+        for path in sorted(Path(directory).glob("*.md"))
+    )
+
+
+class KnowledgeBase:
+    """BM25-ranked inverted index over knowledge passages."""
+
+    def __init__(self, passages: List[Passage], signature: tuple = ()):
+        self.passages = passages
+        self.signature = signature
+
+        counts = [
+            Counter(tokenize(p.title) * TITLE_WEIGHT + tokenize(p.text))
+            for p in passages
+        ]
+        lengths = np.array([sum(c.values()) for c in counts], dtype=np.float64)
+        average = lengths.mean() if len(lengths) else 1.0
+
+        postings = defaultdict(list)
+        for i, c in enumerate(counts):
+            for term, tf in c.items():
+                postings[term].append((i, tf))
+
+        count = len(passages)
+        self.terms: Dict[str, int] = {}
+        self.idf = np.zeros(len(postings))
+        self.postings = []  # Per term: (passage ids, BM25 weights)
+        for term_id, (term, entries) in enumerate(sorted(postings.items())):
+            self.terms[term] = term_id
+            self.idf[term_id] = self._idf(len(entries), count)
+            ids = np.array([i for i, _ in entries], dtype=np.int32)
+            tf = np.array([tf for _, tf in entries], dtype=np.float64)
+            weights = self.idf[term_id] * tf * (K1 + 1) / (tf + K1 * (1 - B + B * lengths[ids] / average))
+            self.postings.append((ids, weights))
+        # IDF of a term that appears nowhere, for coverage
+        self.unknown_idf = self._idf(0, count)
+
+    @staticmethod
+    def _idf(df: int, count: int) -> float:
+        return math.log(1 + (count - df + 0.5) / (df + 0.5))
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def search(self, query: str, k: int = KB_CONTEXT_PASSAGES,
+               min_coverage: float = KB_CONTEXT_MIN_COVERAGE) -> List[SearchResult]:
+        """The k best passages covering at least min_coverage of the query, best first."""
+        terms = set(tokenize(query))
+        if not terms or not self.passages:
+            return []
+        scores = np.zeros(len(self.passages))
+        matched = np.zeros(len(self.passages))  # IDF weight of the query terms each passage contains
+        total = 0.0
+        for term in terms:
+            term_id = self.terms.get(term)
+            if term_id is None:
+                total += self.unknown_idf
+                continue
+            ids, weights = self.postings[term_id]
+            scores[ids] += weights
+            matched[ids] += self.idf[term_id]
+            total += self.idf[term_id]
+
+        best = np.argsort(-scores)[:k]
+        return [
+            SearchResult(self.passages[i], float(scores[i]), float(matched[i] / total))
+            for i in best if scores[i] > 0 and matched[i] / total >= min_coverage
+        ]
+
+    def answer(self, results: List[SearchResult]) -> Optional[SearchResult]:
+        """The top result if it is confident enough to answer with directly."""
+        if not results or results[0].coverage < KB_ANSWER_MIN_COVERAGE:
+            return None
+        # Another passage covering the question about as well makes it ambiguous
+        rivals = [r for r in results[1:] if r.coverage >= KB_ANSWER_MIN_COVERAGE]
+        if rivals and results[0].score < KB_ANSWER_MIN_MARGIN * rivals[0].score:
+            return None
+        return results[0]
+
+    def save(self, path: Path = KNOWLEDGE_INDEX_PATH):
+        # Plain data only, so the file loads whichever module name saved it
+        joblib.dump({
+            "format": INDEX_FORMAT,
+            "signature": self.signature,
+            "passages": [(p.document, p.title, p.text) for p in self.passages],
+            "terms": self.terms,
+            "idf": self.idf,
+            "postings": self.postings,
+            "unknown_idf": self.unknown_idf,
+        }, path)
+
+    @classmethod
+    def _from_saved(cls, saved: dict) -> "KnowledgeBase":
+        knowledge = cls.__new__(cls)
+        knowledge.passages = [Passage(*p) for p in saved["passages"]]
+        knowledge.signature = saved["signature"]
+        knowledge.terms = saved["terms"]
+        knowledge.idf = saved["idf"]
+        knowledge.postings = saved["postings"]
+        knowledge.unknown_idf = saved["unknown_idf"]
+        return knowledge
+
+    @classmethod
+    def build(cls, directory: Path = KNOWLEDGE_DIR) -> "KnowledgeBase":
+        return cls(read_passages(directory), corpus_signature(directory))
+
+    @classmethod
+    def load_or_build(cls, directory: Path = KNOWLEDGE_DIR,
+                      index_path: Path = KNOWLEDGE_INDEX_PATH) -> "KnowledgeBase":
+        """Load the saved index if it matches the documents, else build it."""
+        signature = corpus_signature(directory)
+        try:
+            saved = joblib.load(index_path)
+            if saved.get("format") == INDEX_FORMAT and tuple(saved["signature"]) == signature:
+                return cls._from_saved(saved)
+            logger.info("Saved knowledge index is out of date, rebuilding")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not load knowledge index {index_path}: {e}")
+        return cls.build(directory)
+
+
+def format_context(results: List[SearchResult], max_chars: int = KB_CONTEXT_CHARS) -> str:
+    """Passages as compact LLM context, best first, cut to max_chars."""
+    parts, used = [], 0
+    for result in results:
+        part = f"[{result.passage.title}] {result.passage.text}"
+        if used + len(part) > max_chars:
+            part = part[:max(0, max_chars - used)].rsplit(" ", 1)[0]
+        if part:
+            parts.append(part)
+            used += len(part)
+        if used >= max_chars:
+            break
+    return "\n".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help=f"Build the index and save it to {KNOWLEDGE_INDEX_PATH}")
+    search = sub.add_parser("search", help="Show the passages matching a question")
+    search.add_argument("query")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        knowledge = KnowledgeBase.build()
+        knowledge.save()
+        print(f"Indexed {len(knowledge)} passages, {len(knowledge.terms)} terms -> {KNOWLEDGE_INDEX_PATH}")
+        return
+
+    knowledge = KnowledgeBase.load_or_build()
+    results = knowledge.search(args.query)
+    answer = knowledge.answer(results)
+    for result in results:
+        marker = "*" if result is answer else " "
+        print(f"{marker} {result.score:6.2f}  coverage {result.coverage:.2f}  "
+              f"{result.passage.document}: {result.passage.title}")
+    print("Direct answer" if answer else "Passages used as LLM context")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Cheap plant-leaf prefilter run before the disease model.
+
+Scores a tiny thumbnail by the fraction of pixels whose colour is plausible
+for leaf tissue (green through yellow and brown, reasonably saturated).
+Selfies, screenshots and document photos score near zero and are rejected
+without paying for the CNN forward pass.
+
+The false-reject rate on real leaf photos has not been measured yet, so the
+default threshold is deliberately low: an image needs only 5% leaf-coloured
+pixels, and the filter only catches images with next to no plant colour. Run
+evaluate_prefilter.py on PlantVillage (and on field photos) before raising it.
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+# Fraction of leaf-coloured pixels required to pass; 0 disables the filter.
+# Kept low until the false-reject rate is measured, see above
+LEAF_PREFILTER_THRESHOLD = float(os.getenv("LEAF_PREFILTER_THRESHOLD", "0.05"))
+
+THUMBNAIL_SIZE = (32, 32)
+
+# Hue band in degrees covering yellow-brown lesions through green tissue.
+# Skin tones sit below the lower bound, sky and water above the upper one.
+LEAF_HUE_RANGE = (25.0, 170.0)
+MIN_SATURATION = 0.15
+MIN_VALUE = 0.12
+
+# The same bounds on PIL's 0-255 HSV scale
+_HUE_MIN = LEAF_HUE_RANGE[0] * 255 / 360
+_HUE_MAX = LEAF_HUE_RANGE[1] * 255 / 360
+_SAT_MIN = MIN_SATURATION * 255
+_VAL_MIN = MIN_VALUE * 255
+
+
+def leaf_score(img: Image.Image) -> float:
+    """Return the fraction of leaf-coloured pixels in an RGB image."""
+    thumbnail = img.resize(THUMBNAIL_SIZE, Image.NEAREST).convert("HSV")
+    hsv = np.asarray(thumbnail)
+    hue, sat, val = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    leaf = (hue >= _HUE_MIN) & (hue <= _HUE_MAX) & (sat >= _SAT_MIN) & (val >= _VAL_MIN)
+    return float(leaf.mean())
+
+
+def is_probable_leaf(img: Image.Image, threshold: float = LEAF_PREFILTER_THRESHOLD) -> bool:
+    """Check whether an image is worth sending to the disease model."""
+    if threshold <= 0:
+        return True
+    return leaf_score(img) >= threshold
@@ -0,0 +1,303 @@
+"""
+Local text generation worker used when the Hugging Face API is unavailable.
+
+A single background thread owns the model and decodes every active request
+together. New requests join the running batch between decoding steps and
+finished ones leave it immediately (continuous batching), so concurrent
+callers share forward passes instead of queueing behind each other. Each step
+reuses the KV cache, so only one new token per sequence is computed.
+
+Requests are bounded by max_new_tokens (the prompt does not count against it)
+and by a deadline, after which the text generated so far is returned.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import List, Optional
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+LOCAL_LM_MODEL = os.getenv("LOCAL_LM_MODEL", "gpt2")
+LOCAL_LM_MAX_BATCH_SIZE = int(os.getenv("LOCAL_LM_MAX_BATCH_SIZE", "8"))
+LOCAL_LM_THREADS = int(os.getenv("LOCAL_LM_THREADS", os.getenv("TORCH_NUM_THREADS", "0")))
+
+
+class _Sequence:
+    """State of one request inside the running batch."""
+
+    def __init__(self, prompt_ids: List[int], max_new_tokens: int, deadline: float,
+                 temperature: float, top_p: float, future: Future):
+        self.prompt_ids = prompt_ids
+        self.max_new_tokens = max_new_tokens
+        self.deadline = deadline
+        self.temperature = temperature
+        self.top_p = top_p
+        self.future = future
+        self.generated = []
+        # Number of tokens already in the KV cache for this sequence
+        self.length = 0
+
+
+class LocalGenerator:
+    """Continuous-batching generation server around a causal language model."""
+
+    def __init__(self, model_name: str = LOCAL_LM_MODEL, max_batch_size: int = LOCAL_LM_MAX_BATCH_SIZE,
+                 num_threads: int = LOCAL_LM_THREADS):
+        # Keep torch from claiming every core; TensorFlow needs some too
+        torch.set_num_threads(num_threads or max(1, (os.cpu_count() or 2) // 2))
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForCausalLM.from_pretrained(model_name)
+        self.model.eval()
+        self.max_positions = getattr(self.model.config, "n_positions", 1024)
+        self.eos_token_id = self.tokenizer.eos_token_id
+        self.max_batch_size = max_batch_size
+
+        self._pending = queue.Queue()
+        self._waiting = deque()  # Taken off the queue while idle, not yet admitted
+        self._active = []
+        self._past = None  # Per layer (key, value), each [batch, heads, length, head_dim]
+        self._mask = None  # [batch, length], 0 where the cache holds left padding
+
+        self._stats_lock = threading.Lock()
+        self._tokens_generated = 0
+        self._requests_completed = 0
+        self._busy_seconds = 0.0
+
+        self._running = True
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, prompt: str, max_new_tokens: int = 128, timeout: Optional[float] = None,
+               temperature: float = 0.7, top_p: float = 0.95) -> Future:
+        """Queue a prompt; the future resolves to the generated continuation."""
+        future = Future()
+        max_new_tokens = max(1, min(max_new_tokens, self.max_positions - 1))
+        prompt_ids = self.tokenizer.encode(prompt)
+        # Keep the end of over-long prompts so that generation still fits
+        prompt_ids = prompt_ids[-(self.max_positions - max_new_tokens):] or [self.eos_token_id]
+        deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+        self._ensure_worker()
+        self._pending.put(_Sequence(prompt_ids, max_new_tokens, deadline, temperature, top_p, future))
+        return future
+
+    def generate(self, prompt: str, max_new_tokens: int = 128, timeout: Optional[float] = None,
+                 temperature: float = 0.7, top_p: float = 0.95) -> str:
+        """Generate a continuation, returning what is ready when the deadline passes."""
+        future = self.submit(prompt, max_new_tokens, timeout, temperature, top_p)
+        # The worker resolves the future at the deadline; allow for one decoding step
+        return future.result(timeout=None if timeout is None else timeout + 5)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "active": len(self._active),
+                "queued": self._pending.qsize() + len(self._waiting),
+                "tokens_generated": self._tokens_generated,
+                "requests_completed": self._requests_completed,
+                "tokens_per_second": self._tokens_generated / self._busy_seconds if self._busy_seconds else 0.0
+            }
+
+    def close(self):
+        """Stop the decoding thread and fail requests that were never admitted."""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        unfinished = list(self._waiting)
+        self._waiting.clear()
+        while True:
+            try:
+                unfinished.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        for seq in unfinished:
+            if not seq.future.done():
+                seq.future.set_exception(RuntimeError("Local generator was closed"))
+
+    def _ensure_worker(self):
+        """
+        Start the decoding thread on first use. Threads don't survive fork(), so
+        starting it lazily keeps the generator usable in preforked workers.
+        """
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="local-generator", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while self._running:
+            try:
+                if not self._active and not self._waiting:
+                    # Idle: block until work arrives
+                    try:
+                        self._waiting.append(self._pending.get(timeout=0.5))
+                    except queue.Empty:
+                        continue
+
+                start = time.perf_counter()
+                with torch.inference_mode():
+                    self._admit()
+                    if self._active:
+                        self._step()
+                with self._stats_lock:
+                    self._busy_seconds += time.perf_counter() - start
+            except Exception as e:
+                logger.error(f"Local generation failed: {e}")
+                for seq in self._active:
+                    if not seq.future.done():
+                        seq.future.set_exception(e)
+                self._active, self._past, self._mask = [], None, None
+
+    def _admit(self):
+        """Prefill waiting requests and merge them into the running batch."""
+        while len(self._active) < self.max_batch_size:
+            if self._waiting:
+                seq = self._waiting.popleft()
+            else:
+                try:
+                    seq = self._pending.get_nowait()
+                except queue.Empty:
+                    return
+            if time.monotonic() >= seq.deadline:
+                seq.future.set_result("")
+                continue
+
+            # The sequence is in neither the queue nor the batch here, so a
+            # failure has to resolve its future or generate() never returns
+            try:
+                input_ids = torch.tensor([seq.prompt_ids])
+                outputs = self.model(input_ids=input_ids, use_cache=True)
+                seq.length = len(seq.prompt_ids)
+                token = self._sample(outputs.logits[:, -1, :], [seq])[0]
+                if self._append(seq, token):
+                    continue
+                past = self._legacy_cache(outputs.past_key_values)
+            except Exception as e:
+                logger.error(f"Local generation prefill failed: {e}")
+                if not seq.future.done():
+                    seq.future.set_exception(e)
+                continue
+            self._merge(seq, past)
+
+    def _merge(self, seq: _Sequence, past):
+        """Add a prefilled sequence to the batch, left-padding the shorter cache."""
+        new_mask = torch.ones(1, seq.length, dtype=torch.long)
+        if self._past is None:
+            self._past, self._mask = past, new_mask
+        else:
+            current_length = self._mask.shape[1]
+            length = max(current_length, seq.length)
+            self._past = tuple(
+                (torch.cat([_pad_left(k0, length), _pad_left(k1, length)]),
+                 torch.cat([_pad_left(v0, length), _pad_left(v1, length)]))
+                for (k0, v0), (k1, v1) in zip(self._past, past)
+            )
+            self._mask = torch.cat([_pad_left_2d(self._mask, length), _pad_left_2d(new_mask, length)])
+        self._active.append(seq)
+
+    def _step(self):
+        """Feed the last generated token of every active sequence."""
+        input_ids = torch.tensor([[seq.generated[-1]] for seq in self._active])
+        position_ids = torch.tensor([[seq.length] for seq in self._active])
+        mask = torch.cat([self._mask, torch.ones(len(self._active), 1, dtype=torch.long)], dim=1)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            past_key_values=self._past,
+            attention_mask=mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        self._past = self._legacy_cache(outputs.past_key_values)
+        self._mask = mask
+
+        tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        keep = []
+        for i, (seq, token) in enumerate(zip(self._active, tokens)):
+            seq.length += 1
+            if not self._append(seq, token):
+                keep.append(i)
+
+        if len(keep) < len(self._active):
+            self._evict(keep)
+
+    def _evict(self, keep: List[int]):
+        """Drop finished sequences from the batch and trim shared left padding."""
+        self._active = [self._active[i] for i in keep]
+        if not keep:
+            self._past, self._mask = None, None
+            return
+
+        index = torch.tensor(keep)
+        mask = self._mask.index_select(0, index)
+        # Columns that are padding for every remaining sequence can go
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self._mask = mask[:, start:]
+        self._past = tuple(
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in self._past
+        )
+
+    def _append(self, seq: _Sequence, token: int) -> bool:
+        """Record a generated token; resolve and return True if the sequence is done."""
+        seq.generated.append(token)
+        with self._stats_lock:
+            self._tokens_generated += 1
+
+        done = (
+            token == self.eos_token_id
+            or len(seq.generated) >= seq.max_new_tokens
+            or seq.length + 1 >= self.max_positions
+            or time.monotonic() >= seq.deadline
+        )
+        if done:
+            tokens = seq.generated[:-1] if token == self.eos_token_id else seq.generated
+            if not seq.future.done():
+                seq.future.set_result(self.tokenizer.decode(tokens, skip_special_tokens=True))
+            with self._stats_lock:
+                self._requests_completed += 1
+        return done
+
+    @staticmethod
+    def _sample(logits: torch.Tensor, sequences: List[_Sequence]) -> List[int]:
+        """Top-p (nucleus) sampling with per-sequence temperature and top_p."""
+        temperature = torch.tensor([[max(seq.temperature, 1e-5)] for seq in sequences])
+        top_p = torch.tensor([[seq.top_p] for seq in sequences])
+
+        probs = torch.softmax(logits.float() / temperature, dim=-1)
+        sorted_probs, sorted_indices = torch.sort(probs, descending=True, dim=-1)
+        # Drop tokens once the probability mass before them already exceeds top_p
+        outside = (torch.cumsum(sorted_probs, dim=-1) - sorted_probs) > top_p
+        sorted_probs = sorted_probs.masked_fill(outside, 0.0)
+        choice = torch.multinomial(sorted_probs, num_samples=1)
+        return sorted_indices.gather(-1, choice).squeeze(-1).tolist()
+
+    @staticmethod
+    def _legacy_cache(past):
+        """Normalize the cache to a tuple of (key, value) tensors per layer."""
+        if hasattr(past, "to_legacy_cache"):
+            return past.to_legacy_cache()
+        return tuple((k, v) for k, v in past)
+
+
+def _pad_left(tensor: torch.Tensor, length: int) -> torch.Tensor:
+    """Zero-pad a [batch, heads, length, head_dim] cache tensor on the left."""
+    missing = length - tensor.shape[2]
+    if missing <= 0:
+        return tensor
+    padding = tensor.new_zeros(tensor.shape[0], tensor.shape[1], missing, tensor.shape[3])
+    return torch.cat([padding, tensor], dim=2)
+
+
+def _pad_left_2d(mask: torch.Tensor, length: int) -> torch.Tensor:
+    missing = length - mask.shape[1]
+    if missing <= 0:
+        return mask
+    return torch.cat([mask.new_zeros(mask.shape[0], missing), mask], dim=1)
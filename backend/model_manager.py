@@ -0,0 +1,254 @@
+"""
+Zero-downtime reloading of model artifacts.
+
+ModelManager watches the artifact files in MODEL_DIR (and can be triggered by
+POST /admin/models/reload). When an artifact changes it loads the new version
+in a background thread, checks it on sample inputs (which also warms it), and
+only then swaps it in. New requests use the new version, requests already
+running finish on the old one, and the old version is freed once the last of
+them is done. A version that fails to load or validate is never installed;
+the previous one keeps serving.
+
+Each server process reloads its own copy. Always replace artifacts with an
+atomic rename (write a temporary file, then mv/os.replace it over the old
+one), never by writing into the existing file: the crop model is
+memory-mapped, so overwriting it in place corrupts the version being served.
+The watcher also waits until the files stop changing before loading them.
+
+With a ResidencyManager (see residency.py), a model that isn't resident
+(evicted, or not loaded yet with MODEL_LAZY_LOAD) isn't loaded on reload:
+its new version is recorded and loaded the next time a request needs it.
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+import inference
+from residency import ResidencyManager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the artifact files; 0 disables the watcher
+MODEL_RELOAD_POLL_SECONDS = float(os.getenv("MODEL_RELOAD_POLL_SECONDS", "30"))
+
+ARTIFACTS = {
+    "crop": ["crop_rf.joblib"],
+    "disease": ["disease_mobilenet.h5", "disease_classes.joblib"],
+}
+
+# Typical field readings (N, P, K, temperature, humidity, ph, rainfall)
+CROP_SAMPLE_ROWS = [
+    [90, 42, 43, 20.9, 82.0, 6.5, 202.9],
+    [20, 67, 20, 22.0, 60.0, 6.8, 60.0],
+    [120, 40, 20, 26.0, 80.0, 6.6, 95.0],
+    [40, 60, 80, 18.0, 15.0, 7.2, 70.0],
+]
+
+
+class ModelManager:
+    """Watches model artifacts and swaps in validated new versions."""
+
+    def __init__(self, model_dir: Path = inference.MODEL_DIR,
+                 poll_interval: float = MODEL_RELOAD_POLL_SECONDS,
+                 residency: Optional[ResidencyManager] = None):
+        self.model_dir = Path(model_dir)
+        self.poll_interval = poll_interval
+        self.residency = residency
+        self.kinds = ["crop"] if inference.CROP_ONLY else ["crop", "disease"]
+
+        self._reload_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+        self._stopped = threading.Event()
+        # Artifact signatures of the installed versions (assumes the models were loaded)
+        self._signatures = {kind: self._signature(kind) for kind in self.kinds}
+        self._changed = {}  # kind -> signature seen changing on the last poll
+        loaded = {"crop": inference.crop_model is not None, "disease": inference.disease is not None}
+        self._status = {
+            kind: {
+                "version": self._version(self._signatures[kind]) if loaded[kind] else None,
+                "state": "ready" if loaded[kind] else "not_loaded",
+                "loaded_at": time.time(),
+                "reloads": 0,
+                "last_error": None
+            }
+            for kind in self.kinds
+        }
+
+    def start(self):
+        """Start the watcher thread. Call after forking, e.g. on app startup."""
+        if self.poll_interval <= 0 or self._running:
+            return
+        self._running = True
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def reload_async(self, kinds: Optional[Iterable[str]] = None, force: bool = False) -> List[str]:
+        """Reload in a background thread; returns the kinds that will be checked."""
+        kinds = self._check_kinds(kinds)
+        threading.Thread(
+            target=self.reload, args=(kinds, force), name="model-reload", daemon=True
+        ).start()
+        return kinds
+
+    def reload(self, kinds: Optional[Iterable[str]] = None, force: bool = False) -> dict:
+        """
+        Reload the given kinds (default: all) whose artifacts changed, or all of
+        them with force. Returns "unchanged", "reloaded" or "failed" per kind.
+        """
+        results = {}
+        with self._reload_lock:
+            for kind in self._check_kinds(kinds):
+                signature = self._signature(kind)
+                if signature is None:
+                    results[kind] = "failed"
+                    self._status[kind]["last_error"] = "Artifact files missing"
+                    continue
+                if signature == self._signatures[kind] and not force:
+                    results[kind] = "unchanged"
+                    continue
+                results[kind] = "reloaded" if self._reload(kind, signature) else "failed"
+        return results
+
+    def status(self) -> dict:
+        statuses = {kind: dict(status) for kind, status in self._status.items()}
+        for kind, status in statuses.items():
+            # Residency loads and evicts models without going through reload()
+            if status["state"] in ("ready", "not_loaded", "evicted") and self._deferred(kind) is not None:
+                if self.residency.is_resident(kind):
+                    status["state"] = "ready"
+                elif self.residency.is_evicted(kind):
+                    status["state"] = "evicted"
+        return statuses
+
+    def _reload(self, kind: str, signature) -> bool:
+        status = self._status[kind]
+        if self._deferred(kind):
+            # The next request that needs it loads the new files
+            self._signatures[kind] = signature
+            status.update(version=self._version(signature), last_error=None)
+            logger.info(f"{kind} model artifacts changed while not resident, not loading them now")
+            return True
+        status["state"] = "reloading"
+        start = time.perf_counter()
+        try:
+            if kind == "crop":
+                model = inference.read_crop_model(self.model_dir)
+                validate_crop_model(model)
+                inference.crop_model = model
+            else:
+                version = inference.read_disease_model(self.model_dir)
+                validate_disease_model(version)
+                inference.install_disease_model(version)
+            if self.residency is not None:
+                self.residency.replace(kind, model if kind == "crop" else version)
+        except Exception as e:
+            logger.error(f"Reloading {kind} model failed, keeping the current version: {e}")
+            status.update(state="failed", last_error=str(e))
+            # Don't retry the same broken files on every poll
+            self._signatures[kind] = signature
+            return False
+
+        self._signatures[kind] = signature
+        status.update(
+            version=self._version(signature),
+            state="ready",
+            loaded_at=time.time(),
+            reloads=status["reloads"] + 1,
+            last_error=None
+        )
+        logger.info(f"Reloaded {kind} model version {status['version']} in {time.perf_counter() - start:.1f}s")
+        # Free the previous version once no request holds it; Keras models
+        # have reference cycles, so this needs the cycle collector
+        gc.collect()
+        return True
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                for kind in self.kinds:
+                    signature = self._signature(kind)
+                    if signature is None or signature == self._signatures[kind]:
+                        self._changed.pop(kind, None)
+                        continue
+                    # Wait until the files stop changing for one interval
+                    if self._changed.get(kind) != signature:
+                        self._changed[kind] = signature
+                        continue
+                    del self._changed[kind]
+                    logger.info(f"{kind} model artifacts changed, reloading")
+                    self.reload([kind])
+            except Exception as e:
+                logger.error(f"Model watcher error: {e}")
+
+    def _deferred(self, kind: str) -> Optional[bool]:
+        """Whether residency will load this kind on demand; None if it doesn't manage it."""
+        if self.residency is None or not self.residency.is_registered(kind):
+            return None
+        return not self.residency.is_resident(kind)
+
+    def _check_kinds(self, kinds: Optional[Iterable[str]]) -> List[str]:
+        kinds = list(kinds) if kinds else list(self.kinds)
+        unknown = [kind for kind in kinds if kind not in self.kinds]
+        if unknown:
+            raise ValueError(f"Unknown model kind(s): {', '.join(unknown)}")
+        return kinds
+
+    def _signature(self, kind: str):
+        """(name, mtime, size) of each artifact file, or None if one is missing."""
+        signature = []
+        for name in ARTIFACTS[kind]:
+            try:
+                stat = (self.model_dir / name).stat()
+            except OSError:
+                return None
+            signature.append((name, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    @staticmethod
+    def _version(signature) -> Optional[str]:
+        """Human-readable version: the newest artifact's modification time."""
+        if signature is None:
+            return None
+        newest = max(mtime for _, mtime, _ in signature) / 1e9
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(newest))
+
+
+def validate_crop_model(model):
+    """Run sample rows through a crop model; raises ValueError if the output is unusable."""
+    probabilities = model.predict_proba(np.asarray(CROP_SAMPLE_ROWS, dtype=np.float64))
+    expected = (len(CROP_SAMPLE_ROWS), len(model.classes_))
+    if probabilities.shape != expected:
+        raise ValueError(f"Crop model output shape {probabilities.shape}, expected {expected}")
+    if not np.all(np.isfinite(probabilities)) or not np.allclose(probabilities.sum(axis=1), 1, atol=1e-3):
+        raise ValueError("Crop model returned invalid probabilities")
+
+
+def validate_disease_model(version: "inference.DiseaseModel"):
+    """
+    Run sample batches through a disease model version, which also warms it for
+    the batch sizes served; raises ValueError if the output is unusable.
+    """
+    height, width = version.input_size
+    rng = np.random.default_rng(0)
+    for batch_size in (1, 4):
+        batch = rng.random((batch_size, height, width, 3), dtype=np.float32)
+        probabilities = inference.predict_disease_batch(batch, version)
+        expected = (batch_size, len(version.class_names))
+        if probabilities.shape != expected:
+            raise ValueError(f"Disease model output shape {probabilities.shape}, expected {expected}")
+        if not np.all(np.isfinite(probabilities)) or not np.allclose(probabilities.sum(axis=1), 1, atol=1e-2):
+            raise ValueError("Disease model returned invalid probabilities")
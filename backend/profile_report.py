@@ -0,0 +1,72 @@
+"""
+Report import time and memory of the API server for each serving profile.
+
+Each profile is measured in a fresh interpreter: the time to import the app
+module (which loads the models), the resident memory afterwards, and which
+heavy frameworks ended up imported.
+
+Usage:
+    cd backend
+    python profile_report.py --profiles crop full --module app
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = ["tensorflow", "torch", "transformers", "firebase_admin", "sklearn"]
+
+PROBE = """
+import json, sys, time
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+baseline = rss_mb()
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_seconds": elapsed,
+    "baseline_rss_mb": baseline,
+    "rss_mb": rss_mb(),
+    "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def measure(profile: str, module: str) -> dict:
+    env = dict(os.environ, SERVING_PROFILE=profile)
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} with SERVING_PROFILE={profile} failed:\n{result.stderr[-2000:]}")
+    # The app logs to stdout too; the report is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", nargs="+", default=["crop", "full"])
+    parser.add_argument("--module", default="app", help="Module to import (app or simple_app)")
+    args = parser.parse_args()
+
+    print(f"{'profile':<8} {'import (s)':>10} {'RSS (MB)':>9} {'+RSS (MB)':>10}  heavy modules")
+    for profile in args.profiles:
+        r = measure(profile, args.module)
+        print(f"{profile:<8} {r['import_seconds']:>10.2f} {r['rss_mb']:>9.0f} "
+              f"{r['rss_mb'] - r['baseline_rss_mb']:>10.0f}  {', '.join(r['heavy_modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
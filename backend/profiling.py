@@ -0,0 +1,255 @@
+"""
+On-demand profiling of the running server.
+
+POST /admin/profile starts a session that lasts for the next N requests or T
+seconds, whichever comes first. While it runs, a background thread samples
+the Python stack of every thread with sys._current_frames() at a fixed
+interval and counts the stacks in folded form ("frame;frame;frame count"),
+the input format of flamegraph.pl, speedscope and similar tools. Threads
+that are only waiting (idle pool workers, the event loop's selector) are
+left out. Optionally tracemalloc records allocations, and the report lists
+the source lines whose memory grew the most over the session.
+
+Nothing is sampled or traced outside a session; the only standing cost is
+one attribute check per request in ProfilingMiddleware. Sessions profile the
+process that receives the request, so with several workers each one has to
+be profiled separately.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+
+# Leaf functions of threads that are blocked waiting for work
+IDLE_FUNCTIONS = {
+    ("threading.py", "wait"), ("queue.py", "get"), ("selectors.py", "select"),
+    ("socket.py", "accept"), ("threading.py", "_wait_for_tstate_lock"), ("base_events.py", "_run_once"),
+}
+
+
+class ProfileBusy(Exception):
+    """Raised when a session is already running."""
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class Profiler:
+    """Runs one profiling session at a time and keeps the last report."""
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.active = False
+
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._session = None
+        self._report = None
+
+    def start(self, seconds: float = 30, requests: Optional[int] = None,
+              allocations: bool = True, top: int = 25) -> dict:
+        """Start a session; raises ProfileBusy if one is running."""
+        seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+        with self._lock:
+            if self.active:
+                raise ProfileBusy("A profiling session is already running")
+            self._session = {
+                "session_id": uuid.uuid4().hex,
+                "status": "running",
+                "started_at": time.time(),
+                "max_seconds": seconds,
+                "max_requests": requests,
+                "requests": 0,
+                "trace_allocations": allocations,
+                "top": top,
+            }
+            self._report = None
+            self._done.clear()
+            self.active = True
+
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self._session["started_tracemalloc"] = True
+        self._session["snapshot"] = tracemalloc.take_snapshot() if allocations else None
+
+        threading.Thread(target=self._sample, name="profiler", daemon=True).start()
+        logger.info(f"Profiling for up to {seconds:.0f}s"
+                    + (f" or {requests} requests" if requests else ""))
+        return self.status()
+
+    def stop(self):
+        """End the running session early."""
+        self._done.set()
+
+    def request_finished(self):
+        with self._lock:
+            session = self._session
+            if not self.active or session is None:
+                return
+            session["requests"] += 1
+            if session["max_requests"] and session["requests"] >= session["max_requests"]:
+                self._done.set()
+
+    def status(self) -> dict:
+        with self._lock:
+            if self._session is None:
+                return {"status": "idle"}
+            return {key: value for key, value in self._session.items()
+                    if key not in ("snapshot", "started_tracemalloc", "top")}
+
+    def report(self, wait: float = 0) -> Optional[dict]:
+        """The last finished session's report, waiting up to `wait` seconds for a running one."""
+        if self.active and wait > 0:
+            self._done.wait(wait)
+            # The sampler thread builds the report just after the session ends
+            deadline = time.monotonic() + 5
+            while self.active and time.monotonic() < deadline:
+                time.sleep(0.01)
+        with self._lock:
+            return self._report
+
+    def _sample(self):
+        session = self._session
+        own = threading.get_ident()
+        names = {}
+        stacks = Counter()
+        samples = idle = 0
+        start = time.perf_counter()
+        try:
+            while not self._done.wait(self.interval):
+                if time.perf_counter() - start >= session["max_seconds"]:
+                    break
+                names.update((t.ident, t.name) for t in threading.enumerate())
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    code = frame.f_code
+                    if (os.path.basename(code.co_filename), code.co_name) in IDLE_FUNCTIONS:
+                        idle += 1
+                        continue
+                    labels = []
+                    while frame is not None:
+                        labels.append(frame_label(frame))
+                        frame = frame.f_back
+                    labels.append(names.get(thread_id, str(thread_id)))
+                    stacks[";".join(reversed(labels))] += 1
+                samples += 1
+        except Exception as e:
+            logger.error(f"Profiler sampling failed: {e}")
+        finally:
+            elapsed = time.perf_counter() - start
+            report = self._build_report(session, stacks, samples, idle, elapsed)
+            with self._lock:
+                session["status"] = "finished"
+                self._report = report
+                self.active = False
+            self._done.set()
+            logger.info(f"Profiling finished: {samples} samples over {elapsed:.1f}s, "
+                        f"{session['requests']} requests")
+
+    def _build_report(self, session: dict, stacks: Counter, samples: int, idle: int, elapsed: float) -> dict:
+        top = session["top"]
+        leaf = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")[1:]  # Without the thread name
+            if frames:
+                leaf[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        busy = sum(stacks.values())
+
+        report = {
+            **{key: value for key, value in session.items()
+               if key not in ("snapshot", "started_tracemalloc", "top", "status")},
+            "status": "finished",
+            "seconds": round(elapsed, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": samples,
+            "busy_thread_samples": busy,
+            "idle_thread_samples": idle,
+            "top_self": [
+                {"frame": label, "samples": count, "share": round(count / busy, 4)}
+                for label, count in leaf.most_common(top)
+            ] if busy else [],
+            "top_inclusive": [
+                {"frame": label, "samples": count, "share": round(count / busy, 4)}
+                for label, count in inclusive.most_common(top)
+            ] if busy else [],
+            "folded": "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+            "allocations": None,
+        }
+
+        if session["snapshot"] is not None:
+            try:
+                report["allocations"] = allocation_report(session["snapshot"], top)
+            except Exception as e:
+                logger.error(f"Allocation report failed: {e}")
+            finally:
+                if session.get("started_tracemalloc"):
+                    tracemalloc.stop()
+        return report
+
+
+def allocation_report(start_snapshot: "tracemalloc.Snapshot", top: int) -> dict:
+    """Source lines whose allocated memory grew the most since start_snapshot."""
+    current, peak = tracemalloc.get_traced_memory()
+    ignore = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, __file__),
+    ]
+    snapshot = tracemalloc.take_snapshot().filter_traces(ignore)
+    diff = snapshot.compare_to(start_snapshot.filter_traces(ignore), "lineno")
+    return {
+        "traced_current_kb": round(current / 1024, 1),
+        "traced_peak_kb": round(peak / 1024, 1),
+        "top_growth": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "size_diff_kb": round(stat.size_diff / 1024, 1),
+                "count": stat.count,
+                "count_diff": stat.count_diff,
+            }
+            for stat in diff[:top]
+        ],
+        "top_size": [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:top]
+        ],
+    }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware counting finished requests for request-bounded sessions."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.active or scope["path"].startswith("/admin/"):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_finished()
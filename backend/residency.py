@@ -0,0 +1,322 @@
+"""
+Memory-budgeted model residency.
+
+Each model the process serves is registered with a loader, an unloader and
+an optional warmup. The manager records its memory cost (the growth in
+process RSS while it loaded) and when it was last used. Requests hold a
+model with `use()`, which loads it on demand first if it isn't resident.
+
+When loading a model would take the resident models past
+MODEL_MEMORY_BUDGET_MB, the least recently used models that no request
+holds are evicted first; pinned models (the small crop model) never are.
+With MODEL_IDLE_SECONDS set, models nobody used for that long are evicted
+as well. Evicted models are dropped, garbage collected and freed back to
+the OS, then reloaded (and warmed up) by the next request that needs them.
+
+Imported libraries such as TensorFlow and torch stay loaded, so evicting a
+model frees its weights and buffers, not the framework. By default
+(MODEL_LAZY_LOAD=1) only the crop model is loaded at startup and the heavy
+models by the first request that needs them, so under gunicorn they are
+loaded in the workers after the fork and only by workers that use them.
+"""
+import contextlib
+import ctypes
+import gc
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0"))  # 0: unlimited
+MODEL_IDLE_SECONDS = float(os.getenv("MODEL_IDLE_SECONDS", "0"))  # 0: never evict for idleness alone
+# Load the disease model and local generator on first use (the default) instead
+# of at startup. TensorFlow isn't fork-safe, so keep this on under gunicorn.
+MODEL_LAZY_LOAD = os.getenv("MODEL_LAZY_LOAD", "1") == "1"
+
+
+class ModelUnavailable(Exception):
+    """Raised when a model is not registered or fails to load."""
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def release_memory():
+    """Collect garbage and return freed heap pages to the OS where glibc allows it."""
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class _Entry:
+    def __init__(self, name: str, load: Callable[[], object], unload: Callable[[object], None],
+                 warmup: Optional[Callable[[object], None]], can_load: Optional[Callable[[], bool]],
+                 pinned: bool, estimate_mb: float):
+        self.name = name
+        self.load = load
+        self.unload = unload
+        self.warmup = warmup
+        self.can_load = can_load
+        self.pinned = pinned
+        self.estimate_mb = estimate_mb
+
+        self.obj = None
+        self.cost_mb = None  # RSS growth measured at the last load
+        self.freed_mb = None  # RSS drop measured at the last eviction
+        self.last_used = 0.0
+        self.in_use = 0
+        self.loads = 0
+        self.cold_starts = 0  # Loads a request had to wait for
+        self.load_seconds = 0.0
+        self.evictions = {"pressure": 0, "idle": 0, "manual": 0}
+        self.last_error = None
+
+    @property
+    def cost(self) -> float:
+        return self.cost_mb if self.cost_mb is not None else self.estimate_mb
+
+
+class ResidencyManager:
+    """Loads models on demand and evicts idle ones to stay within a memory budget."""
+
+    def __init__(self, budget_mb: float = MODEL_MEMORY_BUDGET_MB, idle_seconds: float = MODEL_IDLE_SECONDS):
+        self.budget_mb = budget_mb
+        self.idle_seconds = idle_seconds
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()  # Bookkeeping
+        # One load or eviction at a time, so RSS changes can be attributed
+        self._load_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def register(self, name: str, load: Callable[[], object], unload: Callable[[object], None],
+                 warmup: Optional[Callable[[object], None]] = None,
+                 can_load: Optional[Callable[[], bool]] = None,
+                 pinned: bool = False, estimate_mb: float = 0.0):
+        """
+        Register a model. `load` returns the loaded model, `unload` drops it,
+        `warmup` runs sample inputs through a reloaded model, and `can_load`
+        tells whether loading could succeed (e.g. the artifacts exist).
+        `estimate_mb` stands in for the cost until a load has measured it.
+        """
+        self._entries[name] = _Entry(name, load, unload, warmup, can_load, pinned, estimate_mb)
+
+    def preload(self, name: str) -> bool:
+        """Load a model at startup (without warmup); logs rather than raises on failure."""
+        try:
+            self._load(self._entries[name], warmup=False, cold_start=False)
+            return True
+        except Exception as e:
+            logger.error(f"Error loading {name} model: {e}")
+            return False
+
+    def available(self, name: str) -> bool:
+        """Whether the model is resident or can be loaded on demand."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return False
+        if entry.obj is not None:
+            return True
+        return entry.can_load() if entry.can_load else True
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._entries
+
+    def is_resident(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return entry is not None and entry.obj is not None
+
+    def is_evicted(self, name: str) -> bool:
+        """Whether the model was loaded and has since been evicted."""
+        entry = self._entries.get(name)
+        return entry is not None and entry.obj is None and any(entry.evictions.values())
+
+    def get(self, name: str):
+        """The resident model, or None; doesn't load it or mark it used."""
+        entry = self._entries.get(name)
+        return entry.obj if entry else None
+
+    def replace(self, name: str, obj):
+        """Record a new version installed by someone else (see model_manager.py)."""
+        entry = self._entries.get(name)
+        if entry is not None:
+            with self._lock:
+                entry.obj = obj
+
+    @contextlib.contextmanager
+    def use(self, name: str):
+        """Hold a model for the duration of the block, loading it first if needed."""
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ModelUnavailable(f"Model {name} is not served by this process")
+        with self._lock:
+            obj = entry.obj
+            if obj is not None:
+                entry.in_use += 1
+        if obj is None:
+            obj = self._load(entry, warmup=True, cold_start=True, hold=True)
+        try:
+            yield obj
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.monotonic()
+
+    def evict(self, name: str, reason: str = "manual") -> bool:
+        """Evict a model if it isn't pinned and no request holds it; returns whether it was evicted."""
+        entry = self._entries.get(name)
+        if entry is None:
+            return False
+        with self._load_lock:
+            return self._evict(entry, reason)
+
+    def start(self):
+        """Start the idle eviction thread. Call after forking, e.g. on app startup."""
+        if self.idle_seconds <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sweep, name="model-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            models = {
+                entry.name: {
+                    "resident": entry.obj is not None,
+                    "pinned": entry.pinned,
+                    "in_use": entry.in_use,
+                    "cost_mb": round(entry.cost_mb, 1) if entry.cost_mb is not None else None,
+                    "freed_mb": round(entry.freed_mb, 1) if entry.freed_mb is not None else None,
+                    "idle_seconds": round(now - entry.last_used, 1) if entry.last_used else None,
+                    "loads": entry.loads,
+                    "cold_starts": entry.cold_starts,
+                    "mean_load_seconds": round(entry.load_seconds / entry.loads, 3) if entry.loads else None,
+                    "evictions": dict(entry.evictions),
+                    "last_error": entry.last_error,
+                }
+                for entry in self._entries.values()
+            }
+            resident = sum(entry.cost for entry in self._entries.values() if entry.obj is not None)
+        rss = rss_mb()
+        return {
+            "budget_mb": self.budget_mb or None,
+            "resident_mb": round(resident, 1),
+            "process_rss_mb": round(rss, 1) if rss is not None else None,
+            "idle_seconds": self.idle_seconds or None,
+            "models": models,
+        }
+
+    def _load(self, entry: _Entry, warmup: bool, cold_start: bool, hold: bool = False):
+        with self._load_lock:
+            # Someone else may have loaded it while we waited
+            with self._lock:
+                if entry.obj is not None:
+                    if hold:
+                        entry.in_use += 1
+                    return entry.obj
+
+            self._make_room(entry.cost, exclude=entry)
+            before = rss_mb()
+            start = time.perf_counter()
+            with tracing.span("model.load", model=entry.name, cold_start=cold_start):
+                try:
+                    obj = entry.load()
+                    if warmup and entry.warmup is not None:
+                        entry.warmup(obj)
+                except Exception as e:
+                    entry.last_error = str(e)
+                    raise ModelUnavailable(f"Could not load {entry.name} model: {e}") from e
+            elapsed = time.perf_counter() - start
+            after = rss_mb()
+
+            with self._lock:
+                entry.obj = obj
+                if before is not None and after is not None:
+                    entry.cost_mb = max(0.0, after - before)
+                entry.loads += 1
+                entry.cold_starts += int(cold_start)
+                entry.load_seconds += elapsed
+                entry.last_used = time.monotonic()
+                entry.last_error = None
+                if hold:
+                    entry.in_use += 1
+            logger.info(f"Loaded {entry.name} model in {elapsed:.1f}s"
+                        + (f" (+{entry.cost_mb:.0f}MB RSS)" if entry.cost_mb is not None else ""))
+            # The measured cost may exceed the estimate used to make room
+            self._make_room(0.0, exclude=entry)
+            return obj
+
+    def _make_room(self, needed_mb: float, exclude: _Entry):
+        """Evict least recently used, unheld models until needed_mb fits the budget. Holds _load_lock."""
+        if self.budget_mb <= 0:
+            return
+        while True:
+            with self._lock:
+                resident = sum(e.cost for e in self._entries.values() if e.obj is not None)
+                if resident + needed_mb <= self.budget_mb:
+                    return
+                candidates = [
+                    e for e in self._entries.values()
+                    if e.obj is not None and not e.pinned and e.in_use == 0 and e is not exclude
+                ]
+            if not candidates:
+                logger.warning(f"Model memory budget of {self.budget_mb:.0f}MB exceeded "
+                               f"({resident + needed_mb:.0f}MB) and nothing can be evicted")
+                return
+            if not self._evict(min(candidates, key=lambda e: e.last_used), "pressure"):
+                return
+
+    def _evict(self, entry: _Entry, reason: str) -> bool:
+        """Drop an unpinned model no request holds. Holds _load_lock."""
+        with self._lock:
+            if entry.obj is None or entry.in_use or entry.pinned:
+                return False
+            obj, entry.obj = entry.obj, None
+            entry.evictions[reason] += 1
+        before = rss_mb()
+        try:
+            entry.unload(obj)
+        except Exception as e:
+            logger.error(f"Error unloading {entry.name} model: {e}")
+        del obj
+        release_memory()
+        after = rss_mb()
+        if before is not None and after is not None:
+            entry.freed_mb = max(0.0, before - after)
+        logger.info(f"Evicted {entry.name} model ({reason})"
+                    + (f", freed {entry.freed_mb:.0f}MB RSS" if entry.freed_mb is not None else ""))
+        return True
+
+    def _sweep(self):
+        interval = max(1.0, min(self.idle_seconds / 4, 30.0))
+        while not self._stopped.wait(interval):
+            now = time.monotonic()
+            for entry in list(self._entries.values()):
+                if (entry.obj is not None and not entry.pinned and not entry.in_use
+                        and now - entry.last_used > self.idle_seconds):
+                    try:
+                        with self._load_lock:
+                            if time.monotonic() - entry.last_used > self.idle_seconds:
+                                self._evict(entry, "idle")
+                    except Exception as e:
+                        logger.error(f"Idle eviction of {entry.name} failed: {e}")
@@ -0,0 +1,324 @@
+"""
+Semantic answer cache for /chat.
+
+Farmers ask the same questions in many phrasings ("yellow leaves on rice",
+"rice leaves turning yellow"). Questions are normalized and embedded on the
+CPU, and a new question whose nearest cached question is at least
+`threshold` cosine-similar gets the stored answer instead of an LLM call and
+a translation.
+
+Entries are partitioned by response language, since the cached answer is
+already translated. Each partition holds at most `max_entries` unit vectors in
+one matrix, so a lookup is a single matrix-vector product; the least recently
+used entry is evicted when it is full, and entries expire after `ttl` seconds.
+
+The embedder is a small sentence-transformers model (MiniLM) run through
+transformers when torch is available. Without it (the crop serving profile,
+or no model download) questions are embedded by hashing their words and
+character trigrams, which still matches reworded and reordered questions.
+
+Similar wording doesn't mean the same answer: "how much urea for wheat" and
+"... for rice", or "spray before rain" and "... after rain", embed close
+together with either embedder. So a cached answer is only reused when both
+questions have the same key terms: crops and inputs, numbers, negations and
+qualifiers such as before/after. The cache is per server process.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "2000"))  # Entries per language; 0 disables
+CHAT_CACHE_TTL_SECONDS = float(os.getenv("CHAT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CHAT_CACHE_EMBEDDING_MODEL = os.getenv("CHAT_CACHE_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# Overrides the embedder's own default threshold
+CHAT_CACHE_THRESHOLD = os.getenv("CHAT_CACHE_THRESHOLD")
+
+HASHING_DIMENSIONS = 2048
+# Words that don't change what a farming question is about
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "am", "was", "were", "be", "my", "our", "your", "i", "we", "you",
+    "it", "its", "of", "on", "in", "at", "to", "for", "with", "and", "or", "do", "does", "did", "what",
+    "why", "how", "which", "when", "should", "can", "could", "there", "this", "that", "these", "me",
+    "please", "tell", "about", "getting", "turning", "becoming", "some", "any",
+}
+
+
+# Words that change the answer however similar the rest of a question is
+NEGATIONS = {"no", "not", "never", "without", "don", "dont", "doesn", "isn", "cannot", "avoid"}
+QUALIFIERS = {
+    "before", "after", "during", "above", "below", "under", "over", "more", "less", "too",
+    "early", "late", "increase", "decrease", "first", "last",
+}
+# Crops (the crop model's labels, PlantVillage crops and other common field
+# crops) and inputs a question can be about
+ENTITIES = {
+    "rice", "paddy", "wheat", "maize", "corn", "barley", "millet", "sorghum", "ragi", "oat", "chickpea",
+    "gram", "lentil", "pea", "bean", "kidneybean", "pigeonpea", "mothbean", "mungbean", "blackgram",
+    "soybean", "groundnut", "peanut", "mustard", "sunflower", "cotton", "jute", "sugarcane", "tea",
+    "coffee", "coconut", "banana", "mango", "grape", "apple", "orange", "citrus", "papaya", "pomegranate",
+    "watermelon", "muskmelon", "melon", "tomato", "potato", "pepper", "chilli", "onion", "garlic",
+    "cabbage", "cauliflower", "brinjal", "eggplant", "okra", "cucumber", "pumpkin", "squash",
+    "strawberry", "cherry", "peach", "blueberry", "raspberry", "tobacco",
+    "urea", "dap", "potash", "npk", "nitrogen", "phosphorus", "potassium", "zinc", "sulphur", "sulfur",
+    "boron", "iron", "calcium", "magnesium", "manure", "compost", "lime", "gypsum",
+}
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+def _singular(word: str) -> str:
+    for candidate in (word, word[:-1], word[:-2], word[:-3] + "y"):
+        if candidate in ENTITIES:
+            return candidate
+    return word
+
+
+def key_terms(normalized: str) -> frozenset:
+    """The terms of a normalized question that must match for a cached answer to apply."""
+    terms = set()
+    for word in normalized.split():
+        if word in NEGATIONS:
+            terms.add("not")
+        elif word in QUALIFIERS or any(char.isdigit() for char in word):
+            terms.add(word)
+        else:
+            entity = _singular(word)
+            if entity in ENTITIES:
+                terms.add(entity)
+    return frozenset(terms)
+
+
+class HashingEmbedder:
+    """Bag of words and in-word character trigrams, hashed into a fixed-size unit vector."""
+
+    name = "hashing"
+    threshold = 0.8
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        words = [word for word in text.split() if word not in STOPWORDS] or text.split()
+        for word in words:
+            padded = f"<{word}>"
+            trigrams = [padded[i:i + 3] for i in range(len(padded) - 2)]
+            # A whole word counts as much as all of its trigrams together, so
+            # "leaf" and "leaves" are close but not identical
+            self._add(vector, word, 1.0)
+            for trigram in trigrams:
+                self._add(vector, f"#{trigram}", 1.0 / len(trigrams))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float):
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % self.dimensions
+        vector[index] += weight if digest[4] & 1 else -weight
+
+
+class TransformerEmbedder:
+    """Mean-pooled sentence embeddings from a small transformers encoder."""
+
+    threshold = 0.85
+
+    def __init__(self, model_name: str = CHAT_CACHE_EMBEDDING_MODEL):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self._torch = torch
+        self.name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+        self._lock = threading.Lock()
+
+    def embed(self, text: str) -> np.ndarray:
+        encoded = self.tokenizer(text, truncation=True, max_length=128, return_tensors="pt")
+        with self._lock, self._torch.inference_mode():
+            hidden = self.model(**encoded).last_hidden_state
+        mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vector = ((hidden * mask).sum(dim=1) / mask.sum(dim=1))[0].numpy().astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+def create_embedder(model_name: str = CHAT_CACHE_EMBEDDING_MODEL, allow_transformers: bool = True):
+    """The transformer embedder if it can be loaded, else the hashing embedder."""
+    if allow_transformers and model_name and model_name != "hashing":
+        try:
+            return TransformerEmbedder(model_name)
+        except Exception as e:
+            logger.warning(f"Could not load embedding model {model_name}, using hashed n-grams: {e}")
+    return HashingEmbedder()
+
+
+class CacheLookup:
+    """Result of SemanticCache.lookup(); pass it to store() on a miss to reuse the embedding."""
+
+    def __init__(self, language: str, question: str, vector: Optional[np.ndarray],
+                 answer: Optional[str] = None, similarity: float = 0.0):
+        self.language = language
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.similarity = similarity
+
+    @property
+    def hit(self) -> bool:
+        return self.answer is not None
+
+
+class _Partition:
+    """Cached questions of one language: a vector matrix plus LRU bookkeeping."""
+
+    def __init__(self, max_entries: int, dimensions: int):
+        self.vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        self.valid = np.zeros(max_entries, dtype=bool)
+        self.entries = OrderedDict()  # slot -> (question, answer, expires_at), least recently used first
+        self.terms = {}  # slot -> key_terms() of the question
+        self.slots = {}  # normalized question -> slot
+        self.free = list(range(max_entries - 1, -1, -1))
+
+
+class SemanticCache:
+    """Per-language nearest-neighbour cache of chat answers, safe for concurrent use."""
+
+    def __init__(self, embedder=None, max_entries: int = CHAT_CACHE_SIZE,
+                 ttl: float = CHAT_CACHE_TTL_SECONDS, threshold: Optional[float] = None):
+        self.embedder = embedder or create_embedder()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        if threshold is None:
+            threshold = float(CHAT_CACHE_THRESHOLD) if CHAT_CACHE_THRESHOLD else self.embedder.threshold
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._partitions: Dict[str, _Partition] = {}
+        self._counts = {
+            "lookups": 0, "hits": 0, "exact_hits": 0, "key_term_misses": 0, "stores": 0, "evictions": 0,
+            "expired": 0,
+        }
+        self._embed_seconds = 0.0
+        self._embeds = 0
+
+    def lookup(self, question: str, language: str) -> CacheLookup:
+        """Find a cached answer for a question in this language."""
+        normalized = normalize_question(question)
+        with self._lock:
+            self._counts["lookups"] += 1
+            partition = self._partitions.get(language)
+            # Identical questions don't need an embedding
+            slot = partition.slots.get(normalized) if partition else None
+            if slot is not None:
+                answer = self._use(partition, slot)
+                if answer is not None:
+                    self._counts["hits"] += 1
+                    self._counts["exact_hits"] += 1
+                    return CacheLookup(language, normalized, None, answer, 1.0)
+
+        vector = self._embed(normalized)
+
+        with self._lock:
+            partition = self._partitions.get(language)
+            if partition is None or not partition.entries:
+                return CacheLookup(language, normalized, vector)
+            similarities = partition.vectors @ vector
+            similarities[~partition.valid] = -1.0
+            candidates = np.flatnonzero(similarities >= self.threshold)
+            if not len(candidates):
+                return CacheLookup(language, normalized, vector, similarity=float(similarities.max()))
+            # The most similar question about the same crops, inputs, negations and qualifiers
+            terms = key_terms(normalized)
+            mismatched = False
+            for slot in candidates[np.argsort(-similarities[candidates])]:
+                slot = int(slot)
+                if partition.terms[slot] != terms:
+                    mismatched = True
+                    continue
+                answer = self._use(partition, slot)
+                if answer is None:
+                    continue
+                self._counts["hits"] += 1
+                return CacheLookup(language, normalized, vector, answer, float(similarities[slot]))
+            if mismatched:
+                self._counts["key_term_misses"] += 1
+            return CacheLookup(language, normalized, vector)
+
+    def store(self, lookup: CacheLookup, answer: str):
+        """Cache the answer to a question that missed."""
+        if self.max_entries <= 0:
+            return
+        vector = lookup.vector if lookup.vector is not None else self._embed(lookup.question)
+        with self._lock:
+            partition = self._partitions.get(lookup.language)
+            if partition is None:
+                partition = self._partitions[lookup.language] = _Partition(self.max_entries, len(vector))
+            slot = partition.slots.get(lookup.question)
+            if slot is not None:
+                self._remove(partition, slot)
+            if not partition.free:
+                oldest = next(iter(partition.entries))
+                self._remove(partition, oldest)
+                self._counts["evictions"] += 1
+            slot = partition.free.pop()
+            partition.vectors[slot] = vector
+            partition.valid[slot] = True
+            partition.entries[slot] = (lookup.question, answer, time.monotonic() + self.ttl)
+            partition.terms[slot] = key_terms(lookup.question)
+            partition.slots[lookup.question] = slot
+            self._counts["stores"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._counts["lookups"]
+            return {
+                "embedder": self.embedder.name,
+                "threshold": self.threshold,
+                "entries": {language: len(p.entries) for language, p in self._partitions.items()},
+                "max_entries_per_language": self.max_entries,
+                "hit_rate": self._counts["hits"] / lookups if lookups else 0.0,
+                "mean_embed_ms": 1000 * self._embed_seconds / self._embeds if self._embeds else 0.0,
+                **self._counts
+            }
+
+    def _embed(self, text: str) -> np.ndarray:
+        start = time.perf_counter()
+        vector = np.asarray(self.embedder.embed(text), dtype=np.float32)
+        with self._lock:
+            self._embed_seconds += time.perf_counter() - start
+            self._embeds += 1
+        return vector
+
+    def _use(self, partition: _Partition, slot: int) -> Optional[str]:
+        """The answer in a slot, marked as recently used; None (and dropped) if expired."""
+        _, answer, expires_at = partition.entries[slot]
+        if expires_at < time.monotonic():
+            self._remove(partition, slot)
+            self._counts["expired"] += 1
+            return None
+        partition.entries.move_to_end(slot)
+        return answer
+
+    @staticmethod
+    def _remove(partition: _Partition, slot: int):
+        question, _, _ = partition.entries.pop(slot)
+        partition.terms.pop(slot, None)
+        partition.slots.pop(question, None)
+        partition.valid[slot] = False
+        partition.free.append(slot)
@@ -0,0 +1,295 @@
+"""
+Nearest-neighbour search over historical field records.
+
+Alongside the model's label, /recommend_crop returns the k most similar
+records from Crop_recommendation.csv and from past recommendations, as
+evidence for the recommendation. Features are standardized (so rainfall in mm
+doesn't drown out pH) and indexed in a KD-tree built once at startup.
+
+Records remember the user they came from, so a user's own past requests are
+never returned as evidence for their new one. A record identical to one
+already indexed (same values and crop, checked against a set of every
+record's key) is not added again, and at most max_stored records are added
+on top of the dataset.
+
+New records are appended to a small buffer that is searched by brute force
+next to the tree. Once the buffer grows past a fraction of the tree, the tree
+is rebuilt in the background with the buffered rows folded in and swapped in
+atomically, so appends stay cheap and queries never wait for a rebuild.
+"""
+import csv
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import numpy as np
+from sklearn.neighbors import KDTree
+
+from inference import CROP_FEATURES
+
+logger = logging.getLogger(__name__)
+
+CROP_DATASET_PATH = Path(os.getenv(
+    "CROP_DATASET_PATH", Path(__file__).resolve().parent.parent.parent / "Crop_recommendation.csv"
+))
+SIMILAR_FIELDS_K = int(os.getenv("SIMILAR_FIELDS_K", "5"))
+SIMILAR_FIELDS_MAX_K = 50
+# Most candidates fetched per query when leaving out a user's own records
+SIMILAR_FIELDS_MAX_FETCH = 4 * SIMILAR_FIELDS_MAX_K
+# Rebuild the tree once the append buffer reaches this fraction of it
+SIMILAR_FIELDS_REBUILD_FRACTION = float(os.getenv("SIMILAR_FIELDS_REBUILD_FRACTION", "0.05"))
+SIMILAR_FIELDS_MIN_REBUILD = 1000
+
+# Rows per block when brute-forcing, to bound the distance matrix size
+BLOCK_ROWS = 4096
+
+
+class _Snapshot:
+    """An immutable view of the index that queries run against."""
+
+    def __init__(self, tree: Optional[KDTree], rows: np.ndarray, labels: np.ndarray,
+                 sources: np.ndarray, owners: np.ndarray, mean: np.ndarray, scale: np.ndarray):
+        self.tree = tree
+        self.rows = rows  # Raw feature values, indexed like the tree
+        self.labels = labels
+        self.sources = sources
+        self.owners = owners  # User IDs, "" for dataset records
+        self.mean = mean
+        self.scale = scale
+
+
+class SimilarFieldsIndex:
+    """Standardized KD-tree plus an append buffer, safe for concurrent use."""
+
+    def __init__(self, rows: np.ndarray, labels: Sequence[str], sources: Sequence[str],
+                 owners: Optional[Sequence[str]] = None, leaf_size: int = 40,
+                 max_stored: Optional[int] = None):
+        self.leaf_size = leaf_size
+        self.max_stored = max_stored  # Records that may be added on top of the initial ones
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        rows = np.asarray(rows, dtype=np.float64)
+        owners = np.full(len(rows), "", dtype=object) if owners is None else np.asarray(owners, dtype=object)
+        self._snapshot = self._build(rows, np.asarray(labels), np.asarray(sources), owners)
+        # (values, crop) of every record, for exact duplicate checks
+        self._keys = {_key(row, label) for row, label in zip(rows, labels)}
+        self._stored = 0
+        self._owner_counts = {}
+        # Appended rows live in the first _buffer_count rows of a growable array;
+        # a full buffer is replaced rather than resized, so views handed to
+        # queries stay valid
+        self._buffer = np.empty((64, len(CROP_FEATURES)))
+        self._buffer_count = 0
+        self._buffer_labels = []
+        self._buffer_sources = []
+        self._buffer_owners = []
+
+    @classmethod
+    def from_csv(cls, path: Path = CROP_DATASET_PATH, **kwargs) -> "SimilarFieldsIndex":
+        """Build the index from Crop_recommendation.csv (CROP_FEATURES plus label)."""
+        with open(path, newline="") as f:
+            records = list(csv.DictReader(f))
+        rows = np.array([[float(r[name]) for name in CROP_FEATURES] for r in records], dtype=np.float64)
+        labels = np.array([r["label"] for r in records])
+        return cls(rows.reshape(-1, len(CROP_FEATURES)), labels, np.full(len(records), "dataset"), **kwargs)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._snapshot.rows) + self._buffer_count
+
+    def append(self, row: Sequence[float], label: str, source: str = "recommendation",
+               owner: str = "") -> bool:
+        """
+        Add a record; it is searchable immediately. Returns False if it was
+        already indexed or max_stored records have been added.
+        """
+        row = np.asarray(row, dtype=np.float64)
+        key = _key(row, label)
+        with self._lock:
+            if key in self._keys or (self.max_stored is not None and self._stored >= self.max_stored):
+                return False
+            self._keys.add(key)
+            self._stored += 1
+            self._owner_counts[owner] = self._owner_counts.get(owner, 0) + 1
+            if self._buffer_count == len(self._buffer):
+                grown = np.empty((2 * len(self._buffer), len(CROP_FEATURES)))
+                grown[:self._buffer_count] = self._buffer
+                self._buffer = grown
+            self._buffer[self._buffer_count] = row
+            self._buffer_count += 1
+            self._buffer_labels.append(label)
+            self._buffer_sources.append(source)
+            self._buffer_owners.append(owner)
+            threshold = max(SIMILAR_FIELDS_MIN_REBUILD, SIMILAR_FIELDS_REBUILD_FRACTION * len(self._snapshot.rows))
+            if self._buffer_count >= threshold and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild, name="similar-fields-rebuild", daemon=True).start()
+        return True
+
+    def extend(self, rows: np.ndarray, labels: Sequence[str], sources: Sequence[str],
+               owners: Sequence[str]) -> int:
+        """
+        Add many records at once (e.g. at startup), rebuilding the tree in
+        this thread. Skips duplicates and stops at max_stored; returns how
+        many were added.
+        """
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(CROP_FEATURES))
+        added_owners = np.asarray(owners, dtype=object)
+        with self._lock:
+            snapshot = self._snapshot
+            room = len(rows) if self.max_stored is None else max(0, self.max_stored - self._stored)
+            keep = []
+            for i, (row, label) in enumerate(zip(rows, labels)):
+                key = _key(row, label)
+                if len(keep) < room and key not in self._keys:
+                    self._keys.add(key)
+                    keep.append(i)
+            added_owners = added_owners[keep]
+            self._stored += len(keep)
+            for owner in added_owners:
+                self._owner_counts[owner] = self._owner_counts.get(owner, 0) + 1
+        new_snapshot = self._build(
+            np.vstack([snapshot.rows, rows[keep]]),
+            np.concatenate([snapshot.labels, np.asarray(labels)[keep]]),
+            np.concatenate([snapshot.sources, np.asarray(sources)[keep]]),
+            np.concatenate([snapshot.owners, added_owners])
+        )
+        with self._lock:
+            self._snapshot = new_snapshot
+        return len(keep)
+
+    def contains(self, row: Sequence[float], label: str) -> bool:
+        """Whether a record with exactly these values and crop is indexed."""
+        with self._lock:
+            return _key(row, label) in self._keys
+
+    def query(self, rows: Sequence[Sequence[float]], k: int = SIMILAR_FIELDS_K,
+              exclude_owner: Optional[str] = None) -> List[List[dict]]:
+        """
+        Return the k nearest records for each row, closest first, leaving out
+        those added for exclude_owner. Fewer than k come back only if most of
+        the nearest SIMILAR_FIELDS_MAX_FETCH records are the owner's.
+        """
+        rows = np.atleast_2d(np.asarray(rows, dtype=np.float64))
+        k = max(1, min(k, SIMILAR_FIELDS_MAX_K))
+        # Fetch enough candidates that k usually remain after dropping the
+        # owner's own, but no more than a fixed number however many they have
+        with self._lock:
+            excluded = self._owner_counts.get(exclude_owner, 0) if exclude_owner else 0
+        results = []
+        for candidates in self._nearest(rows, min(k + excluded, SIMILAR_FIELDS_MAX_FETCH)):
+            results.append([
+                {
+                    "crop": str(label),
+                    "source": str(source),
+                    "distance": round(float(distance), 4),
+                    **{name: float(value) for name, value in zip(CROP_FEATURES, row)}
+                }
+                for distance, row, label, source, owner in candidates
+                if not (exclude_owner and owner == exclude_owner)
+            ][:k])
+        return results
+
+    def _nearest(self, rows: np.ndarray, k: int) -> List[list]:
+        """(distance, row, label, source, owner) of the k nearest records for each row, closest first."""
+        with self._lock:
+            snapshot = self._snapshot
+            buffer_rows = self._buffer[:self._buffer_count] if self._buffer_count else None
+            buffer_labels = list(self._buffer_labels)
+            buffer_sources = list(self._buffer_sources)
+            buffer_owners = list(self._buffer_owners)
+
+        queries = (rows - snapshot.mean) / snapshot.scale
+
+        # Candidates from the tree: (distance, index into snapshot rows)
+        tree_k = min(k, len(snapshot.rows))
+        if snapshot.tree is not None and tree_k:
+            tree_dist, tree_idx = snapshot.tree.query(queries, k=tree_k)
+        else:
+            tree_dist = tree_idx = np.empty((len(rows), 0))
+
+        # Candidates from the buffer, by brute force
+        if buffer_rows is not None:
+            buffer_dist, buffer_idx = brute_force_knn((buffer_rows - snapshot.mean) / snapshot.scale, queries, k)
+        else:
+            buffer_dist = buffer_idx = np.empty((len(rows), 0))
+
+        results = []
+        for i in range(len(rows)):
+            candidates = [
+                (d, snapshot.rows[j], snapshot.labels[j], snapshot.sources[j], snapshot.owners[j])
+                for d, j in zip(tree_dist[i], tree_idx[i].astype(int))
+            ] + [
+                (d, buffer_rows[j], buffer_labels[j], buffer_sources[j], buffer_owners[j])
+                for d, j in zip(buffer_dist[i], buffer_idx[i].astype(int))
+            ]
+            candidates.sort(key=lambda c: c[0])
+            results.append(candidates[:k])
+        return results
+
+    def _rebuild(self):
+        try:
+            with self._lock:
+                snapshot = self._snapshot
+                count = self._buffer_count
+                rows = np.vstack([snapshot.rows, self._buffer[:count]])
+                labels = np.concatenate([snapshot.labels, np.array(self._buffer_labels[:count])])
+                sources = np.concatenate([snapshot.sources, np.array(self._buffer_sources[:count])])
+                owners = np.concatenate([snapshot.owners, np.array(self._buffer_owners[:count], dtype=object)])
+
+            # Building the tree is the slow part; queries keep using the old snapshot
+            new_snapshot = self._build(rows, labels, sources, owners)
+
+            with self._lock:
+                self._snapshot = new_snapshot
+                # Rows appended during the rebuild stay in the buffer
+                remaining = self._buffer[count:self._buffer_count]
+                self._buffer = np.empty((max(64, 2 * len(remaining)), len(CROP_FEATURES)))
+                self._buffer[:len(remaining)] = remaining
+                self._buffer_count = len(remaining)
+                del self._buffer_labels[:count]
+                del self._buffer_sources[:count]
+                del self._buffer_owners[:count]
+            logger.info(f"Similar fields index rebuilt with {len(rows)} records")
+        except Exception as e:
+            logger.error(f"Similar fields index rebuild failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    def _build(self, rows: np.ndarray, labels: np.ndarray, sources: np.ndarray,
+               owners: np.ndarray) -> _Snapshot:
+        mean = rows.mean(axis=0) if len(rows) else np.zeros(len(CROP_FEATURES))
+        scale = rows.std(axis=0) if len(rows) else np.ones(len(CROP_FEATURES))
+        scale[scale == 0] = 1.0
+        tree = KDTree((rows - mean) / scale, leaf_size=self.leaf_size) if len(rows) else None
+        return _Snapshot(tree, rows, labels, sources, owners, mean, scale)
+
+
+def _key(row: Sequence[float], label: str) -> tuple:
+    return np.asarray(row, dtype=np.float64).tobytes(), str(label)
+
+
+def brute_force_knn(data: np.ndarray, queries: np.ndarray, k: int):
+    """
+    Exact k nearest neighbours by blocked brute force. Distances are computed
+    a block of data rows at a time as |q|^2 - 2 q.x + |x|^2, so memory stays
+    bounded for large batches. Returns (distances, indices), closest first.
+    """
+    k = min(k, len(data))
+    best_dist = np.full((len(queries), k), np.inf)
+    best_idx = np.zeros((len(queries), k), dtype=np.int64)
+    query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+    for start in range(0, len(data), BLOCK_ROWS):
+        block = data[start:start + BLOCK_ROWS]
+        sq = query_norms - 2 * queries @ block.T + np.einsum("ij,ij->i", block, block)[None, :]
+        # Merge this block's candidates with the best so far
+        dist = np.concatenate([best_dist, sq], axis=1)
+        idx = np.concatenate([best_idx, np.arange(start, start + len(block))[None, :].repeat(len(queries), 0)], axis=1)
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        best_dist = np.take_along_axis(dist, top, axis=1)
+        best_idx = np.take_along_axis(idx, top, axis=1)
+    order = np.argsort(best_dist, axis=1)
+    best_dist = np.sqrt(np.maximum(np.take_along_axis(best_dist, order, axis=1), 0))
+    return best_dist, np.take_along_axis(best_idx, order, axis=1)
@@ -3,13 +3,21 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import joblib
 import numpy as np
-from PIL import Image
-import io
 import logging
 import warnings
 from pathlib import Path
 from typing import Optional
-import tensorflow as tf
+from advice import generate_crop_advice, generate_disease_advice
+from inference import CROP_ONLY, build_disease_fn
+from image_io import (
+    MAX_UPLOAD_BYTES,
+    InvalidImage,
+    UploadLimitMiddleware,
+    UploadTooLarge,
+    load_rgb,
+    open_image,
+    read_upload,
+)
 
 class CropData(BaseModel):
     N: float
@@ -22,42 +30,6 @@ class CropData(BaseModel):
     user_id: str = "demo_user"
     language: str = "en"
 
-def generate_crop_advice(crop: str, data: CropData) -> str:
-    """Generate customized farming advice based on the crop and soil parameters."""
-    
-    advice = f"Based on your soil parameters, {crop} is recommended.\n\n"
-    
-    # NPK advice
-    if data.N < 50:
-        advice += "- Nitrogen (N) is low. Consider adding nitrogen-rich fertilizers.\n"
-    elif data.N > 100:
-        advice += "- Nitrogen (N) is high. Reduce nitrogen fertilization.\n"
-        
-    if data.P < 30:
-        advice += "- Phosphorus (P) is low. Add phosphate fertilizers.\n"
-    elif data.P > 100:
-        advice += "- Phosphorus (P) is high. Reduce phosphate application.\n"
-        
-    if data.K < 30:
-        advice += "- Potassium (K) is low. Add potash fertilizers.\n"
-    elif data.K > 100:
-        advice += "- Potassium (K) is high. Reduce potassium application.\n"
-    
-    # pH advice
-    if data.ph < 6.0:
-        advice += "- Soil is acidic. Consider adding lime to raise pH.\n"
-    elif data.ph > 8.0:
-        advice += "- Soil is alkaline. Consider adding sulfur to lower pH.\n"
-    
-    # General care advice
-    advice += f"\nGeneral care for {crop}:\n"
-    advice += "1. Prepare the soil well before planting\n"
-    advice += "2. Maintain proper spacing between plants\n"
-    advice += "3. Monitor for pests and diseases regularly\n"
-    advice += f"4. Maintain soil moisture appropriate for {crop}\n"
-    
-    return advice
-
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -67,6 +39,9 @@ warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 app = FastAPI(title="AgriMind.AI API")
 
+# Reject oversized uploads while they stream in
+app.add_middleware(UploadLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 # Enable CORS
 app.add_middleware(
     CORSMiddleware,
@@ -87,20 +62,30 @@ except Exception as e:
     logger.error(f"Error loading crop model: {e}")
     crop_model = None
 
-try:
-    disease_model = tf.keras.models.load_model(MODEL_DIR / "disease_mobilenet.h5")
-    logger.info("Disease detection model loaded successfully")
+disease_model = None
+disease_fn = None
+if CROP_ONLY:
+    logger.info("Crop-only serving profile: disease model not loaded")
+else:
+    try:
+        # Imported here so the crop profile never loads TensorFlow
+        import tensorflow as tf
+        disease_model = tf.keras.models.load_model(MODEL_DIR / "disease_mobilenet.h5")
+        logger.info("Disease detection model loaded successfully")
+        # Fixed input signature, traced on the first call; much cheaper per call than predict()
+        disease_fn = build_disease_fn(disease_model, (160, 160))
     
-    # Load class indices
-    class_indices = joblib.load(MODEL_DIR / "disease_classes.joblib")
-    disease_class_names = {v: k for k, v in class_indices.items()}
-    logger.info(f"Loaded {len(disease_class_names)} disease classes")
-    logger.info(f"Sample classes: {list(disease_class_names.values())[:3]}")
-except Exception as e:
-    logger.error(f"Error loading disease model: {e}")
-    logger.error(f"Please run 'python train_models.py' to train the models")
-    disease_model = None
-    disease_class_names = {}
+        # Load class indices
+        class_indices = joblib.load(MODEL_DIR / "disease_classes.joblib")
+        disease_class_names = {v: k for k, v in class_indices.items()}
+        logger.info(f"Loaded {len(disease_class_names)} disease classes")
+        logger.info(f"Sample classes: {list(disease_class_names.values())[:3]}")
+    except Exception as e:
+        logger.error(f"Error loading disease model: {e}")
+        logger.error(f"Please run 'python train_models.py' to train the models")
+        disease_model = None
+        disease_fn = None
+        disease_class_names = {}
 
 def parse_disease_class(class_name: str) -> dict:
     """Parse disease class name to extract crop and disease information."""
@@ -186,12 +171,24 @@ async def detect_disease(
                 detail="Invalid file type. Please upload an image file."
             )
         
-        # Process image
-        contents = await file.read()
+        # Read the upload in chunks, checking the magic bytes up front
+        try:
+            contents = await read_upload(file)
+        except InvalidImage:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid file type. Please upload an image file."
+            )
+        except UploadTooLarge:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid image file. Please upload a valid image."
+            )
         
+        # Validate the header before decoding any pixels
         try:
-            img = Image.open(io.BytesIO(contents)).convert('RGB')
-        except Exception:
+            img = load_rgb(open_image(contents), target_size=(160, 160))
+        except InvalidImage:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid image file. Please upload a valid image."
@@ -199,12 +196,12 @@ async def detect_disease(
         
         # Resize to match model input
         img = img.resize((160, 160))  # Match training size
-        img_array = np.expand_dims(np.array(img) / 255.0, axis=0)
+        img_array = np.expand_dims(np.asarray(img, dtype=np.float32) / 255.0, axis=0)
         
         logger.info(f"Processing image with shape: {img_array.shape}")
         
         # Make prediction
-        prediction = disease_model.predict(img_array, verbose=0)
+        prediction = disease_fn(img_array).numpy()
         disease_label = int(np.argmax(prediction))
         confidence = float(np.max(prediction))
         
@@ -228,23 +225,7 @@ async def detect_disease(
         is_healthy = disease_info["is_healthy"]
         
         # Generate advice
-        if is_healthy:
-            advice = f"✅ Your {crop_name} plant appears healthy!\n\n"
-            advice += "Maintenance tips:\n"
-            advice += "1. Continue regular watering schedule\n"
-            advice += "2. Ensure adequate sunlight (6-8 hours daily)\n"
-            advice += "3. Monitor for early signs of pests or disease\n"
-            advice += "4. Maintain good air circulation\n"
-            advice += "5. Apply balanced fertilizer as needed"
-        else:
-            advice = f"⚠️ {disease_name} detected in {crop_name}\n\n"
-            advice += "Treatment recommendations:\n"
-            advice += "1. Remove and destroy affected leaves\n"
-            advice += "2. Apply appropriate fungicide or treatment\n"
-            advice += "3. Improve air circulation around plants\n"
-            advice += "4. Avoid overhead watering\n"
-            advice += "5. Monitor other plants for spread\n\n"
-            advice += "Consult a local agricultural expert for specific treatment options."
+        advice = generate_disease_advice(crop_name, disease_name, is_healthy)
         
         return {
             "success": True,
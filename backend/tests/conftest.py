@@ -0,0 +1,76 @@
+"""
+Shared setup for the backend tests.
+
+The app is imported with the crop-only serving profile (no TensorFlow or
+torch) and a small crop model trained into a temporary MODEL_DIR, so the
+tests run without the trained artifacts or network access.
+
+Run from backend/:
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+TEST_DIR = Path(tempfile.mkdtemp(prefix="agrimind-tests-"))
+ADMIN_TOKEN = "test-admin-token"
+
+os.environ.update({
+    "SERVING_PROFILE": "crop",
+    "MODEL_DIR": str(TEST_DIR / "models"),
+    "MODEL_RELOAD_POLL_SECONDS": "0",
+    "ADMIN_TOKEN": ADMIN_TOKEN,
+    "HUGGINGFACE_API_KEY": "",
+    "JOBS_DB_PATH": str(TEST_DIR / "jobs.sqlite3"),
+    "TRACE_FILE": "",
+    "CROP_DATASET_PATH": str(TEST_DIR / "missing.csv"),
+})
+
+
+def train_crop_model(model_dir: Path):
+    from sklearn.ensemble import RandomForestClassifier
+
+    rng = np.random.default_rng(0)
+    X = rng.random((60, 7)) * 100
+    y = np.array(["rice", "maize", "mango"])[np.arange(60) % 3]
+    model = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    model_dir.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, model_dir / "crop_rf.joblib")
+
+
+train_crop_model(TEST_DIR / "models")
+
+
+@pytest.fixture(scope="session")
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+@pytest.fixture
+def crop_request():
+    return {
+        "N": 90, "P": 42, "K": 43, "temperature": 20.8, "humidity": 82.0, "ph": 6.5, "rainfall": 202.9,
+        "user_id": "test-user", "advice_mode": "hybrid",
+    }
+
+
+@pytest.fixture
+def admin_headers():
+    return {"X-Admin-Token": ADMIN_TOKEN}
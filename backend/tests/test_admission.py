@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, Overloaded, tenant_for
+
+
+def controller(**kwargs):
+    kwargs.setdefault("queue_wait_target", 60)
+    return AdmissionController("/test", kwargs.pop("max_in_flight", 1), **kwargs)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_slots_go_round_robin_across_tenants():
+    async def scenario():
+        admission = controller()
+        await admission.acquire("holder")
+        order = []
+
+        async def request(tenant, name):
+            await admission.acquire(tenant)
+            order.append(name)
+
+        tasks = []
+        for tenant, name in [("alice", "a1"), ("alice", "a2"), ("alice", "a3"), ("bob", "b1")]:
+            tasks.append(asyncio.create_task(request(tenant, name)))
+            await settle()
+        assert admission.stats()["queued"] == 4
+
+        for _ in tasks:
+            admission.release(0.1)
+            await settle()
+        await asyncio.gather(*tasks)
+        return order
+
+    # Bob arrived last but doesn't wait behind all of Alice's requests
+    assert asyncio.run(scenario()) == ["a1", "b1", "a2", "a3"]
+
+
+def test_sheds_on_the_per_tenant_limit():
+    async def scenario():
+        admission = controller(max_queue_per_tenant=1)
+        await admission.acquire("holder")
+        waiting = asyncio.create_task(admission.acquire("alice"))
+        await settle()
+        with pytest.raises(Overloaded, match="too many queued requests"):
+            await admission.acquire("alice")
+        # Other tenants still get in line
+        other = asyncio.create_task(admission.acquire("bob"))
+        await settle()
+        assert admission.stats()["queued"] == 2
+        for task in (waiting, other):
+            task.cancel()
+        await asyncio.gather(waiting, other, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_sheds_when_the_queue_is_full():
+    async def scenario():
+        admission = controller(max_queue=1)
+        await admission.acquire("holder")
+        waiting = asyncio.create_task(admission.acquire("alice"))
+        await settle()
+        with pytest.raises(Overloaded, match="queue full") as raised:
+            await admission.acquire("bob")
+        assert raised.value.retry_after >= 1
+        assert admission.stats()["shed"] == 1
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_sheds_when_the_expected_wait_is_above_target():
+    async def scenario():
+        # One slot and about a second per request: a 0.5s target can't be met
+        admission = controller(queue_wait_target=0.5)
+        await admission.acquire("holder")
+        with pytest.raises(Overloaded, match="queue wait above target"):
+            await admission.acquire("alice")
+        assert admission.stats()["queued"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_that_times_out_is_shed_and_dequeued():
+    async def scenario():
+        admission = controller(queue_wait_target=0.05)
+        admission._service_time = 0.01
+        await admission.acquire("holder")
+        with pytest.raises(Overloaded, match="queue wait above target"):
+            await admission.acquire("alice")
+        assert admission.stats()["queued"] == 0
+        admission.release(0.0)
+        assert admission.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_slot_handed_to_a_waiter_that_times_out_passes_on(monkeypatch):
+    admission = controller()
+    wait_for = asyncio.wait_for
+    raced = []
+
+    async def times_out_as_slot_arrives(awaitable, timeout):
+        if raced:
+            return await wait_for(awaitable, timeout)
+        raced.append(True)
+        await settle()  # Let Bob join the queue
+        admission.release(0.1)  # The slot goes to Alice, first in line...
+        awaitable.cancel()
+        raise asyncio.TimeoutError  # ...just as her wait runs out
+
+    async def scenario():
+        await admission.acquire("holder")
+        monkeypatch.setattr(asyncio, "wait_for", times_out_as_slot_arrives)
+        alice = asyncio.create_task(admission.acquire("alice"))
+        await asyncio.sleep(0)
+        bob = asyncio.create_task(admission.acquire("bob"))
+        with pytest.raises(Overloaded):
+            await alice
+        await wait_for(bob, 1)
+
+    asyncio.run(scenario())
+    stats = admission.stats()
+    assert stats["in_flight"] == 1 and stats["queued"] == 0
+
+
+def test_one_address_cannot_queue_unlimited_users():
+    async def scenario():
+        admission = controller(max_tenants_per_address=2)
+        await admission.acquire("holder")
+        tasks = [asyncio.create_task(admission.acquire(f"10.0.0.1/user-{i}", "10.0.0.1")) for i in range(2)]
+        await settle()
+        with pytest.raises(Overloaded, match="too many queued users"):
+            await admission.acquire("10.0.0.1/user-2", "10.0.0.1")
+        # A user already queued may add requests, and other addresses and
+        # trusted clients are unaffected
+        tasks.append(asyncio.create_task(admission.acquire("10.0.0.1/user-0", "10.0.0.1")))
+        tasks.append(asyncio.create_task(admission.acquire("10.0.0.2/user-2", "10.0.0.2")))
+        tasks.append(asyncio.create_task(admission.acquire("farmer", None)))
+        await settle()
+        assert admission.stats()["queued"] == 5
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_tenant_includes_the_address_unless_trusted():
+    scope = {"client": ("203.0.113.7", 5000), "headers": [(b"x-user-id", b"farmer-1")], "query_string": b""}
+    assert tenant_for(scope, trusted_clients=set()) == ("203.0.113.7/farmer-1", "203.0.113.7")
+    assert tenant_for(scope, trusted_clients={"203.0.113.7"}) == ("farmer-1", None)
+
+    scope = {"client": ("203.0.113.7", 5000), "headers": [], "query_string": b"user_id=farmer-2"}
+    assert tenant_for(scope, trusted_clients=set()) == ("203.0.113.7/farmer-2", "203.0.113.7")
+    scope["query_string"] = b""
+    assert tenant_for(scope, trusted_clients=set()) == ("203.0.113.7", "203.0.113.7")
@@ -0,0 +1,40 @@
+import pytest
+
+import batch_scan
+from batch_scan import COLUMNS, ParquetResults
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def error_row(path):
+    return {**dict.fromkeys(COLUMNS, ""), "path": path, "is_healthy": None, "confidence": None, "error": "bad"}
+
+
+def result_row(path):
+    return {"path": path, "label": "", "class_name": "Tomato___healthy", "crop": "Tomato",
+            "disease": "Healthy", "is_healthy": True, "confidence": 0.9, "error": ""}
+
+
+def test_parts_share_one_schema(tmp_path):
+    results = ParquetResults(tmp_path / "scan.parquet", rows_per_part=2)
+    results.open()
+    results.write([error_row("a.jpg"), error_row("b.jpg")])
+    results.write([result_row("c.jpg"), result_row("d.jpg")])
+    results.close()
+
+    parts = sorted((tmp_path / "scan.parquet").glob("part-*.parquet"))
+    assert len(parts) == 2
+    assert pq.read_schema(parts[0]) == pq.read_schema(parts[1]) == results.schema
+    assert results.completed() == {"a.jpg", "b.jpg", "c.jpg", "d.jpg"}
+
+
+def test_unflushed_rows_are_not_done(tmp_path, monkeypatch):
+    results = ParquetResults(tmp_path / "scan.parquet", rows_per_part=100)
+    results.open()
+    results.write([result_row("a.jpg")])
+    assert results.completed() == set()
+
+    # Flushed once PART_FLUSH_SECONDS have passed, however few rows are buffered
+    monkeypatch.setattr(batch_scan, "PART_FLUSH_SECONDS", 0.0)
+    results.write([result_row("b.jpg")])
+    assert results.completed() == {"a.jpg", "b.jpg"}
@@ -0,0 +1,76 @@
+import time
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def breaker(**kwargs):
+    kwargs.setdefault("min_calls", 4)
+    kwargs.setdefault("open_seconds", 0.05)
+    return CircuitBreaker("test", **kwargs)
+
+
+def trip(cb):
+    for _ in range(cb.min_calls):
+        assert cb.allow_request()
+        cb.record_failure(0.1)
+
+
+def test_opens_on_failures_and_rejects_calls():
+    cb = breaker()
+    cb.record_success(0.1)
+    cb.record_failure(0.1)
+    cb.record_success(0.1)
+    assert cb.state == CLOSED  # Below min_calls
+
+    cb.record_failure(0.1)  # 2 of 4 failed: at the 50% threshold
+    assert cb.state == OPEN
+    assert not cb.allow_request()
+    assert cb.snapshot()["rejected"] == 1
+
+
+def test_opens_on_slow_calls():
+    cb = breaker(slow_call_seconds=1.0)
+    for _ in range(4):
+        cb.record_success(2.0)
+    assert cb.state == OPEN
+    assert "slow call rate" in cb.snapshot()["transitions"][-1]["reason"]
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success():
+    cb = breaker()
+    trip(cb)
+    time.sleep(0.06)
+
+    assert cb.allow_request()
+    assert cb.state == HALF_OPEN
+    assert not cb.allow_request()  # The probe is still running
+
+    cb.record_success(0.1)
+    assert cb.state == CLOSED
+    assert cb.allow_request() and cb.allow_request()
+    assert [t["to"] for t in cb.snapshot()["transitions"]] == [OPEN, HALF_OPEN, CLOSED]
+
+
+def test_failed_probe_opens_again():
+    cb = breaker()
+    trip(cb)
+    time.sleep(0.06)
+
+    assert cb.allow_request()
+    cb.record_failure(0.1)
+    assert cb.state == OPEN
+    assert not cb.allow_request()
+    assert cb.snapshot()["opened"] == 2
+
+
+def test_closing_starts_a_fresh_window():
+    cb = breaker()
+    trip(cb)
+    time.sleep(0.06)
+    assert cb.allow_request()
+    cb.record_success(0.1)
+
+    # The failures that opened it don't count against the new window
+    for _ in range(3):
+        cb.record_failure(0.1)
+    assert cb.state == CLOSED
@@ -0,0 +1,38 @@
+import pytest
+from fastapi import HTTPException
+
+import deadlines
+from deadlines import Deadline, parse_budget
+
+
+def test_check_deadline_raises_once_expired(app_module):
+    app_module.check_deadline()  # Outside a request there is no deadline
+
+    token = deadlines._current.set(Deadline(60))
+    try:
+        app_module.check_deadline()
+    finally:
+        deadlines._current.reset(token)
+
+    token = deadlines._current.set(Deadline(0))
+    try:
+        with pytest.raises(HTTPException) as raised:
+            app_module.check_deadline()
+        assert raised.value.status_code == 504
+    finally:
+        deadlines._current.reset(token)
+
+
+def test_expired_request_gets_504_before_the_model_runs(client, crop_request, monkeypatch):
+    monkeypatch.setattr(Deadline, "remaining", lambda self: 0.0)
+    response = client.post("/recommend_crop", json=crop_request)
+    assert response.status_code == 504
+    assert response.json()["detail"] == "Request deadline exceeded. Please try again."
+
+
+def test_budget_from_header_or_default():
+    assert parse_budget(None, 15) == 15
+    assert parse_budget("2500", 15) == 2.5
+    assert parse_budget("0", 15) == 15
+    assert parse_budget("soon", 15) == 15
+    assert parse_budget(str(3600 * 1000), 15) == deadlines.DEADLINE_MAX_SECONDS
@@ -0,0 +1,42 @@
+import io
+import warnings
+
+import pytest
+from PIL import Image
+
+import image_io
+from image_io import InvalidImage, load_rgb, open_image
+
+
+def png_bytes(width, height, mode="1"):
+    # 1-bit pixels compress to almost nothing, so large headers stay cheap
+    buffer = io.BytesIO()
+    Image.new(mode, (width, height)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_import_leaves_pil_and_warnings_alone():
+    assert Image.MAX_IMAGE_PIXELS == int(1024 * 1024 * 1024 // 4 // 3)  # PIL's default
+    assert not any(f[2] is Image.DecompressionBombWarning for f in warnings.filters)
+
+
+def test_pixel_limit_is_applied_per_call():
+    contents = png_bytes(10_000, 9_500)  # 95M pixels, above PIL's own warning limit
+    with pytest.raises(InvalidImage):
+        open_image(contents)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        img = open_image(contents, max_pixels=image_io.MAX_TILED_IMAGE_PIXELS)
+    assert img.size == (10_000, 9_500)
+    assert not any(f[2] is Image.DecompressionBombWarning for f in warnings.filters)
+
+
+def test_small_image_decodes():
+    assert load_rgb(open_image(png_bytes(32, 32, "L"))).mode == "RGB"
+
+
+def test_oversized_upload_gets_existing_400(client):
+    body = b"\xff\xd8\xff" + b"\0" * (image_io.MAX_UPLOAD_BYTES + image_io.MULTIPART_OVERHEAD_BYTES)
+    response = client.post("/detect_disease", files={"file": ("leaf.jpg", body, "image/jpeg")})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid image file. Please upload a valid image."
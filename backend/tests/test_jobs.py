@@ -0,0 +1,47 @@
+import threading
+import time
+
+import jobs
+from jobs import JobQueue
+
+
+def test_running_job_keeps_its_lease(tmp_path, monkeypatch):
+    # Renewed every second; without renewal the job's lease would expire after 1.5s
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 3.0)
+    release = threading.Event()
+    runs = []
+
+    def slow(payload, attachment):
+        runs.append(payload)
+        release.wait(10)
+        return {"ok": True}
+
+    queue = JobQueue({"slow": slow}, db_path=str(tmp_path / "jobs.sqlite3"), workers=2)
+    queue.start()
+    try:
+        job_id = queue.submit("slow", {"n": 1})
+        time.sleep(5)
+        assert queue._claim() is None
+        assert len(runs) == 1
+        release.set()
+        assert queue.get(job_id, wait=5)["status"] == "succeeded"
+    finally:
+        release.set()
+        queue.stop()
+
+
+def test_dead_workers_job_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", 0.1)
+    queue = JobQueue({"noop": lambda payload, attachment: {}}, db_path=str(tmp_path / "jobs.sqlite3"))
+    job_id = queue.submit("noop", {})
+    # Claimed by a worker that never renews or finishes
+    assert queue._claim()[0] == job_id
+    time.sleep(0.2)
+    assert queue._claim()[0] == job_id
+
+
+def test_job_endpoint_rejects_internal_callback(client, crop_request):
+    crop_request["callback_url"] = "https://127.0.0.1/hook"
+    response = client.post("/jobs/recommend_crop", json=crop_request)
+    assert response.status_code == 400
+    assert "callback_url" in response.json()["detail"]
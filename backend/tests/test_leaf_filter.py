@@ -0,0 +1,15 @@
+from PIL import Image, ImageDraw
+
+from leaf_filter import is_probable_leaf
+
+
+def test_blank_and_skin_images_are_rejected():
+    assert not is_probable_leaf(Image.new("RGB", (224, 224), (200, 200, 200)))
+    assert not is_probable_leaf(Image.new("RGB", (224, 224), (224, 172, 140)))
+
+
+def test_small_leaf_on_plain_background_passes():
+    # A leaf filling about 6% of the frame, as in a photo taken from a distance
+    img = Image.new("RGB", (224, 224), (200, 200, 200))
+    ImageDraw.Draw(img).ellipse((80, 80, 160, 130), fill=(60, 140, 40))
+    assert is_probable_leaf(img)
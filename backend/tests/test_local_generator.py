@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import local_generator  # noqa: E402
+from local_generator import LocalGenerator  # noqa: E402
+
+
+class FakeTokenizer:
+    eos_token_id = 0
+
+    def encode(self, text):
+        return [1 + len(word) for word in text.split()]
+
+    def decode(self, tokens, skip_special_tokens=True):
+        return " ".join(map(str, tokens))
+
+
+class FailingModel:
+    class config:
+        n_positions = 64
+
+    def eval(self):
+        return self
+
+    def __call__(self, **kwargs):
+        raise RuntimeError("model exploded")
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.setattr(local_generator.AutoTokenizer, "from_pretrained", lambda name: FakeTokenizer())
+    monkeypatch.setattr(local_generator.AutoModelForCausalLM, "from_pretrained", lambda name: FailingModel())
+    generator = LocalGenerator("fake", num_threads=1)
+    yield generator
+    generator.close()
+
+
+def test_failed_prefill_fails_the_request(generator):
+    # Without a timeout, generate() would wait forever on an unresolved future
+    future = generator.submit("how much urea for wheat", timeout=None)
+    with pytest.raises(RuntimeError, match="model exploded"):
+        future.result(timeout=5)
+    with pytest.raises(RuntimeError, match="model exploded"):
+        generator.generate("spray before rain", timeout=1)
+
+
+def test_close_fails_requests_never_admitted(generator, monkeypatch):
+    monkeypatch.setattr(generator, "_ensure_worker", lambda: None)
+    future = generator.submit("queued prompt")
+    generator.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        future.result(timeout=1)
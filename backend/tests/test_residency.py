@@ -0,0 +1,34 @@
+from residency import ResidencyManager
+
+
+def test_pinned_model_is_never_evicted():
+    residency = ResidencyManager(budget_mb=0)
+    residency.register("crop", lambda: object(), lambda model: None, pinned=True)
+    residency.preload("crop")
+
+    assert not residency.evict("crop")
+    assert not residency.evict("crop", reason="pressure")
+    assert residency.is_resident("crop")
+
+
+def test_evicted_model_is_reloaded_on_use():
+    loads = []
+    residency = ResidencyManager(budget_mb=0)
+    residency.register("disease", lambda: loads.append(1) or object(), lambda model: None)
+    residency.preload("disease")
+
+    assert residency.evict("disease")
+    assert not residency.is_resident("disease")
+    with residency.use("disease") as model:
+        assert model is not None
+    assert residency.is_resident("disease")
+    assert len(loads) == 2
+
+
+def test_evict_crop_then_recommend(client, admin_headers, crop_request):
+    response = client.post("/admin/models/evict", params={"kind": "crop"}, headers=admin_headers)
+    assert response.status_code == 409
+
+    response = client.post("/recommend_crop", json=crop_request)
+    assert response.status_code == 200, response.text
+    assert response.json()["recommended_crop"] in {"rice", "maize", "mango"}
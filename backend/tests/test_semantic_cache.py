@@ -0,0 +1,51 @@
+import pytest
+
+from semantic_cache import HashingEmbedder, SemanticCache, key_terms, normalize_question
+
+
+@pytest.fixture
+def cache():
+    return SemanticCache(HashingEmbedder(), max_entries=100, ttl=3600)
+
+
+def store(cache, question, answer, language="en"):
+    lookup = cache.lookup(question, language)
+    assert not lookup.hit
+    cache.store(lookup, answer)
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("How much urea for wheat per acre?", "how much urea for rice per acre"),
+    ("spray pesticide before rain", "spray pesticide after rain"),
+    ("should i spray fungicide", "should i not spray fungicide"),
+    ("how much urea for 2 acres of wheat", "how much urea for 5 acres of wheat"),
+])
+def test_different_key_terms_miss(cache, cached, asked):
+    store(cache, cached, "cached answer")
+    assert not cache.lookup(asked, "en").hit
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("yellow leaves on rice", "rice leaves turning yellow"),
+    ("best fertilizer for maize", "which fertilizer is best for maize?"),
+])
+def test_rewordings_hit(cache, cached, asked):
+    store(cache, cached, "cached answer")
+    lookup = cache.lookup(asked, "en")
+    assert lookup.hit
+    assert lookup.answer == "cached answer"
+
+
+def test_guard_applies_above_threshold():
+    # Even when the embeddings count as the same question, a different crop misses
+    cache = SemanticCache(HashingEmbedder(), max_entries=100, ttl=3600, threshold=0.5)
+    store(cache, "How much urea for wheat per acre?", "wheat answer")
+    lookup = cache.lookup("how much urea for rice per acre", "en")
+    assert not lookup.hit
+    assert cache.stats()["key_term_misses"] == 1
+
+
+def test_key_terms_ignore_plurals_and_wording():
+    assert key_terms(normalize_question("Aphids on tomatoes?")) == key_terms("how to control aphids on tomato")
+    assert key_terms("spray before rain") != key_terms("spray after rain")
+    assert key_terms("don t water wheat") == key_terms("never water wheat")
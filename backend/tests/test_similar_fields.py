@@ -0,0 +1,84 @@
+import numpy as np
+
+import similar_fields
+from similar_fields import SimilarFieldsIndex
+
+FIELD = [90, 42, 43, 20.8, 82.0, 6.5, 202.9]
+
+
+def make_index(**kwargs):
+    rng = np.random.default_rng(0)
+    rows = rng.random((50, 7)) * 100
+    return SimilarFieldsIndex(rows, ["maize"] * 50, ["dataset"] * 50, **kwargs)
+
+
+def test_own_records_are_not_returned():
+    index = make_index()
+    index.append(FIELD, "rice", owner="alice")
+
+    own = index.query([FIELD], k=3, exclude_owner="alice")[0]
+    assert len(own) == 3
+    assert all(r["source"] == "dataset" for r in own)
+
+    other = index.query([FIELD], k=3, exclude_owner="bob")[0]
+    assert other[0]["source"] == "recommendation" and other[0]["distance"] == 0.0
+
+
+def test_own_records_stay_excluded_after_rebuild(monkeypatch):
+    monkeypatch.setattr(similar_fields, "SIMILAR_FIELDS_MIN_REBUILD", 1)
+    index = make_index()
+    index.append(FIELD, "rice", owner="alice")
+    index._rebuild()
+    assert index._buffer_count == 0
+    assert all(r["source"] == "dataset" for r in index.query([FIELD], k=3, exclude_owner="alice")[0])
+
+
+def test_duplicates_are_not_added():
+    index = make_index()
+    assert index.append(FIELD, "rice", owner="alice")
+    assert not index.append(FIELD, "rice", owner="bob")
+    assert index.append(FIELD, "jute", owner="bob")
+    assert len(index) == 52
+
+    assert index.extend([FIELD, FIELD, [1, 2, 3, 4, 5, 6, 7]], ["rice", "mango", "mango"],
+                        ["recommendation"] * 3, ["carol"] * 3) == 2
+    assert len(index) == 54
+
+
+def test_cap_applies_to_appends():
+    index = make_index(max_stored=2)
+    assert index.extend([FIELD], ["rice"], ["recommendation"], ["alice"]) == 1
+    assert index.append([1, 2, 3, 4, 5, 6, 7], "rice", owner="bob")
+    assert not index.append([7, 6, 5, 4, 3, 2, 1], "rice", owner="bob")
+    assert len(index) == 52
+
+
+def test_request_is_not_its_own_evidence(client, app_module, crop_request, monkeypatch):
+    monkeypatch.setattr(app_module, "similar_fields", make_index())
+    crop_request["advice_mode"] = "sync"
+    first = client.post("/recommend_crop", json=crop_request).json()
+    second = client.post("/recommend_crop", json=crop_request).json()
+    assert first["similar_fields"] == second["similar_fields"]
+    assert all(r["source"] == "dataset" for r in second["similar_fields"])
+
+
+def test_duplicate_found_among_many_identical_neighbours():
+    index = make_index()
+    for i in range(similar_fields.SIMILAR_FIELDS_MAX_K + 10):
+        assert index.append(FIELD, f"crop-{i}", owner="alice")
+    assert not index.append(FIELD, "crop-0", owner="bob")
+    assert index.contains(FIELD, "crop-0")
+
+
+def test_fetch_size_does_not_grow_with_history(monkeypatch):
+    index = make_index()
+    rng = np.random.default_rng(1)
+    for row in rng.random((1000, 7)) * 100:
+        index.append(row, "rice", owner="alice")
+
+    sizes = []
+    nearest = index._nearest
+    monkeypatch.setattr(index, "_nearest", lambda rows, k: sizes.append(k) or nearest(rows, k))
+    result = index.query([FIELD], k=5, exclude_owner="alice")[0]
+    assert sizes == [similar_fields.SIMILAR_FIELDS_MAX_FETCH]
+    assert all(r["source"] == "dataset" for r in result)
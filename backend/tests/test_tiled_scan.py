@@ -0,0 +1,45 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import tiled_scan
+from image_io import open_image
+from tiled_scan import NotReducible, analyze_tiles, decode_reduced
+
+CLASSES = {0: "Tomato___healthy", 1: "Tomato___Late_blight"}
+
+
+def encode(img, fmt):
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def predict(batch):
+    return np.tile(np.array([[0.2, 0.8]], dtype=np.float32), (len(batch), 1))
+
+
+def test_large_non_jpeg_is_rejected(monkeypatch):
+    monkeypatch.setattr(tiled_scan, "MAX_IMAGE_PIXELS", 100 * 100)
+    img = Image.new("RGB", (200, 200), (60, 140, 40))
+    with pytest.raises(NotReducible):
+        decode_reduced(open_image(encode(img, "PNG")), 0.5)
+    # JPEGs decode at reduced size, so the limit doesn't apply to them
+    assert decode_reduced(open_image(encode(img, "JPEG")), 0.5).size == (100, 100)
+
+
+def test_small_image_reports_its_real_scale():
+    img = open_image(encode(Image.new("RGB", (100, 80), (60, 140, 40)), "PNG"))
+    result = analyze_tiles(img, (224, 224), CLASSES, predict, tile_size=512, overlay=False)
+    assert result["tiles"] == 1
+    assert result["tile_size"] == 100  # The whole image, in source pixels
+
+
+def test_too_many_tiles_is_rejected_before_decoding(monkeypatch):
+    img = open_image(encode(Image.new("RGB", (4000, 3000), (60, 140, 40)), "JPEG"))
+    monkeypatch.setattr(tiled_scan, "TILE_MAX_TILES", 100)  # 432 tiles of 224 pixels needed
+    monkeypatch.setattr(tiled_scan, "decode_reduced", lambda *args: pytest.fail("decoded"))
+    with pytest.raises(tiled_scan.TooManyTiles):
+        analyze_tiles(img, (224, 224), CLASSES, predict, tile_size=64, overlay=False)
@@ -0,0 +1,265 @@
+"""
+Tiled disease analysis of high-resolution field and drone photos.
+
+/detect_disease scales the whole upload down to one model input, which
+loses the lesions in a photo of a canopy. Tiled analysis instead slides a
+window of `tile_size` source pixels over the image with `overlap`, scales
+each tile to the model input and classifies the tiles in batches.
+
+The image is decoded only at about the scale the tiles need: a 512-pixel
+tile feeding a 224-pixel model needs less than half the resolution. JPEGs
+decode directly at 1/2, 1/4 or 1/8 scale; other formats can only be decoded
+in full and then reduced by an integer factor, so they are held to the
+MAX_IMAGE_PIXELS limit of /detect_disease. Tiles are cut from that one image and
+scaled to the model input one batch at a time, so memory stays bounded by
+the reduced image plus one batch however large the photo is, with no
+full-image resize. Tiles the leaf prefilter rejects (soil, sky) are not
+classified.
+
+Tile probabilities are stitched onto a grid with one cell per tile stride,
+each cell averaging the tiles covering it weighted by overlap. The result
+has per-class tile counts, the grid of disease probabilities and a PNG
+heatmap overlay.
+"""
+import base64
+import io
+import logging
+import math
+import os
+from collections import Counter, defaultdict
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+import inference
+import tracing
+from image_io import MAX_IMAGE_PIXELS, load_rgb
+from leaf_filter import is_probable_leaf
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = int(os.getenv("TILE_SIZE", "512"))  # Source pixels per tile side
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.25"))
+TILE_BATCH_SIZE = int(os.getenv("TILE_BATCH_SIZE", "16"))
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", "1024"))
+MAX_TILED_UPLOAD_BYTES = int(os.getenv("MAX_TILED_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+HEATMAP_MAX_SIDE = 1024
+HEATMAP_COLOR = (220, 30, 30)
+HEATMAP_MAX_ALPHA = 0.6
+# Below this confidence a tile's prediction isn't counted (as in /detect_disease)
+MIN_TILE_CONFIDENCE = 0.3
+
+
+class TooManyTiles(ValueError):
+    """Raised when the image would need more than TILE_MAX_TILES tiles."""
+
+
+class NotReducible(ValueError):
+    """Raised when an image is too large to decode in full and isn't a JPEG."""
+
+
+def tile_positions(length: int, tile: int, stride: int) -> List[int]:
+    """Tile offsets along one axis, with the last tile flush with the edge."""
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile, stride))
+    positions.append(length - tile)
+    return positions
+
+
+def decode_reduced(img: Image.Image, scale: float) -> Image.Image:
+    """
+    Decode an opened image to RGB at no less than `scale` of its size, as
+    cheaply as the format allows. Only JPEGs can be decoded at reduced size,
+    so other formats above MAX_IMAGE_PIXELS raise NotReducible.
+    """
+    if img.format != "JPEG" and img.width * img.height > MAX_IMAGE_PIXELS:
+        raise NotReducible(
+            f"{img.format} image has {img.width}x{img.height} pixels, limit for non-JPEG images is {MAX_IMAGE_PIXELS}"
+        )
+    target = (max(1, math.ceil(img.width * scale)), max(1, math.ceil(img.height * scale)))
+    decoded = load_rgb(img, target_size=target)
+    factor = int(min(decoded.width / target[0], decoded.height / target[1]))
+    if factor >= 2:
+        # Box-filter reduction, much cheaper than a resize to the exact scale
+        decoded = decoded.reduce(factor)
+    return decoded
+
+
+class TileGrid:
+    """Accumulates tile probabilities onto cells of one tile stride."""
+
+    def __init__(self, height: int, width: int, stride: int, num_classes: int):
+        self.stride = stride
+        self.rows = math.ceil(height / stride)
+        self.cols = math.ceil(width / stride)
+        self.probabilities = np.zeros((self.rows, self.cols, num_classes), dtype=np.float32)
+        self.weights = np.zeros((self.rows, self.cols), dtype=np.float32)
+
+    def _coverage(self, start: int, length: int, cells: int) -> Tuple[int, np.ndarray]:
+        """First cell and the fraction of each cell covered by [start, start + length)."""
+        first = start // self.stride
+        last = min(cells - 1, (start + length - 1) // self.stride)
+        edges = np.arange(first, last + 2) * self.stride
+        covered = np.minimum(edges[1:], start + length) - np.maximum(edges[:-1], start)
+        return first, covered / self.stride
+
+    def add(self, y: int, x: int, tile: Tuple[int, int], probabilities: np.ndarray):
+        row, row_weights = self._coverage(y, tile[0], self.rows)
+        col, col_weights = self._coverage(x, tile[1], self.cols)
+        weights = np.outer(row_weights, col_weights)
+        rows = slice(row, row + len(row_weights))
+        cols = slice(col, col + len(col_weights))
+        self.weights[rows, cols] += weights
+        self.probabilities[rows, cols] += weights[..., None] * probabilities
+
+    def mean(self) -> np.ndarray:
+        """Per-cell class probabilities; NaN where no leaf tile covers the cell."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return self.probabilities / self.weights[..., None]
+
+
+def iter_tile_batches(image: Image.Image, positions: List[Tuple[int, int]], source: Tuple[int, int],
+                      tile: Tuple[int, int], batch_size: int) -> Iterator[Tuple[List[Tuple[int, int]], np.ndarray]]:
+    """
+    Cut leaf tiles of `source` (height, width) pixels out of a decoded image
+    and yield them scaled to `tile` as float batches.
+    """
+    height, width = source
+    batch_positions, tiles = [], []
+    for y, x in positions:
+        view = image.crop((x, y, x + width, y + height))
+        if not is_probable_leaf(view):
+            continue
+        if source != tile:
+            view = view.resize(tile[::-1], Image.BILINEAR)
+        batch_positions.append((y, x))
+        tiles.append(np.asarray(view))
+        if len(tiles) == batch_size:
+            yield batch_positions, np.stack(tiles).astype(np.float32) / 255.0
+            batch_positions, tiles = [], []
+    if tiles:
+        yield batch_positions, np.stack(tiles).astype(np.float32) / 255.0
+
+
+def heatmap_png(image: Image.Image, disease: np.ndarray, stride: int) -> str:
+    """The image with per-cell disease probability overlaid in red, as a base64 PNG."""
+    factor = min(1.0, HEATMAP_MAX_SIDE / max(image.size))
+    base = image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))),
+                        Image.BILINEAR)
+    cells = Image.fromarray((np.clip(np.nan_to_num(disease, nan=0.0), 0, 1) * 255).astype(np.uint8))
+    # One cell per stride; the last row and column may reach past the image edge
+    size = (max(1, round(disease.shape[1] * stride * factor)), max(1, round(disease.shape[0] * stride * factor)))
+    mask = cells.resize(size, Image.BILINEAR).crop((0, 0, base.width, base.height))
+    alpha = mask.point(lambda value: int(value * HEATMAP_MAX_ALPHA))
+    base.paste(Image.new("RGB", base.size, HEATMAP_COLOR), (0, 0), alpha)
+    buffer = io.BytesIO()
+    base.save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def analyze_tiles(img: Image.Image, input_size: Tuple[int, int], class_names: dict,
+                  predict_batch: Callable[[np.ndarray], np.ndarray], tile_size: int = TILE_SIZE,
+                  overlap: float = TILE_OVERLAP, batch_size: int = TILE_BATCH_SIZE,
+                  overlay: bool = True, checkpoint: Optional[Callable[[], None]] = None) -> dict:
+    """
+    Classify overlapping tiles of an opened image and summarize them.
+    `predict_batch` maps a float batch of input_size tiles to class
+    probabilities; `checkpoint` runs between batches (e.g. a deadline check).
+    """
+    original = img.size
+    tile = input_size
+    # The scale at which a tile_size tile matches the model input
+    scale = min(1.0, min(tile) / tile_size)
+
+    # Count the tiles from the header first: a small tile_size on a large
+    # image would otherwise be decoded in full only to be rejected
+    source = (max(1, round(tile[0] / scale)), max(1, round(tile[1] / scale)))
+    stride = max(1, round(min(source) * (1 - overlap)))
+    tiles = (len(tile_positions(original[1], source[0], stride))
+             * len(tile_positions(original[0], source[1], stride)))
+    if tiles > TILE_MAX_TILES:
+        raise TooManyTiles(f"{tiles} tiles needed, limit is {TILE_MAX_TILES}")
+
+    with tracing.span("decode", scale=round(scale, 3)) as decode_span:
+        image = decode_reduced(img, scale)
+        decode_span.set(width=image.width, height=image.height)
+    # Tiles and stride in pixels of the decoded image, which may be larger than needed
+    reduced = image.width / original[0]
+    source = (max(1, round(tile[0] * reduced / scale)), max(1, round(tile[1] * reduced / scale)))
+    stride = max(1, round(min(source) * (1 - overlap)))
+    if image.width < source[1] or image.height < source[0]:
+        # Smaller than one tile: stretch it to fill one
+        image = image.resize((max(image.width, source[1]), max(image.height, source[0])), Image.BILINEAR)
+        reduced = image.width / original[0]
+
+    width, height = image.size
+    positions = [(y, x) for y in tile_positions(height, source[0], stride)
+                 for x in tile_positions(width, source[1], stride)]
+    if len(positions) > TILE_MAX_TILES:
+        raise TooManyTiles(f"{len(positions)} tiles needed, limit is {TILE_MAX_TILES}")
+
+    num_classes = len(class_names)
+    healthy = np.array([inference.parse_disease_class(class_names.get(i, ""))["is_healthy"]
+                        for i in range(num_classes)], dtype=bool)
+    grid = TileGrid(height, width, stride, num_classes)
+    counts = Counter()
+    confidence = defaultdict(float)
+    analyzed = low_confidence = 0
+
+    for batch_positions, batch in iter_tile_batches(image, positions, source, tile, batch_size):
+        if checkpoint is not None:
+            checkpoint()
+        with tracing.span("inference.batch", tiles=len(batch)):
+            probabilities = predict_batch(batch)
+        for (y, x), probs in zip(batch_positions, probabilities):
+            grid.add(y, x, source, probs)
+            class_id = int(np.argmax(probs))
+            if probs[class_id] < MIN_TILE_CONFIDENCE:
+                low_confidence += 1
+                continue
+            name = class_names.get(class_id, f"Unknown_{class_id}")
+            counts[name] += 1
+            confidence[name] += float(probs[class_id])
+            analyzed += 1
+
+    cells = grid.mean()
+    disease = cells[..., ~healthy].sum(axis=-1) if num_classes else np.zeros(cells.shape[:2])
+    top = np.argmax(np.nan_to_num(cells, nan=-1.0), axis=-1) if num_classes else np.zeros(cells.shape[:2], int)
+    covered = grid.weights > 0
+
+    classes, dominant = inference.summarize_classes(counts, confidence, unit="tiles")
+    affected = sum(entry["tiles"] for entry in classes if not entry["is_healthy"])
+    leaf_tiles = analyzed + low_confidence
+    with tracing.span("heatmap", enabled=overlay):
+        heatmap = heatmap_png(image, disease, stride) if overlay else None
+    return {
+        "image": {"width": original[0], "height": original[1]},
+        "tile_size": round(min(source) / reduced),  # In source pixels
+        "overlap": overlap,
+        "decode_scale": round(reduced, 4),
+        "tiles": len(positions),
+        "tiles_background": len(positions) - leaf_tiles,
+        "tiles_low_confidence": low_confidence,
+        "tiles_analyzed": analyzed,
+        "tiles_affected": affected,
+        "affected_fraction": round(affected / analyzed, 4) if analyzed else 0.0,
+        "dominant": dominant,
+        "classes": classes,
+        "grid": {
+            "rows": grid.rows,
+            "cols": grid.cols,
+            "cell_size": round(stride / reduced, 1),  # In source pixels
+            "disease_probability": [
+                [round(float(value), 3) if ok else None for value, ok in zip(row, mask)]
+                for row, mask in zip(disease, covered)
+            ],
+            "top_class": [
+                [class_names.get(int(value)) if ok else None for value, ok in zip(row, mask)]
+                for row, mask in zip(top, covered)
+            ],
+        },
+        "heatmap_png": heatmap,
+    }
@@ -0,0 +1,237 @@
+"""
+Lightweight per-request tracing.
+
+TracingMiddleware gives every HTTP request a trace ID (returned in the
+X-Trace-Id header, or taken from the client's header if it sent one) and a
+root span. Code handling the request opens child spans with
+
+    with tracing.span("inference", batch=4) as s:
+        ...
+        s.set(status_code=200)
+
+which nest into a tree. The current trace and span live in context
+variables, so spans opened in the threadpool attach to the right request;
+outside a trace, span() does nothing and costs almost nothing. Job workers
+start their own traces with trace().
+
+Finished traces are appended as one JSON line each to TRACE_FILE, rotated at
+TRACE_MAX_BYTES. A "{pid}" in the file name gives each server process its own
+file, which multi-worker deployments need since rotation is per process.
+Traces slower than TRACE_SLOW_SECONDS are also logged in full as a warning.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")  # Empty disables the file
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "5"))
+
+TRACE_HEADER = "x-trace-id"
+# Accept client trace IDs only if they look like one
+TRACE_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+_trace = contextvars.ContextVar("trace", default=None)
+_span = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """A timed stage of a trace, with attributes and child spans."""
+
+    def __init__(self, name: str, trace: "Trace", attrs: dict):
+        self.name = name
+        self.trace = trace
+        self.attrs = attrs
+        self.children = []
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        record = {
+            "name": self.name,
+            "start_ms": round((self.start - self.trace.root.start) * 1000, 2),
+            "duration_ms": round((end - self.start) * 1000, 2),
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if self.error:
+            record["error"] = self.error
+        if self.children:
+            record["children"] = [child.to_dict() for child in list(self.children)]
+        return record
+
+
+class _NoSpan:
+    """Returned outside a trace so callers can set attributes unconditionally."""
+
+    def set(self, **attrs):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace:
+    def __init__(self, name: str, trace_id: Optional[str] = None, **attrs):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.root = Span(name, self, attrs)
+
+    @property
+    def duration(self) -> float:
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return end - self.root.start
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "timestamp": self.started_at, **self.root.to_dict()}
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """Time a stage as a child of the current span; a no-op outside a trace."""
+    parent = _span.get()
+    if parent is None:
+        yield _NO_SPAN
+        return
+    child = Span(name, parent.trace, attrs)
+    parent.children.append(child)
+    token = _span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = _describe(e)
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _span.reset(token)
+
+
+def event(name: str, **attrs):
+    """Record a zero-length span, e.g. a skipped stage."""
+    with span(name, **attrs):
+        pass
+
+
+@contextlib.contextmanager
+def trace(name: str, trace_id: Optional[str] = None, **attrs):
+    """Run the block as the root span of a new trace, recorded when it ends."""
+    new = Trace(name, trace_id, **attrs)
+    trace_token = _trace.set(new)
+    span_token = _span.set(new.root)
+    try:
+        yield new
+    except BaseException as e:
+        new.root.error = _describe(e)
+        raise
+    finally:
+        new.root.end = time.perf_counter()
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+        record(new)
+
+
+def _describe(e: BaseException) -> str:
+    detail = getattr(e, "detail", None) or str(e)
+    return f"{type(e).__name__}: {detail}" if detail else type(e).__name__
+
+
+class _TraceLog:
+    """Appends finished traces to the rotating JSONL file, opened per process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._handler = None
+        self._pid = None
+
+    def write(self, line: str):
+        if not TRACE_FILE:
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Opened lazily so a forked worker never shares its parent's file
+                self._handler = RotatingFileHandler(
+                    TRACE_FILE.replace("{pid}", str(os.getpid())),
+                    maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8"
+                )
+                self._handler.setFormatter(logging.Formatter("%(message)s"))
+                self._pid = os.getpid()
+            self._handler.emit(logging.makeLogRecord({"msg": line}))
+
+
+_log = _TraceLog()
+
+
+def record(finished: Trace):
+    try:
+        data = finished.to_dict()
+        _log.write(json.dumps(data, default=str))
+        if finished.duration >= TRACE_SLOW_SECONDS:
+            logger.warning(
+                f"Slow request {finished.root.name} took {finished.duration * 1000:.0f}ms "
+                f"(trace {finished.trace_id}):\n{render(data)}"
+            )
+    except Exception as e:
+        logger.error(f"Could not record trace {finished.trace_id}: {e}")
+
+
+def render(data: dict, depth: int = 0) -> str:
+    """A span tree as indented text, one span per line."""
+    attrs = " ".join(f"{key}={value}" for key, value in data.get("attrs", {}).items())
+    line = f"{'  ' * depth}{data['name']} +{data['start_ms']:.1f}ms {data['duration_ms']:.1f}ms"
+    if attrs:
+        line += f" {attrs}"
+    if data.get("error"):
+        line += f" error={data['error']}"
+    return "\n".join([line] + [render(child, depth + 1) for child in data.get("children", [])])
+
+
+class TracingMiddleware:
+    """ASGI middleware starting a trace per HTTP request and returning its ID."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace_id = None
+        for name, value in scope.get("headers", []):
+            if name == TRACE_HEADER.encode() and TRACE_ID_PATTERN.match(value.decode("latin-1")):
+                trace_id = value.decode("latin-1")
+
+        with trace(f"{scope['method']} {scope['path']}", trace_id) as current:
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    current.root.set(status_code=message["status"])
+                    message = {
+                        **message,
+                        "headers": list(message.get("headers", [])) + [
+                            (TRACE_HEADER.encode(), current.trace_id.encode())
+                        ],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_with_trace_id)
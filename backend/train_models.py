@@ -1,27 +1,121 @@
+"""
+Train the crop recommendation and disease detection models.
+
+Usage:
+    cd backend
+    python train_models.py                          # Train both models from scratch
+    python train_models.py --crop                   # Only the crop model
+    python train_models.py --crop-update field.csv  # Add trees for new crop records
+    python train_models.py --crop-promote 20261019-101500  # Serve a saved crop version
+
+Every crop model is saved under models/crop_versions/ and recorded in
+models/crop_versions/registry.json, then promoted by atomically replacing
+models/crop_rf.joblib, which running servers pick up (see model_manager.py).
+
+--crop-update takes a CSV with the columns of Crop_recommendation.csv (N, P,
+K, temperature, humidity, ph, rainfall, label), e.g. accumulated field
+outcomes. Instead of refitting the forest it appends --add-trees trees
+(warm start) fitted on the new rows plus a stratified replay sample of the
+original training rows, so that every class stays represented. With
+--max-trees the oldest trees are dropped beyond that many, so the forest
+covers a sliding window of the data. The result is scored on a held-out set
+(the original test split plus a stable fifth of the new rows) and only
+promoted if it does not score lower than the current model.
+"""
+import argparse
+import json
+import shutil
+import time
+
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
-import tensorflow as tf
 import joblib
 from pathlib import Path
 import os
 from tqdm import tqdm
 
+CROP_DATASET = '../../Crop_recommendation.csv'
+CROP_FEATURES = ['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']
+CROP_MODEL_PATH = Path('models/crop_rf.joblib')
+CROP_VERSIONS_DIR = Path('models/crop_versions')
+CROP_REGISTRY_PATH = CROP_VERSIONS_DIR / 'registry.json'
+# Percentage of new rows held out for validation, chosen by hashing each row so
+# a row stays on the same side as the feedback file grows
+CROP_UPDATE_HOLDOUT_PERCENT = 20
+
+
+def load_crop_dataset():
+    """The original dataset split into the training rows and held-out rows."""
+    df = pd.read_csv(CROP_DATASET)
+    print(f"Loaded {len(df)} records from crop recommendation dataset")
+    # Same split as every previous training run, so the held-out rows were never trained on
+    return train_test_split(df, test_size=0.2, random_state=42)
+
+
+def read_crop_registry():
+    if not CROP_REGISTRY_PATH.exists():
+        return []
+    with open(CROP_REGISTRY_PATH) as f:
+        return json.load(f)
+
+
+def write_crop_registry(entries):
+    tmp = CROP_REGISTRY_PATH.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp, CROP_REGISTRY_PATH)
+
+
+def save_crop_version(model, **metadata):
+    """Save a crop model as a new version and record it in the registry."""
+    CROP_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    entries = read_crop_registry()
+    version = time.strftime('%Y%m%d-%H%M%S')
+    while any(entry['version'] == version for entry in entries):
+        version += '-1'
+    path = CROP_VERSIONS_DIR / f"crop_rf-{version}.joblib"
+    joblib.dump(model, path)
+    entries.append({
+        'version': version,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'path': str(path),
+        'n_estimators': len(model.estimators_),
+        'promoted': False,
+        **metadata,
+    })
+    write_crop_registry(entries)
+    print(f"Saved crop model version {version} to {path}")
+    return version
+
+
+def promote_crop_version(version):
+    """Make a saved version the served crop model with an atomic rename."""
+    entries = read_crop_registry()
+    entry = next((entry for entry in entries if entry['version'] == version), None)
+    if entry is None:
+        raise SystemExit(f"No crop model version {version} in {CROP_REGISTRY_PATH}")
+    # Never write into crop_rf.joblib: servers memory-map it
+    tmp = CROP_MODEL_PATH.with_suffix('.joblib.tmp')
+    shutil.copyfile(entry['path'], tmp)
+    os.replace(tmp, CROP_MODEL_PATH)
+    for other in entries:
+        other['current'] = other is entry
+    entry['promoted'] = True
+    entry['promoted_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    write_crop_registry(entries)
+    print(f"Promoted crop model version {version} to {CROP_MODEL_PATH}")
+
+
 def train_crop_recommendation_model():
     print("Training crop recommendation model...")
     
-    # Load the dataset
-    df = pd.read_csv('../../Crop_recommendation.csv')
-    print(f"Loaded {len(df)} records from crop recommendation dataset")
-    
-    # Prepare features and target
-    X = df[['N', 'P', 'K', 'temperature', 'humidity', 'ph', 'rainfall']]
-    y = df['label']
-    
-    # Split the data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    # Load the dataset and split the data
+    train, test = load_crop_dataset()
+    X_train, y_train = train[CROP_FEATURES], train['label']
+    X_test, y_test = test[CROP_FEATURES], test['label']
     
     # Train the model
     model = RandomForestClassifier(n_estimators=100, random_state=42)
@@ -32,10 +126,72 @@ def train_crop_recommendation_model():
     print(f"Crop recommendation model accuracy: {accuracy:.2f}")
     
     # Save the model
-    joblib.dump(model, 'models/crop_rf.joblib')
+    version = save_crop_version(model, mode='full', train_rows=len(train), holdout_accuracy=round(accuracy, 4))
+    promote_crop_version(version)
     print("Crop recommendation model saved successfully!")
 
+
+def update_crop_recommendation_model(new_data, add_trees=20, max_trees=None, replay=1.0, tolerance=0.0):
+    """
+    Append trees fitted on new labelled rows to the current crop model and
+    promote the result if it holds up on the held-out rows.
+    """
+    start = time.perf_counter()
+    print(f"Updating crop recommendation model with {new_data}...")
+    model = joblib.load(CROP_MODEL_PATH)
+    parent = next((entry['version'] for entry in read_crop_registry() if entry.get('current')), None)
+
+    new = pd.read_csv(new_data)
+    missing = [column for column in CROP_FEATURES + ['label'] if column not in new.columns]
+    if missing:
+        raise SystemExit(f"{new_data} is missing columns: {', '.join(missing)}")
+    new = new[CROP_FEATURES + ['label']].dropna()
+    unknown = sorted(set(new['label']) - set(model.classes_))
+    if unknown:
+        # New trees would number the classes differently from the existing ones
+        raise SystemExit(f"New crops {', '.join(unknown)} need a full retrain (python train_models.py --crop)")
+
+    held_out = pd.util.hash_pandas_object(new, index=False).values % 100 < CROP_UPDATE_HOLDOUT_PERCENT
+    new_train, new_test = new[~held_out], new[held_out]
+    if new_train.empty:
+        raise SystemExit(f"No rows left to train on in {new_data}")
+    train, test = load_crop_dataset()
+    test = pd.concat([test, new_test])
+
+    # Replay original rows from every class, so the new trees still see all classes
+    per_class = max(1, int(np.ceil(len(new_train) * replay / len(model.classes_))))
+    sample = train.groupby('label').sample(n=per_class, replace=True, random_state=len(model.estimators_))
+    fit = pd.concat([new_train, sample])
+    print(f"Fitting {add_trees} trees on {len(new_train)} new and {len(sample)} replayed records")
+
+    baseline = model.score(test[CROP_FEATURES], test['label'])
+    model.set_params(warm_start=True, n_estimators=len(model.estimators_) + add_trees)
+    model.fit(fit[CROP_FEATURES], fit['label'])
+    if max_trees and len(model.estimators_) > max_trees:
+        # Drop the oldest trees
+        model.estimators_ = model.estimators_[-max_trees:]
+        model.n_estimators = max_trees
+    model.set_params(warm_start=False)
+
+    accuracy = model.score(test[CROP_FEATURES], test['label'])
+    new_accuracy = model.score(new_test[CROP_FEATURES], new_test['label']) if len(new_test) else None
+    print(f"Held-out accuracy on {len(test)} records: {baseline:.4f} -> {accuracy:.4f}"
+          + (f" ({new_accuracy:.4f} on {len(new_test)} new records)" if new_accuracy is not None else ""))
+
+    version = save_crop_version(
+        model, mode='incremental', parent=parent, new_data=str(new_data), new_rows=len(new_train),
+        replay_rows=len(sample), holdout_accuracy=round(accuracy, 4), baseline_accuracy=round(baseline, 4),
+    )
+    if accuracy + tolerance < baseline:
+        print(f"Not promoting version {version}: it scores lower than the current model "
+              f"(promote it anyway with --crop-promote {version})")
+    else:
+        promote_crop_version(version)
+    print(f"Crop model update took {time.perf_counter() - start:.1f}s")
+
 def train_disease_detection_model():
+    import tensorflow as tf
+
     print("Training disease detection model...")
     
     # Enable mixed precision training for better performance on Apple Silicon
@@ -119,12 +275,33 @@ def train_disease_detection_model():
     print("Class indices saved successfully!")
 
 def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--crop", action="store_true", help="Only train the crop model")
+    mode.add_argument("--crop-update", metavar="CSV", help="Update the crop model with new labelled records")
+    mode.add_argument("--crop-promote", metavar="VERSION", help="Serve a saved crop model version")
+    parser.add_argument("--add-trees", type=int, default=20, help="Trees to add with --crop-update")
+    parser.add_argument("--max-trees", type=int, help="Drop the oldest trees beyond this many")
+    parser.add_argument("--replay", type=float, default=1.0,
+                        help="Original records replayed per new record with --crop-update")
+    parser.add_argument("--tolerance", type=float, default=0.0,
+                        help="Held-out accuracy an update may lose and still be promoted")
+    args = parser.parse_args()
+
     # Create models directory if it doesn't exist
     os.makedirs('models', exist_ok=True)
     
-    # Train both models
-    train_crop_recommendation_model()
-    train_disease_detection_model()
+    if args.crop_update:
+        update_crop_recommendation_model(args.crop_update, args.add_trees, args.max_trees, args.replay,
+                                         args.tolerance)
+    elif args.crop_promote:
+        promote_crop_version(args.crop_promote)
+    elif args.crop:
+        train_crop_recommendation_model()
+    else:
+        # Train both models
+        train_crop_recommendation_model()
+        train_disease_detection_model()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,266 @@
+"""
+Disease scanning of walk-along videos and frame sequences.
+
+Frames are sampled from a video at VIDEO_SAMPLE_FPS (OpenCV grabs the frames
+in between without decoding them to pixels) and scaled to the model input
+as they are decoded. A frame that looks almost the same as the last one
+kept, compared on a 16x16 grayscale thumbnail, is skipped, as is one the
+leaf prefilter rejects. The rest are classified in batches of
+VIDEO_BATCH_SIZE while a background thread decodes the next frames.
+
+scan_frames() yields one event per batch with the frame results and the
+clip summary so far, then a final summary: the dominant disease, its
+confidence and how many frames show disease.
+
+OpenCV is optional and only needed for video files; frame sequences are
+decoded with Pillow.
+"""
+import logging
+import os
+import queue
+import threading
+from collections import Counter, defaultdict
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+import inference
+import tracing
+from image_io import load_rgb, open_image
+from leaf_filter import is_probable_leaf
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+VIDEO_SAMPLE_FPS = float(os.getenv("VIDEO_SAMPLE_FPS", "2"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "120"))
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "16"))
+# Mean absolute difference (0-255) of the grayscale thumbnails below which a
+# frame counts as a duplicate of the last frame kept; 0 keeps every frame
+VIDEO_DEDUP_THRESHOLD = float(os.getenv("VIDEO_DEDUP_THRESHOLD", "6"))
+MAX_VIDEO_UPLOAD_BYTES = int(os.getenv("MAX_VIDEO_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+SIGNATURE_SIZE = (16, 16)
+# Below this confidence a frame's prediction isn't counted (as in /detect_disease)
+MIN_FRAME_CONFIDENCE = 0.3
+# Decoded batches kept ready ahead of inference
+PREFETCH_BATCHES = 2
+
+# (index, timestamp in seconds or None, RGB image)
+Frame = Tuple[int, Optional[float], Image.Image]
+
+
+class InvalidVideo(Exception):
+    """Raised when a video can't be opened or has no frames."""
+
+
+def video_support() -> bool:
+    return cv2 is not None
+
+
+def probe_video(path: str) -> dict:
+    """Frame rate, frame count and duration of a video file; raises InvalidVideo."""
+    if cv2 is None:
+        raise InvalidVideo("Video decoding is not available (OpenCV is not installed)")
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise InvalidVideo("Cannot open video")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        ok, _ = capture.read()
+        if not ok:
+            raise InvalidVideo("Video has no readable frames")
+        return {
+            "fps": round(fps, 3),
+            "frames": frames,
+            "duration": round(frames / fps, 3) if fps and frames else None,
+        }
+    finally:
+        capture.release()
+
+
+def sample_video_frames(path: str, input_size: Tuple[int, int], sample_fps: float = VIDEO_SAMPLE_FPS,
+                        max_frames: int = VIDEO_MAX_FRAMES) -> Iterator[Frame]:
+    """Decode every n-th frame of a video at sample_fps, scaled to input_size (height, width)."""
+    capture = cv2.VideoCapture(path)
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 0.0
+        step = max(1, round(fps / sample_fps)) if fps > 0 and sample_fps > 0 else 1
+        index = sampled = 0
+        while sampled < max_frames:
+            # grab() only demuxes and decodes; retrieve() converts to pixels
+            if not capture.grab():
+                break
+            if index % step == 0:
+                ok, frame = capture.retrieve()
+                if ok:
+                    frame = cv2.resize(frame, input_size[::-1], interpolation=cv2.INTER_AREA)
+                    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                    yield index, round(index / fps, 3) if fps > 0 else None, image
+                    sampled += 1
+            index += 1
+    finally:
+        capture.release()
+
+
+def decode_image_frames(images: Sequence[bytes], input_size: Tuple[int, int]) -> Iterator[Frame]:
+    """Decode uploaded images in order, letting JPEGs scale down while decoding."""
+    for index, contents in enumerate(images):
+        yield index, None, load_rgb(open_image(contents), target_size=input_size[::-1])
+
+
+def frame_signature(img: Image.Image) -> np.ndarray:
+    return np.asarray(img.convert("L").resize(SIGNATURE_SIZE, Image.BILINEAR), dtype=np.float32)
+
+
+class FrameDeduplicator:
+    """Flags frames nearly identical to the last frame kept."""
+
+    def __init__(self, threshold: float = VIDEO_DEDUP_THRESHOLD):
+        self.threshold = threshold
+        self.last_index = None
+        self._last = None
+
+    def is_duplicate(self, index: int, img: Image.Image) -> bool:
+        if self.threshold <= 0:
+            return False
+        signature = frame_signature(img)
+        if self._last is not None and float(np.abs(signature - self._last).mean()) < self.threshold:
+            return True
+        self._last = signature
+        self.last_index = index
+        return False
+
+
+class ClipSummary:
+    """Aggregates per-frame predictions into a per-clip result."""
+
+    def __init__(self):
+        self.sampled = 0
+        self.skipped = Counter()  # reason -> frames
+        self.frames = Counter()  # class_name -> confident frames
+        self.confidence = defaultdict(float)  # class_name -> summed confidence
+        self.first_seen = {}  # class_name -> first frame timestamp (or index)
+
+    def skip(self, reason: str):
+        self.sampled += 1
+        self.skipped[reason] += 1
+
+    def add(self, record: dict):
+        self.sampled += 1
+        if record["status"] != "analyzed":
+            self.skipped[record["status"]] += 1
+            return
+        name = record["class_name"]
+        self.frames[name] += 1
+        self.confidence[name] += record["confidence"]
+        position = record["timestamp"] if record["timestamp"] is not None else record["index"]
+        self.first_seen.setdefault(name, position)
+
+    def to_dict(self) -> dict:
+        analyzed = sum(self.frames.values())
+        classes, dominant = inference.summarize_classes(self.frames, self.confidence, unit="frames")
+        for entry in classes:
+            entry["first_seen"] = self.first_seen[entry["class_name"]]
+        affected = sum(entry["frames"] for entry in classes if not entry["is_healthy"])
+        return {
+            "frames_sampled": self.sampled,
+            "frames_analyzed": analyzed,
+            "frames_skipped": dict(self.skipped),
+            "frames_affected": affected,
+            "affected_fraction": round(affected / analyzed, 4) if analyzed else 0.0,
+            "dominant": dominant,
+            "classes": classes,
+        }
+
+
+def prefetch(frames: Iterable[Frame], depth: int) -> Iterator[Frame]:
+    """Decode frames in a background thread, up to `depth` ahead of the consumer."""
+    buffer = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+    done = object()
+
+    def produce():
+        try:
+            for frame in frames:
+                while not stopped.is_set():
+                    try:
+                        buffer.put(frame, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stopped.is_set():
+                    return
+            buffer.put(done)
+        except BaseException as e:
+            buffer.put(e)
+
+    threading.Thread(target=produce, name="frame-decoder", daemon=True).start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # The consumer stopped early (e.g. the client disconnected)
+        stopped.set()
+
+
+def scan_frames(frames: Iterable[Frame], predict: Callable[[List[Image.Image]], List[dict]],
+                batch_size: int = VIDEO_BATCH_SIZE,
+                dedup_threshold: float = VIDEO_DEDUP_THRESHOLD) -> Iterator[dict]:
+    """
+    Classify frames in batches, skipping duplicates and non-leaf frames.
+    Yields a "frames" event per batch and a final "summary" event.
+    """
+    summary = ClipSummary()
+    dedup = FrameDeduplicator(dedup_threshold)
+    pending = []  # (record, image) waiting for the next batch
+    skipped = []  # Records of frames skipped since the last event
+
+    def flush() -> dict:
+        if pending:
+            with tracing.span("inference.batch", frames=len(pending)):
+                predictions = predict([img for _, img in pending])
+        else:
+            predictions = []
+        for (record, _), prediction in zip(pending, predictions):
+            info = inference.parse_disease_class(prediction["class_name"])
+            record.update(
+                status="analyzed" if prediction["confidence"] >= MIN_FRAME_CONFIDENCE else "low_confidence",
+                class_name=prediction["class_name"],
+                crop=info["crop"],
+                disease=info["disease"],
+                is_healthy=info["is_healthy"],
+                confidence=round(prediction["confidence"], 4),
+            )
+            summary.add(record)
+        records = sorted([record for record, _ in pending] + skipped, key=lambda r: r["index"])
+        pending.clear()
+        skipped.clear()
+        return {"type": "frames", "frames": records, "summary": summary.to_dict()}
+
+    for index, timestamp, img in prefetch(frames, depth=PREFETCH_BATCHES * batch_size):
+        record = {"index": index, "timestamp": timestamp}
+        if dedup.is_duplicate(index, img):
+            skipped.append({**record, "status": "duplicate", "duplicate_of": dedup.last_index})
+            summary.skip("duplicate")
+        elif not is_probable_leaf(img):
+            skipped.append({**record, "status": "not_leaf"})
+            summary.skip("not_leaf")
+        else:
+            pending.append((record, img))
+        if len(pending) >= batch_size:
+            yield flush()
+    if pending or skipped:
+        yield flush()
+    yield {"type": "summary", **summary.to_dict()}
@@ -0,0 +1,182 @@
+"""
+Shared client for the AgriMind.AI backend API and Firestore history.
+
+All pages go through one pooled HTTP session (cached across Streamlit reruns
+and sessions) with timeouts and retries, and images are downscaled to the
+backend's model input size before upload. The Firestore client is likewise
+created once per server and history queries are cached for a short TTL.
+"""
+import io
+
+import requests
+import streamlit as st
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    API_ENDPOINTS,
+    DEFAULT_MODEL_INPUT_SIZE,
+    ENRICHMENT_MAX_POLLS,
+    ENRICHMENT_WAIT_SECONDS,
+    FIREBASE_CREDENTIALS_PATH,
+    HISTORY_CACHE_TTL,
+    MAX_RETRIES,
+    MODEL_INFO_CACHE_TTL,
+    REQUEST_TIMEOUT,
+    RETRY_BACKOFF_FACTOR,
+    UPLOAD_JPEG_QUALITY,
+)
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """Create one pooled session shared by every page and user."""
+    # Connection errors are retried for any method: the request never reached
+    # the backend. Read errors and 502/503/504 are retried only for idempotent
+    # methods, so a POST (a saved recommendation, a chat) is never sent twice
+    retry = Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,
+        status=MAX_RETRIES,
+        status_forcelist=[502, 503, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_data(ttl=MODEL_INFO_CACHE_TTL, show_spinner=False)
+def get_model_input_size() -> tuple:
+    """Return the disease model's (height, width) as reported by the backend."""
+    try:
+        response = get_session().get(API_ENDPOINTS["model_info"], timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            height, width = response.json()["disease_input_size"]
+            return int(height), int(width)
+    except (requests.exceptions.RequestException, KeyError, ValueError):
+        pass
+    return DEFAULT_MODEL_INPUT_SIZE
+
+
+def prepare_image(image_bytes: bytes) -> bytes:
+    """
+    Downscale an image so its shorter side matches the model input and
+    re-encode it as JPEG. The backend resizes to the model input anyway, so
+    sending more pixels than that only costs upload time.
+    """
+    height, width = get_model_input_size()
+    target = max(height, width)
+
+    img = Image.open(io.BytesIO(image_bytes))
+    # Let the JPEG decoder do most of the downscaling
+    img.draft("RGB", (target, target))
+    img = img.convert("RGB")
+
+    scale = target / min(img.size)
+    if scale < 1:
+        new_size = (max(target, round(img.width * scale)), max(target, round(img.height * scale)))
+        img = img.resize(new_size, Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=UPLOAD_JPEG_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def detect_disease(image_bytes: bytes, user_id: str, language: str = "en") -> requests.Response:
+    files = {"file": ("image.jpg", prepare_image(image_bytes), "image/jpeg")}
+    return get_session().post(
+        API_ENDPOINTS["detect_disease"],
+        files=files,
+        params={"user_id": user_id, "language": language},
+        headers={"X-User-Id": user_id},
+        timeout=REQUEST_TIMEOUT
+    )
+
+
+def recommend_crop(request_data: dict) -> requests.Response:
+    return get_session().post(
+        API_ENDPOINTS["recommend_crop"],
+        json=request_data,
+        # The backend queues requests fairly per user under load
+        headers={"X-User-Id": request_data.get("user_id", "")},
+        timeout=REQUEST_TIMEOUT
+    )
+
+
+def chat(message: str, user_id: str, language: str = "en") -> requests.Response:
+    return get_session().post(
+        API_ENDPOINTS["chat"],
+        json={
+            "message": message,
+            "user_id": user_id,
+            "language": language
+        },
+        headers={"X-User-Id": user_id},
+        timeout=REQUEST_TIMEOUT
+    )
+
+
+def wait_for_enrichment(enrichment_id: str):
+    """
+    Long-poll the backend for LLM advice generated in the background.
+    Returns the enrichment result dict, or None if it isn't ready in time.
+    """
+    url = f"{API_ENDPOINTS['enrichments']}/{enrichment_id}"
+    read_timeout = ENRICHMENT_WAIT_SECONDS + REQUEST_TIMEOUT[0]
+    for _ in range(ENRICHMENT_MAX_POLLS):
+        try:
+            response = get_session().get(
+                url,
+                params={"wait": ENRICHMENT_WAIT_SECONDS},
+                timeout=(REQUEST_TIMEOUT[0], read_timeout)
+            )
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        record = response.json()
+        if record["status"] == "ready":
+            return record["result"]
+        if record["status"] == "failed":
+            return None
+    return None
+
+
+@st.cache_resource
+def get_firestore_client():
+    """Initialize Firebase once per server; returns None if it isn't configured."""
+    try:
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        if not firebase_admin._apps:
+            cred = credentials.Certificate(FIREBASE_CREDENTIALS_PATH)
+            firebase_admin.initialize_app(cred)
+        return firestore.client()
+    except Exception:
+        return None
+
+
+@st.cache_data(ttl=HISTORY_CACHE_TTL, show_spinner=False)
+def fetch_history(user_id: str, collection: str, limit: int, refresh: int = 0) -> list:
+    """
+    Return a user's most recent documents from a Firestore collection.
+    `refresh` is only part of the cache key: pass a new value to refetch.
+    """
+    from firebase_admin import firestore
+
+    db = get_firestore_client()
+    if db is None:
+        raise RuntimeError("Firebase is not configured")
+
+    docs = db.collection("farmers").document(user_id).collection(collection)\
+        .order_by("timestamp", direction=firestore.Query.DESCENDING).limit(limit).stream()
+    return [doc.to_dict() for doc in docs]
@@ -1,7 +1,7 @@
 import streamlit as st
-import requests
 from PIL import Image
-import io
+
+import api_client
 
 # Configure page
 st.set_page_config(
@@ -43,20 +43,24 @@ if page == "Crop Recommendation":
     st.header("🌾 Crop Recommendation")
     st.write("Enter your soil and environmental parameters to get crop recommendations.")
     
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        nitrogen = st.number_input("Nitrogen (N) mg/kg", 0, 140, 50)
-        phosphorus = st.number_input("Phosphorus (P) mg/kg", 0, 140, 50)
-        potassium = st.number_input("Potassium (K) mg/kg", 0, 200, 50)
-        temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0)
+    # Inputs in a form only rerun the script when the form is submitted
+    with st.form("crop_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            nitrogen = st.number_input("Nitrogen (N) mg/kg", 0, 140, 50)
+            phosphorus = st.number_input("Phosphorus (P) mg/kg", 0, 140, 50)
+            potassium = st.number_input("Potassium (K) mg/kg", 0, 200, 50)
+            temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0)
+            
+        with col2:
+            humidity = st.number_input("Humidity (%)", 0.0, 100.0, 50.0)
+            ph = st.number_input("pH", 0.0, 14.0, 7.0)
+            rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0)
         
-    with col2:
-        humidity = st.number_input("Humidity (%)", 0.0, 100.0, 50.0)
-        ph = st.number_input("pH", 0.0, 14.0, 7.0)
-        rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0)
+        submitted = st.form_submit_button("Get Recommendation")
     
-    if st.button("Get Recommendation"):
+    if submitted:
         with st.spinner("Analyzing your soil parameters..."):
             try:
                 # Debug: Print the request data
@@ -67,14 +71,12 @@ if page == "Crop Recommendation":
                     "temperature": temperature,
                     "humidity": humidity,
                     "ph": ph,
-                    "rainfall": rainfall
+                    "rainfall": rainfall,
+                    "user_id": "demo_user"
                 }
                 st.write("Sending request:", request_data)
                 
-                response = requests.post(
-                    "http://localhost:8000/recommend_crop",
-                    json=request_data
-                )
+                response = api_client.recommend_crop(request_data)
                 
                 # Debug: Print raw response
                 st.write("Response status:", response.status_code)
@@ -101,20 +103,18 @@ elif page == "Disease Detection":
     st.header("🔍 Plant Disease Detection")
     st.write("Upload a photo of your plant's leaves for disease detection.")
     
-    uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
+    with st.form("disease_form"):
+        uploaded_file = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"])
+        submitted = st.form_submit_button("Detect Disease")
     
     if uploaded_file is not None:
         image = Image.open(uploaded_file)
         st.image(image, caption="Uploaded Image", use_column_width=True)
         
-        if st.button("Detect Disease"):
+        if submitted:
             with st.spinner("Analyzing image..."):
                 try:
-                    files = {"file": ("image.jpg", uploaded_file.getvalue(), "image/jpeg")}
-                    response = requests.post(
-                        "http://localhost:8000/detect_disease",
-                        files=files
-                    )
+                    response = api_client.detect_disease(uploaded_file.getvalue(), user_id="demo_user")
                     
                     if response.status_code == 200:
                         result = response.json()
@@ -19,4 +19,26 @@ API_ENDPOINTS = {
     "detect_disease": f"{BACKEND_URL}/detect_disease",
     "recommend_crop": f"{BACKEND_URL}/recommend_crop",
     "chat": f"{BACKEND_URL}/chat",
+    "model_info": f"{BACKEND_URL}/model_info",
+    "enrichments": f"{BACKEND_URL}/enrichments",
 }
+
+# HTTP client settings: (connect, read) timeouts in seconds and retry policy
+REQUEST_TIMEOUT = (5, 60)
+MAX_RETRIES = 3
+RETRY_BACKOFF_FACTOR = 0.5
+
+# How long to wait for background LLM advice after the instant answer
+ENRICHMENT_WAIT_SECONDS = 25
+ENRICHMENT_MAX_POLLS = 2
+
+# Fallback when the backend's model input size can't be fetched
+DEFAULT_MODEL_INPUT_SIZE = (224, 224)
+UPLOAD_JPEG_QUALITY = 90
+
+# Firebase credentials used by the dashboard's history view
+FIREBASE_CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS_PATH", "../backend/firebase-config.json")
+
+# Cache lifetimes in seconds
+HISTORY_CACHE_TTL = 60
+MODEL_INFO_CACHE_TTL = 600
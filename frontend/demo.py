@@ -1,23 +1,11 @@
 import streamlit as st
-import requests
-import json
-import pandas as pd
 from PIL import Image
-import io
-import os
 import time
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime
 
-# Initialize Firebase if not already initialized
-if not firebase_admin._apps:
-    cred = credentials.Certificate("../backend/firebase-config.json")
-    firebase_admin.initialize_app(cred)
-db = firestore.client()
+import api_client
+from config import HISTORY_CACHE_TTL
 
 # Constants
-API_URL = "http://localhost:8000"
 SUPPORTED_LANGUAGES = {
     "English": "en",
     "Telugu": "te",
@@ -58,6 +46,8 @@ if 'user_id' not in st.session_state:
     st.session_state.user_id = str(int(time.time()))  # Simple user ID generation
 if 'language' not in st.session_state:
     st.session_state.language = "en"
+if 'history_refresh' not in st.session_state:
+    st.session_state.history_refresh = 0
 
 # Sidebar
 with st.sidebar:
@@ -82,36 +72,37 @@ with st.sidebar:
 if page == "Crop Recommendation":
     st.header("🌱 Crop Recommendation")
     
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        n = st.number_input("Nitrogen (N)", 0, 140, 50)
-        p = st.number_input("Phosphorus (P)", 0, 140, 50)
-        k = st.number_input("Potassium (K)", 0, 200, 50)
-        ph = st.number_input("pH", 0.0, 14.0, 6.5)
+    # Inputs in a form only rerun the script when the form is submitted
+    with st.form("crop_form"):
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            n = st.number_input("Nitrogen (N)", 0, 140, 50)
+            p = st.number_input("Phosphorus (P)", 0, 140, 50)
+            k = st.number_input("Potassium (K)", 0, 200, 50)
+            ph = st.number_input("pH", 0.0, 14.0, 6.5)
+            
+        with col2:
+            temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0)
+            humidity = st.number_input("Humidity (%)", 0.0, 100.0, 70.0)
+            rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0)
         
-    with col2:
-        temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0)
-        humidity = st.number_input("Humidity (%)", 0.0, 100.0, 70.0)
-        rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0)
+        submitted = st.form_submit_button("Get Recommendation")
     
-    if st.button("Get Recommendation"):
+    if submitted:
         with st.spinner("Analyzing soil and weather conditions..."):
             try:
-                response = requests.post(
-                    f"{API_URL}/recommend_crop",
-                    json={
-                        "N": n,
-                        "P": p,
-                        "K": k,
-                        "temperature": temperature,
-                        "humidity": humidity,
-                        "ph": ph,
-                        "rainfall": rainfall,
-                        "user_id": st.session_state.user_id,
-                        "language": st.session_state.language
-                    }
-                )
+                response = api_client.recommend_crop({
+                    "N": n,
+                    "P": p,
+                    "K": k,
+                    "temperature": temperature,
+                    "humidity": humidity,
+                    "ph": ph,
+                    "rainfall": rainfall,
+                    "user_id": st.session_state.user_id,
+                    "language": st.session_state.language
+                })
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -127,23 +118,21 @@ if page == "Crop Recommendation":
 elif page == "Disease Detection":
     st.header("🔍 Plant Disease Detection")
     
-    uploaded_file = st.file_uploader("Upload a leaf image", type=["jpg", "jpeg", "png"])
+    with st.form("disease_form"):
+        uploaded_file = st.file_uploader("Upload a leaf image", type=["jpg", "jpeg", "png"])
+        submitted = st.form_submit_button("Detect Disease")
     
     if uploaded_file:
         image = Image.open(uploaded_file)
         st.image(image, caption="Uploaded Image", use_column_width=True)
         
-        if st.button("Detect Disease"):
+        if submitted:
             with st.spinner("Analyzing image..."):
                 try:
-                    files = {"file": ("image.jpg", uploaded_file, "image/jpeg")}
-                    response = requests.post(
-                        f"{API_URL}/detect_disease",
-                        files=files,
-                        data={
-                            "user_id": st.session_state.user_id,
-                            "language": st.session_state.language
-                        }
+                    response = api_client.detect_disease(
+                        uploaded_file.getvalue(),
+                        user_id=st.session_state.user_id,
+                        language=st.session_state.language
                     )
                     
                     if response.status_code == 200:
@@ -178,13 +167,10 @@ elif page == "AI Chat":
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
                 try:
-                    response = requests.post(
-                        f"{API_URL}/chat",
-                        json={
-                            "message": prompt,
-                            "user_id": st.session_state.user_id,
-                            "language": st.session_state.language
-                        }
+                    response = api_client.chat(
+                        prompt,
+                        user_id=st.session_state.user_id,
+                        language=st.session_state.language
                     )
                     
                     if response.status_code == 200:
@@ -201,40 +187,44 @@ elif page == "AI Chat":
 
 elif page == "History":
     st.header("📚 Your History")
+    st.caption(f"History is refreshed every {HISTORY_CACHE_TTL} seconds.")
+    if st.button("🔄 Refresh"):
+        # A new cache key for this user only; fetch_history.clear() would drop every user's history
+        st.session_state.history_refresh += 1
     
-    # Get user's history from Firebase
+    # Get user's history from Firebase (cached per user for a short TTL)
     try:
         # Get crop recommendations
-        recommendations = db.collection("farmers").document(st.session_state.user_id)\
-            .collection("recommendations").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5).stream()
+        recommendations = api_client.fetch_history(
+            st.session_state.user_id, "recommendations", 5, st.session_state.history_refresh
+        )
         
         st.subheader("Recent Crop Recommendations")
-        for rec in recommendations:
-            data = rec.to_dict()
+        for data in recommendations:
             with st.expander(f"Recommendation from {data['timestamp'].strftime('%Y-%m-%d %H:%M')}"):
                 st.write(f"**Recommended Crop:** {data['crop']}")
                 st.write("**Advice:**")
                 st.write(data['advice'])
         
         # Get disease detections
-        detections = db.collection("farmers").document(st.session_state.user_id)\
-            .collection("disease_detections").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(5).stream()
+        detections = api_client.fetch_history(
+            st.session_state.user_id, "disease_detections", 5, st.session_state.history_refresh
+        )
         
         st.subheader("Recent Disease Detections")
-        for det in detections:
-            data = det.to_dict()
+        for data in detections:
             with st.expander(f"Detection from {data['timestamp'].strftime('%Y-%m-%d %H:%M')}"):
                 st.write(f"**Confidence:** {data['confidence']*100:.1f}%")
                 st.write("**Analysis & Treatment:**")
                 st.write(data['advice'])
         
         # Get chat history
-        chats = db.collection("farmers").document(st.session_state.user_id)\
-            .collection("chats").order_by("timestamp", direction=firestore.Query.DESCENDING).limit(10).stream()
+        chats = api_client.fetch_history(
+            st.session_state.user_id, "chats", 10, st.session_state.history_refresh
+        )
         
         st.subheader("Recent Chats")
-        for chat in chats:
-            data = chat.to_dict()
+        for data in chats:
             with st.expander(f"Chat from {data['timestamp'].strftime('%Y-%m-%d %H:%M')}"):
                 st.write("**Question:**")
                 st.write(data['question'])
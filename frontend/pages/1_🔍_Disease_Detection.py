@@ -8,6 +8,7 @@ import os
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import API_ENDPOINTS
+import api_client
 
 st.set_page_config(page_title="Disease Detection - AgriMind.AI", page_icon="🔍")
 
@@ -29,12 +30,11 @@ if uploaded_file is not None:
     if st.button("Detect Disease"):
         with st.spinner("Analyzing image..."):
             try:
-                # Prepare the file for upload
-                files = {"file": ("image.jpg", uploaded_file.getvalue(), "image/jpeg")}
-                response = requests.post(
-                    API_ENDPOINTS["detect_disease"],
-                    files=files,
-                    data={"user_id": "demo_user", "language": language}
+                # Downscaled to the model input size before upload
+                response = api_client.detect_disease(
+                    uploaded_file.getvalue(),
+                    user_id="demo_user",
+                    language=language
                 )
                 
                 if response.status_code == 200:
@@ -68,7 +68,16 @@ if uploaded_file is not None:
                     
                     with col2:
                         st.info("### 💡 Treatment Advice")
-                        st.write(result.get('advice', 'No advice available'))
+                        advice_box = st.empty()
+                        advice_box.write(result.get('advice', 'No advice available'))
+                        
+                        # The instant answer carries rule-based advice; swap in
+                        # the detailed LLM advice once it is ready
+                        if result.get('enrichment_id'):
+                            with st.spinner("Generating detailed advice..."):
+                                enriched = api_client.wait_for_enrichment(result['enrichment_id'])
+                            if enriched:
+                                advice_box.write(enriched['advice'])
                     
                     # Additional information in expandable sections
                     with st.expander("📋 General Prevention Tips"):
@@ -108,6 +117,8 @@ if uploaded_file is not None:
                 else:
                     st.error("Failed to analyze image. Please try again.")
                     
+            except requests.exceptions.Timeout:
+                st.error("⏱️ The server took too long to respond. Please try again.")
             except requests.exceptions.ConnectionError:
                 st.error("❌ Cannot connect to the server!")
                 st.info(f"Please make sure the backend server is running. Backend URL: {API_ENDPOINTS['detect_disease']}")
@@ -1,11 +1,11 @@
 import streamlit as st
-import requests
 import sys
 import os
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import API_ENDPOINTS
+import api_client
 
 st.set_page_config(page_title="Crop Recommendation - AgriMind.AI", page_icon="🌾")
 
@@ -15,27 +15,31 @@ Get personalized crop recommendations based on your soil parameters and environm
 Our AI analyzes multiple factors to suggest the best crop for your field.
 """)
 
-# Create two columns for input fields
-col1, col2 = st.columns(2)
+# Inputs in a form only rerun the script when the form is submitted
+with st.form("crop_form"):
+    # Create two columns for input fields
+    col1, col2 = st.columns(2)
 
-with col1:
-    st.subheader("Soil Parameters")
-    nitrogen = st.number_input("Nitrogen (N) mg/kg", 0, 140, 50, help="Amount of nitrogen in soil")
-    phosphorus = st.number_input("Phosphorus (P) mg/kg", 0, 140, 50, help="Amount of phosphorus in soil")
-    potassium = st.number_input("Potassium (K) mg/kg", 0, 200, 50, help="Amount of potassium in soil")
-    ph = st.number_input("pH level", 0.0, 14.0, 7.0, help="Soil pH level")
+    with col1:
+        st.subheader("Soil Parameters")
+        nitrogen = st.number_input("Nitrogen (N) mg/kg", 0, 140, 50, help="Amount of nitrogen in soil")
+        phosphorus = st.number_input("Phosphorus (P) mg/kg", 0, 140, 50, help="Amount of phosphorus in soil")
+        potassium = st.number_input("Potassium (K) mg/kg", 0, 200, 50, help="Amount of potassium in soil")
+        ph = st.number_input("pH level", 0.0, 14.0, 7.0, help="Soil pH level")
 
-with col2:
-    st.subheader("Environmental Conditions")
-    temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0, help="Average temperature")
-    humidity = st.number_input("Humidity (%)", 0.0, 100.0, 50.0, help="Average humidity")
-    rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0, help="Annual rainfall")
-    language = st.selectbox("Select Language", ["en", "hi", "te"], index=0)
+    with col2:
+        st.subheader("Environmental Conditions")
+        temperature = st.number_input("Temperature (°C)", 0.0, 50.0, 25.0, help="Average temperature")
+        humidity = st.number_input("Humidity (%)", 0.0, 100.0, 50.0, help="Average humidity")
+        rainfall = st.number_input("Rainfall (mm)", 0.0, 300.0, 100.0, help="Annual rainfall")
+        language = st.selectbox("Select Language", ["en", "hi", "te"], index=0)
 
-# Add some spacing
-st.write("")
+    # Add some spacing
+    st.write("")
 
-if st.button("Get Recommendation"):
+    submitted = st.form_submit_button("Get Recommendation")
+
+if submitted:
     with st.spinner("Analyzing your parameters..."):
         try:
             # Prepare request data
@@ -54,10 +58,7 @@ if st.button("Get Recommendation"):
             # Debug: Show request data
             st.write("Sending request with data:", request_data)
             
-            response = requests.post(
-                API_ENDPOINTS["recommend_crop"],
-                json=request_data
-            )
+            response = api_client.recommend_crop(request_data)
             
             # Debug: Show raw response
             st.write("Response status code:", response.status_code)
@@ -75,7 +76,16 @@ if st.button("Get Recommendation"):
                     
                     # Display advice in an expander
                     with st.expander("View Detailed Farming Advice", expanded=True):
-                        st.write(result['advice'])
+                        advice_box = st.empty()
+                        advice_box.write(result['advice'])
+                        
+                        # The instant answer carries rule-based advice; swap in
+                        # the detailed LLM advice once it is ready
+                        if result.get('enrichment_id'):
+                            with st.spinner("Generating detailed advice..."):
+                                enriched = api_client.wait_for_enrichment(result['enrichment_id'])
+                            if enriched:
+                                advice_box.write(enriched['advice'])
                     
                     # Display parameter summary
                     with st.expander("Your Input Parameters"):
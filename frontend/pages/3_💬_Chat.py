@@ -1,11 +1,11 @@
 import streamlit as st
-import requests
 import sys
 import os
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import API_ENDPOINTS
+import api_client
 
 st.set_page_config(page_title="Chat - AgriMind.AI", page_icon="💬")
 
@@ -42,14 +42,7 @@ if prompt := st.chat_input("Ask your farming question..."):
     with st.chat_message("assistant"):
         with st.spinner("Thinking..."):
             try:
-                response = requests.post(
-                    API_ENDPOINTS["chat"],
-                    json={
-                        "message": prompt,
-                        "user_id": "demo_user",
-                        "language": language
-                    }
-                )
+                response = api_client.chat(prompt, user_id="demo_user", language=language)
                 
                 if response.status_code == 200:
                     result = response.json()